@@ -1,15 +1,43 @@
+import dataclasses
+
+import aiohttp
 from starlette import requests as requests_
 
 from app import services
 
 
-async def get_image_processor(requests: requests_.Request) -> services.ImageProcessor:
-    return requests.app.state.image_processor
+@dataclasses.dataclass
+class CertificateServices:
+    """The shared clients and caches used to render and upload e-Certificates."""
+
+    http_client: aiohttp.ClientSession
+    asset_cache: services.AssetCache
+    image_processor: services.ImageProcessor
+    gdrive_client: services.GoogleDriveClient
+    result_cache: services.RenderResultCache
+    template_variants: services.TemplateVariantIndex
+
+
+async def get_certificate_coalescer(
+    requests: requests_.Request,
+) -> services.RequestCoalescer:
+    return requests.app.state.certificate_coalescer
+
 
+async def get_certificate_job_runner(
+    requests: requests_.Request,
+) -> services.CertificateJobRunner:
+    return requests.app.state.certificate_job_runner
 
-async def get_imagekit_client(requests: requests_.Request) -> services.ImageKitClient:
-    return requests.app.state.imagekit_client
 
+async def get_certificate_services(requests: requests_.Request) -> CertificateServices:
+    state = requests.app.state
 
-async def get_gdrive_client(requests: requests_.Request) -> services.GoogleDriveClient:
-    return requests.app.state.gdrive
+    return CertificateServices(
+        http_client=state.http_client,
+        asset_cache=state.asset_cache,
+        image_processor=state.image_processor,
+        gdrive_client=state.gdrive,
+        result_cache=state.render_result_cache,
+        template_variants=state.template_variant_index,
+    )
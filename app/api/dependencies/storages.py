@@ -20,6 +20,10 @@ async def get_storj_s3_client(
     return requests.app.state.storj_client_session
 
 
+async def get_storage_router(requests: requests_.Request) -> services.StorageRouter:
+    return requests.app.state.storage_router
+
+
 async def get_http_client(requests: requests_.Request) -> aiohttp.ClientSession:
     return requests.app.state.http_client
 
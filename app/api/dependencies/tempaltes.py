@@ -1,7 +1,24 @@
+import dataclasses
+
 from starlette import requests as requests_
 
 from app import services
 
 
-def get_imagekit_client(requests: requests_.Request) -> services.ImageKitClient:
-    return requests.app.state.imagekit_client
+@dataclasses.dataclass
+class TemplateServices:
+    """The shared clients used to check, store and pre-scale uploaded templates."""
+
+    imagekit_client: services.ImageKitClient
+    image_processor: services.ImageProcessor
+    variant_index: services.TemplateVariantIndex
+
+
+def get_template_services(requests: requests_.Request) -> TemplateServices:
+    state = requests.app.state
+
+    return TemplateServices(
+        imagekit_client=state.imagekit_client,
+        image_processor=state.image_processor,
+        variant_index=state.template_variant_index,
+    )
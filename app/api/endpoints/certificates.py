@@ -1,8 +1,9 @@
 import asyncio
+import contextlib
 import io
+import typing
 import uuid
 
-import aiohttp
 import fastapi
 import PIL
 from fastapi import responses
@@ -14,23 +15,45 @@ router = fastapi.APIRouter(prefix="/certificates")
 
 
 async def _upload_ecertificates(
-    gdrive_client: services.GoogleDriveClient, ecerts: list[io.BytesIO]
+    gdrive_client: services.GoogleDriveClient,
+    ecerts: typing.AsyncIterable[tuple[int, bytes]],
+    on_uploaded: (
+        typing.Callable[[int, tuple[str, str]], typing.Awaitable[None]] | None
+    ) = None,
+    file_extension: str = "",
 ) -> list[tuple[str, str]]:
-    responses_: list[tuple[str, str]] = []
-    loop = asyncio.get_running_loop()
+    # Wait for the first e-Certificate so that a broken template doesn't leave an
+    # empty folder behind; the rest of the batch keeps rendering in the meantime.
+    try:
+        first_ecert = await anext(aiter(ecerts))
+    except StopAsyncIteration:
+        return []
+
+    # The folder is shared once; its e-Certificates inherit the permission instead
+    # of each needing a request of its own.
     gdrive_folder = await gdrive_client.create_folder(
-        loop=loop, folder_name=str(uuid.uuid4())
+        folder_name=str(uuid.uuid4()), share=True
     )
     gdrive_folder_id: str = gdrive_folder["id"]
 
-    for ecert in ecerts:
-        response = await gdrive_client.upload_file(
-            loop=loop,
-            file=ecert,
-            file_name=str(uuid.uuid1()),
-            folder_id=gdrive_folder_id,
+    async def ecert_files() -> typing.AsyncIterator[tuple[int, tuple[io.BytesIO, str]]]:
+        # The extension lets Drive tell the file's MIME type.
+        yield first_ecert[0], (
+            io.BytesIO(first_ecert[1]),
+            f"{uuid.uuid1()}{file_extension}",
         )
-        responses_.append(response)
+
+        async for index, ecert in ecerts:
+            yield index, (io.BytesIO(ecert), f"{uuid.uuid1()}{file_extension}")
+
+    # Each e-Certificate is uploaded as soon as it is rendered and dropped once its
+    # upload is done, so the batch is never held in memory all at once.
+    responses_ = await gdrive_client.upload_files_as_ready(
+        files_=ecert_files(),
+        folder_id=gdrive_folder_id,
+        share=False,
+        on_uploaded=on_uploaded,
+    )
 
     # This is the code we will use if we want to store the generated e-Certificates to
     # ImageKit.io instead:
@@ -46,84 +69,265 @@ async def _upload_ecertificates(
     return responses_
 
 
-async def _generate_ecertificate(
-    http_client: aiohttp.ClientSession,
+async def _load_certificate_meta(
+    services_: certificates.CertificateServices,
     certificate_template_meta: models.CertificateTemplateMeta,
-    image_processor: services.ImageProcessor,
-    gdrive_client: services.GoogleDriveClient,
-) -> list[dict[str, str]]:
-    # These assertions are purely for pyright to be able to understand the code; the
-    # validators should have already checked the values.
+) -> models.CertificateMeta:
+    template_url = certificate_template_meta.template_url
+    template_height = certificate_template_meta.recipient_name_meta.template_height
+
+    # Templates uploaded through /templates have render-ready variants; rendering
+    # from the matching one skips converting and resizing the original.
+    if variant := services.select_template_variant(
+        await services_.template_variants.get(template_url), template_height
+    ):
+        template_url, template_height = variant.url, None
 
-    name_font_src = await http_client.get(
-        certificate_template_meta.recipient_name_meta.font_url
+    layer_font_urls = list(
+        dict.fromkeys(layer.font_url for layer in certificate_template_meta.text_layers)
     )
-    template_src = await http_client.get(certificate_template_meta.template_url)
 
-    certificate_meta = models.CertificateMeta(
+    try:
+        name_font_src, template_src, *layer_font_srcs = await asyncio.gather(
+            services_.asset_cache.get(
+                services_.http_client,
+                certificate_template_meta.recipient_name_meta.font_url,
+                content_types=services.FONT_CONTENT_TYPES,
+            ),
+            services_.asset_cache.get(
+                services_.http_client,
+                template_url,
+                content_types=services.TEMPLATE_CONTENT_TYPES,
+            ),
+            *(
+                services_.asset_cache.get(
+                    services_.http_client,
+                    font_url,
+                    content_types=services.FONT_CONTENT_TYPES,
+                )
+                for font_url in layer_font_urls
+            ),
+        )
+    except services.AssetFetchError as fetch_err:
+        raise fastapi.HTTPException(
+            status_code=fetch_err.status_code,
+            detail=str(fetch_err),
+        ) from fetch_err
+
+    layer_fonts = dict(zip(layer_font_urls, layer_font_srcs))
+
+    return models.CertificateMeta(
         font_color="black",
-        template=await template_src.read(),
-        name_font_style=await name_font_src.read(),
-        template_height=certificate_template_meta.recipient_name_meta.template_height,
+        template=template_src.data,
+        name_font_style=name_font_src.data,
+        template_height=template_height,
+        template_digest=template_src.digest,
+        name_font_digest=name_font_src.digest,
+        name_max_width=certificate_template_meta.recipient_name_meta.max_width,
+        name_max_height=certificate_template_meta.recipient_name_meta.max_height,
+        text_layers=[
+            models.CertificateTextLayer(
+                text=layer.text,
+                text_position=(layer.position["x"], layer.position["y"]),
+                text_size=layer.font_size,
+                font_style=layer_fonts[layer.font_url].data,
+                font_color=layer.font_color,
+                static=layer.static,
+                font_digest=layer_fonts[layer.font_url].digest,
+            )
+            for layer in certificate_template_meta.text_layers
+        ],
+        output=certificate_template_meta.output,
     )
 
-    certificate_recipients: list[models.CertificateRecipient] = [
+
+def _make_certificate_recipients(
+    certificate_template_meta: models.CertificateTemplateMeta,
+) -> list[models.CertificateRecipient]:
+    recipient_name_meta = certificate_template_meta.recipient_name_meta
+
+    return [
         models.CertificateRecipient(
             recipient_name=name.recipient_name,
             text_position=(
-                certificate_template_meta.recipient_name_meta.position["x"],
-                certificate_template_meta.recipient_name_meta.position["y"],
+                recipient_name_meta.position["x"],
+                recipient_name_meta.position["y"],
             ),
-            text_size=certificate_template_meta.recipient_name_meta.font_size,
+            text_size=recipient_name_meta.font_size,
+            fields=name.fields,
         )
         for name in certificate_template_meta.recipients
     ]
 
+
+def _ecertificate_result(
+    ecert: tuple[str, str], recipient: models.CertificateRecipient
+) -> dict[str, str]:
+    return {
+        "certificate_url": ecert[0],
+        "file_id": ecert[1],
+        "recipient_name": recipient.recipient_name,
+    }
+
+
+async def _generate_ecertificate(
+    services_: certificates.CertificateServices,
+    certificate_template_meta: models.CertificateTemplateMeta,
+    on_generated: (
+        typing.Callable[[int, dict[str, str]], typing.Awaitable[None]] | None
+    ) = None,
+) -> list[dict[str, str]]:
+    certificate_meta = await _load_certificate_meta(
+        services_, certificate_template_meta
+    )
+    certificate_recipients = _make_certificate_recipients(certificate_template_meta)
+
+    # e-Certificates that an earlier, e.g. retried, request already produced are
+    # reused instead of being rendered and uploaded again.
+    cache_keys = [
+        services.RenderResultCache.make_key(certificate_meta, recipient)
+        for recipient in certificate_recipients
+    ]
+    ecerts_loc: list[tuple[str, str] | None] = [
+        services_.result_cache.get(key) for key in cache_keys
+    ]
+    missing = [index for index, ecert in enumerate(ecerts_loc) if ecert is None]
+
+    async def on_uploaded(index: int, ecert: tuple[str, str]) -> None:
+        ecerts_loc[index] = ecert
+        services_.result_cache.put(cache_keys[index], ecert)
+
+        if on_generated is not None:
+            await on_generated(
+                index, _ecertificate_result(ecert, certificate_recipients[index])
+            )
+
+    for index, ecert in enumerate(ecerts_loc):
+        if ecert is not None:
+            await on_uploaded(index, ecert)
+
     try:
-        results = await image_processor.attach_text(
-            certificate_meta=certificate_meta,
-            certificate_recipients=certificate_recipients,
-        )
+        if missing:
+            async with contextlib.aclosing(
+                services_.image_processor.iter_attach_text(
+                    certificate_meta=certificate_meta,
+                    certificate_recipients=[
+                        certificate_recipients[index] for index in missing
+                    ],
+                )
+            ) as ecerts:
+                await _upload_ecertificates(
+                    gdrive_client=services_.gdrive_client,
+                    ecerts=ecerts,
+                    on_uploaded=lambda position, ecert: on_uploaded(
+                        missing[position], ecert
+                    ),
+                    file_extension=certificate_template_meta.output.format.extension,
+                )
     except PIL.UnidentifiedImageError as img_err:
         raise fastapi.HTTPException(
             status_code=400,
             detail=str(img_err),
         ) from img_err
 
-    ecerts_loc = await _upload_ecertificates(
-        gdrive_client=gdrive_client, ecerts=[io.BytesIO(result) for result in results]
-    )
-
     return [
-        {
-            "certificate_url": ecert[0],
-            "file_id": ecert[1],
-            "recipient_name": recipient.recipient_name,
-        }
+        _ecertificate_result(ecert, recipient)
         for ecert, recipient in zip(ecerts_loc, certificate_recipients)
+        if ecert is not None
     ]
 
 
 @router.post("")
 async def generate_ecertificate(
-    requests: fastapi.Request,
     certificate_template_meta: models.CertificateTemplateMeta,
-    image_processor: services.ImageProcessor = fastapi.Depends(
-        certificates.get_image_processor
+    services_: certificates.CertificateServices = fastapi.Depends(
+        certificates.get_certificate_services
     ),
-    gdrive_client: services.GoogleDriveClient = fastapi.Depends(
-        certificates.get_gdrive_client
+    coalescer: services.RequestCoalescer = fastapi.Depends(
+        certificates.get_certificate_coalescer
     ),
+    idempotency_key: str | None = fastapi.Header(None, alias="Idempotency-Key"),
 ) -> responses.ORJSONResponse:
-    http_client = requests.app.state.http_client
+    # Identical batches that arrive while one is running share its execution, and
+    # replays of an idempotency key get the response of its first request.
+    fingerprint = services.RequestCoalescer.fingerprint(
+        certificate_template_meta.json().encode()
+    )
+
+    try:
+        result = await coalescer.run(
+            key=f"key:{idempotency_key}" if idempotency_key else f"body:{fingerprint}",
+            fingerprint=fingerprint,
+            func=lambda: _generate_ecertificate(
+                services_=services_,
+                certificate_template_meta=certificate_template_meta,
+            ),
+            remember=bool(idempotency_key),
+        )
+    except services.IdempotencyKeyConflictError as key_err:
+        raise fastapi.HTTPException(status_code=422, detail=str(key_err)) from key_err
+
+    return responses.ORJSONResponse(content={"certificate": result}, status_code=201)
+
+
+@router.post("/jobs", status_code=202, response_class=responses.ORJSONResponse)
+async def submit_ecertificate_job(
+    certificate_template_meta: models.CertificateTemplateMeta,
+    services_: certificates.CertificateServices = fastapi.Depends(
+        certificates.get_certificate_services
+    ),
+    job_runner: services.CertificateJobRunner = fastapi.Depends(
+        certificates.get_certificate_job_runner
+    ),
+) -> dict[str, typing.Any]:
+    async def generate(job: models.CertificateJob) -> None:
+        async def on_generated(index: int, ecert: dict[str, str]) -> None:
+            job.results[index] = ecert
+            job.completed += 1
+            await job_runner.save_progress(job)
 
-    assert isinstance(http_client, aiohttp.ClientSession)
+        job.results = await _generate_ecertificate(
+            services_=services_,
+            certificate_template_meta=certificate_template_meta,
+            on_generated=on_generated,
+        )
+        job.completed = job.total
 
-    result = await _generate_ecertificate(
-        http_client=http_client,
-        certificate_template_meta=certificate_template_meta,
-        image_processor=image_processor,
-        gdrive_client=gdrive_client,
+    job = models.CertificateJob(
+        job_id=str(uuid.uuid4()), total=len(certificate_template_meta.recipients)
     )
 
-    return responses.ORJSONResponse(content={"certificate": result}, status_code=201)
+    try:
+        await job_runner.submit(job, generate)
+    except services.JobQueueFullError as queue_err:
+        raise fastapi.HTTPException(status_code=503, detail=str(queue_err)) from (
+            queue_err
+        )
+
+    return {"job_id": job.job_id, "status": job.status.value}
+
+
+@router.get("/jobs/{job_id}", response_class=responses.ORJSONResponse)
+async def get_ecertificate_job(
+    job_id: str,
+    job_runner: services.CertificateJobRunner = fastapi.Depends(
+        certificates.get_certificate_job_runner
+    ),
+) -> dict[str, typing.Any]:
+    if (job := await job_runner.store.get(job_id)) is None:
+        raise fastapi.HTTPException(status_code=404, detail="Job not found.")
+
+    return job.to_dict()
+
+
+@router.delete("/jobs/{job_id}", response_class=responses.ORJSONResponse)
+async def cancel_ecertificate_job(
+    job_id: str,
+    job_runner: services.CertificateJobRunner = fastapi.Depends(
+        certificates.get_certificate_job_runner
+    ),
+) -> dict[str, typing.Any]:
+    if (job := await job_runner.cancel(job_id)) is None:
+        raise fastapi.HTTPException(status_code=404, detail="Job not found.")
+
+    return job.to_dict()
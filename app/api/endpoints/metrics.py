@@ -0,0 +1,30 @@
+import fastapi
+from fastapi import responses
+
+from app import services
+from app.api.dependencies import certificates
+
+router = fastapi.APIRouter(prefix="/metrics")
+
+
+@router.get("", response_class=responses.PlainTextResponse)
+async def get_metrics(
+    job_runner: services.CertificateJobRunner = fastapi.Depends(
+        certificates.get_certificate_job_runner
+    ),
+) -> responses.PlainTextResponse:
+    """Expose the metrics of this process in the Prometheus text format.
+
+    Stages of e-Certificate generation are timed under
+    `certinize_stage_duration_seconds`: `asset_fetch`, `template_prepare`,
+    `render_queue` (waiting for a render worker), `template_load`, `draw` and
+    `encode`. Requests to Google Drive, S3, nft.storage and ImageKit, including
+    folder creation, uploads and permission grants, are counted and timed per
+    provider and operation. Each render worker reports the hits and misses of its
+    font cache back with every e-Certificate.
+    """
+    services.metrics.set("certinize_certificate_jobs_queued", job_runner.queued)
+
+    return responses.PlainTextResponse(
+        services.metrics.render(), media_type="text/plain; version=0.0.4"
+    )
@@ -1,68 +1,162 @@
+import os
 import typing
 
 import aiohttp
 import fastapi
 from fastapi import responses
 
-from app import services
+from app import models, services
 from app.api.dependencies import storages
 
 router = fastapi.APIRouter(prefix="/storages")
 
 
+def _get_upload_size(file: fastapi.UploadFile) -> int | None:
+    try:
+        size = file.file.seek(0, os.SEEK_END)
+        file.file.seek(0)
+        return size
+    except (AttributeError, OSError):
+        return None
+
+
+def _describe_put_result(
+    key: str, result: typing.Mapping[str, typing.Any]
+) -> typing.Any:
+    # Failed uploads already carry their key and error, and deduplicated ones the
+    # key the same bytes are stored under.
+    meta = result.get("ResponseMetadata", result)
+
+    if isinstance(meta, dict):
+        meta = meta | {"Key": result.get("Key", key)}
+
+        if result.get("Deduplicated"):
+            meta = meta | {"Deduplicated": True}
+
+    return meta
+
+
+async def _put_bucket_objects(
+    storage_router: services.StorageRouter, file: list[fastapi.UploadFile]
+) -> tuple[list[typing.Any], list[dict[str, str | None]]]:
+    # The files are streamed to the buckets instead of being read into memory, and
+    # spread across the configured S3 backends.
+    results = await storage_router.put_objects(
+        (item.filename, item, _get_upload_size(item)) for item in file
+    )
+    response_meta = [
+        _describe_put_result(item.filename, result)
+        for item, (_, result) in zip(file, results)
+    ]
+    objects = [
+        {
+            "key": item.filename,
+            "bucket_name": backend.label if backend else None,
+            "network": backend.network if backend else None,
+        }
+        for item, (backend, _) in zip(file, results)
+    ]
+
+    return response_meta, objects
+
+
 @router.post("", status_code=201, response_class=responses.ORJSONResponse)
 async def upload_permanent_object(
     file: list[fastapi.UploadFile],
-    filebase_s3_client: services.S3ClientSession = fastapi.Depends(
-        storages.get_filebase_s3_client
+    storage_router: services.StorageRouter = fastapi.Depends(
+        storages.get_storage_router
     ),
     nft_storage_client: services.NftStorageClient = fastapi.Depends(
         storages.get_nft_storage_client
     ),
-    s3_client_interface: services.S3Client = fastapi.Depends(
-        storages.get_s3_client_interface
-    ),
     http_client: aiohttp.ClientSession = fastapi.Depends(storages.get_http_client),
 ):
     # Due to free-tier storage limitations, we have to use multiple pinning services.
     try:
         # Assume the entire form data only contains json objects.
         if file[0].content_type == "application/json":
-            response_meta: list[typing.Any] = []
-
-            for json_file in file:
-                result = await s3_client_interface.put_object(
-                    client=filebase_s3_client.s3client,
-                    bucket=filebase_s3_client.bucket_name,
-                    key=json_file.filename,
-                    body=await json_file.read(),
-                )
-                meta = result["ResponseMetadata"]
-
-                if isinstance(meta, dict):
-                    meta = meta | {"Key": json_file.filename}
-
-                response_meta.append(meta)
-
-            bucket_name = f"{filebase_s3_client.bucket_name} (filebase.com)"
-            network = "IPFS"
+            response_meta, objects = await _put_bucket_objects(storage_router, file)
         else:
-            file_: dict[str, tuple[str, bytes]] = {}
+            # The files are streamed into the request instead of being read into
+            # memory first.
+            file_: dict[str, tuple[str, bytes | services.AsyncReadable]] = {}
 
             for item in file:
-                file_[item.filename] = (item.content_type, await item.read())
+                file_[item.filename] = (item.content_type, item)
 
-            response = await nft_storage_client.upload_file(
-                http_client=http_client, file=file_
+            # One response per request the files were split into.
+            response_meta = await nft_storage_client.upload_files(
+                http_client=http_client,
+                file=file_,
+                sizes={item.filename: _get_upload_size(item) for item in file},
             )
-            bucket_name = "files (nft.storage)"
-            network = "IPFS"
-            response_meta = response
+            objects = [
+                {
+                    "key": item.filename,
+                    "bucket_name": "files (nft.storage)",
+                    "network": "IPFS",
+                }
+                for item in file
+            ]
     except ValueError as value_err:
         raise fastapi.HTTPException(status_code=400, detail=str(value_err))
 
+    # Objects may be spread across several buckets; `objects` tells where each one
+    # went, and `bucket_name` and `network` describe the first stored object.
+    stored = next((obj for obj in objects if obj["bucket_name"]), objects[0])
+
     return {
-        "bucket_name": bucket_name,
-        "network": network,
+        "bucket_name": stored["bucket_name"],
+        "network": stored["network"],
         "response_meta": response_meta,
+        "objects": objects,
+    }
+
+
+@router.post("/presign", response_class=responses.ORJSONResponse)
+async def presign_objects(
+    presign_request: models.PresignRequest,
+    storage_router: services.StorageRouter = fastapi.Depends(
+        storages.get_storage_router
+    ),
+):
+    # Clients upload straight to the bucket, so the bytes never pass through here.
+    try:
+        backend, presigned_posts = await storage_router.presign_posts(
+            presign_request.keys
+        )
+    except ValueError as value_err:
+        raise fastapi.HTTPException(status_code=503, detail=str(value_err))
+
+    return {
+        "backend": backend.name,
+        "bucket_name": backend.label,
+        "network": backend.network,
+        "presigned_posts": presigned_posts,
+    }
+
+
+@router.post("/presign/complete", response_class=responses.ORJSONResponse)
+async def complete_presigned_objects(
+    presign_completion: models.PresignCompletion,
+    storage_router: services.StorageRouter = fastapi.Depends(
+        storages.get_storage_router
+    ),
+):
+    if (backend := storage_router.get_backend(presign_completion.backend)) is None:
+        raise fastapi.HTTPException(status_code=404, detail="Backend not found.")
+
+    # Completing the same keys again reports them again but doesn't count them twice.
+    keys = list(dict.fromkeys(presign_completion.keys))
+    heads = await storage_router.verify_objects(backend, keys)
+
+    return {
+        "bucket_name": backend.label,
+        "network": backend.network,
+        "response_meta": [
+            {"Key": key, "ContentLength": head["ContentLength"], "ETag": head["ETag"]}
+            for key, head in zip(keys, heads)
+            if head is not None
+        ],
+        "missing": [key for key, head in zip(keys, heads) if head is None],
     }
@@ -1,24 +1,261 @@
+import asyncio
+import base64
+import json
+import logging
+import tempfile
 import typing
 
 import fastapi
-from starlette import requests
+import pydantic
+from fastapi import exceptions
+from PIL import Image
+from pydantic import error_wrappers
+from starlette import datastructures, requests
 
 from app import models, services
 from app.api.dependencies import tempaltes
+from app.config import settings
+
+logger = logging.getLogger(__name__)
 
 router = fastapi.APIRouter(prefix="/templates")
 
+# Size of the chunks streamed from the request to ImageKit.
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Templates larger than this are spooled to disk while they are checked.
+UPLOAD_SPOOL_SIZE = 1024 * 1024
+
+
+async def _iter_file(file: datastructures.UploadFile) -> typing.AsyncIterator[bytes]:
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        yield chunk
+
+
+async def _iter_chunks(content: bytes) -> typing.AsyncIterator[bytes]:
+    yield content
+
+
+async def _sniff_template(
+    chunks: typing.AsyncIterator[bytes],
+) -> tuple[str, typing.AsyncIterator[bytes]]:
+    """Tell the content type of a template from the start of its stream.
+
+    Returns:
+        tuple[str, typing.AsyncIterator[bytes]]: The content type and the whole
+            stream, including the bytes read to sniff it.
+    """
+    header = b""
+
+    async for chunk in chunks:
+        header += chunk
+
+        if len(header) >= models.IMAGE_HEADER_SIZE:
+            break
+
+    if (content_type := models.sniff_image_type(header)) is None:
+        raise fastapi.HTTPException(
+            status_code=400, detail="file must be a PNG, JPEG, GIF, WebP, BMP or TIFF"
+        )
+
+    async def body() -> typing.AsyncIterator[bytes]:
+        yield header
+
+        async for chunk in chunks:
+            yield chunk
+
+    return content_type, body()
+
+
+def _parse_options(options: str | None) -> dict[str, typing.Any]:
+    try:
+        parsed = json.loads(options) if options else {}
+    except ValueError as value_err:
+        raise fastapi.HTTPException(
+            status_code=400, detail="options must be a JSON object"
+        ) from value_err
+
+    if not isinstance(parsed, dict):
+        raise fastapi.HTTPException(
+            status_code=400, detail="options must be a JSON object"
+        )
+
+    return parsed
+
+
+async def _spool(
+    chunks: typing.AsyncIterator[bytes], file_name: str
+) -> datastructures.UploadFile:
+    # The caller closes the spooled file once the template is uploaded.
+    spooled = tempfile.SpooledTemporaryFile(  # pylint: disable=consider-using-with
+        max_size=UPLOAD_SPOOL_SIZE
+    )
+    template = datastructures.UploadFile(file=spooled, filename=file_name)
+
+    try:
+        async for chunk in chunks:
+            await template.write(chunk)
+
+        await template.seek(0)
+    except BaseException:
+        await template.close()
+        raise
+
+    return template
+
+
+async def _read_template(
+    request: requests.Request, filename: str | None, options: str | None
+) -> tuple[datastructures.UploadFile, str, dict[str, typing.Any]]:
+    """Spool an uploaded template, whichever way it was sent.
+
+    Returns:
+        tuple[datastructures.UploadFile, str, dict[str, typing.Any]]: The spooled
+            template, its content type and the ImageKit upload options.
+    """
+    content_type = request.headers.get("Content-Type", "").partition(";")[0].strip()
+
+    if content_type == "application/octet-stream":
+        if not filename:
+            raise fastapi.HTTPException(status_code=400, detail="filename is required")
+
+        file_type, body = await _sniff_template(request.stream())
+        return await _spool(body, filename), file_type, _parse_options(options)
+
+    if content_type == "multipart/form-data":
+        form = await request.form()
+
+        if not isinstance(file := form.get("file"), datastructures.UploadFile):
+            raise fastapi.HTTPException(status_code=400, detail="file is required")
+
+        form_options = form.get("options")
+        file_type, body = await _sniff_template(_iter_file(file))
+        return (
+            await _spool(body, str(form.get("filename") or filename or file.filename)),
+            file_type,
+            _parse_options(form_options if isinstance(form_options, str) else options),
+        )
+
+    try:
+        template_upload = models.TemplateUpload.parse_raw(await request.body())
+    except pydantic.ValidationError as validation_err:
+        raise exceptions.RequestValidationError(
+            [error_wrappers.ErrorWrapper(validation_err, loc=("body",))]
+        ) from validation_err
+
+    file_type, body = await _sniff_template(
+        _iter_chunks(base64.b64decode(template_upload.fileb.rpartition(",")[2]))
+    )
+    return (
+        await _spool(body, template_upload.filename),
+        file_type,
+        template_upload.options,
+    )
+
+
+async def _make_template_variants(
+    image_processor: services.ImageProcessor, template: datastructures.UploadFile
+) -> list[tuple[tuple[int, int], bytes]]:
+    # Decoding the whole template also checks it; a truncated or corrupt image is
+    # rejected here, before anything is uploaded.
+    try:
+        return await image_processor.make_template_variants(
+            await template.read(), settings.template_variant_heights
+        )
+    except (OSError, SyntaxError, Image.DecompressionBombError) as img_err:
+        raise fastapi.HTTPException(
+            status_code=400, detail=f"file is not a valid image: {img_err}"
+        ) from img_err
+    finally:
+        await template.seek(0)
+
+
+async def _store_template_variants(
+    services_: tempaltes.TemplateServices,
+    template_url: str,
+    encoded: list[tuple[tuple[int, int], bytes]],
+    file_name: str,
+    options: dict[str, typing.Any],
+) -> list[dict[str, typing.Any]]:
+    """Store the render-ready variants of an uploaded template next to it.
+
+    Variants only speed up rendering, so failing to store them is logged and the
+    template is rendered from the original instead.
+
+    Returns:
+        list[dict[str, typing.Any]]: The URL and size of each stored variant.
+    """
+    stem = file_name.rpartition(".")[0] or file_name
+
+    try:
+        responses = await asyncio.gather(
+            *(
+                services_.imagekit_client.upload_file(
+                    file=content,
+                    file_name=f"{stem}-{width}x{height}.png",
+                    options=options,
+                    content_type="image/png",
+                )
+                for (width, height), content in encoded
+            )
+        )
+        variants = [
+            services.TemplateVariant(url=response["url"], width=width, height=height)
+            for ((width, height), _), response in zip(encoded, responses)
+        ]
+        await services_.variant_index.put(template_url, variants)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Failed to store the variants of %s", template_url)
+        return []
+
+    return [
+        {"url": variant.url, "width": variant.width, "height": variant.height}
+        for variant in variants
+    ]
+
 
 @router.post("", status_code=201)
 async def add_certificate_template(
-    _: requests.Request,
-    template: models.TemplateUpload,
-    imagekit_client: services.ImageKitClient = fastapi.Depends(
-        tempaltes.get_imagekit_client
+    request: requests.Request,
+    filename: str | None = None,
+    options: str | None = None,
+    services_: tempaltes.TemplateServices = fastapi.Depends(
+        tempaltes.get_template_services
     ),
 ) -> dict[str, typing.Any]:
-    return await imagekit_client.upload_file(
-        file=template.fileb,
-        file_name=template.filename,
-        options=template.options,
-    )
+    """Upload an e-Certificate template.
+
+    The template is sent either as raw bytes (`application/octet-stream`, with the
+    `filename` and JSON `options` as query parameters), as `multipart/form-data`
+    (a `file` field and optional `filename` and `options` fields), or base64
+    encoded in JSON. Uploads are spooled, to disk when they are large, and fully
+    decoded before they are streamed to ImageKit, so broken images are rejected
+    without being stored.
+
+    Render-ready variants of the template, converted to RGB and pre-scaled to the
+    configured heights below its own, are stored alongside it; e-Certificates
+    generated from the template's URL are rendered from the matching variant.
+    """
+    template, file_type, file_options = await _read_template(request, filename, options)
+
+    try:
+        encoded = await _make_template_variants(services_.image_processor, template)
+        response = await services_.imagekit_client.upload_file(
+            file=_iter_file(template),
+            file_name=str(template.filename),
+            options=file_options,
+            content_type=file_type,
+        )
+    finally:
+        await template.close()
+
+    # ImageKit reports failed uploads in the response body.
+    if isinstance(template_url := response.get("url"), str):
+        response["variants"] = await _store_template_variants(
+            services_,
+            template_url=template_url,
+            encoded=encoded,
+            file_name=str(template.filename),
+            options=file_options,
+        )
+
+    return response
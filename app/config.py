@@ -25,6 +25,12 @@ class AppSettings(BaseAppSettings):
     filebase_s3_access_key_id = ""
     filebase_s3_secret_access_key = ""
     filebase_s3_bucket = ""
+    # Number of objects uploaded to Filebase at the same time.
+    filebase_s3_max_concurrency = 16
+    # Size of each part of a streamed upload; S3 requires at least 5 MiB.
+    filebase_s3_part_size = 8 * 1024 * 1024
+    # Bytes that may still be written to the bucket; unlimited if not set.
+    filebase_s3_quota_bytes: int | None = None
 
     # Storj access keys
     storj_s3_api_endpoint_url: pydantic.AnyHttpUrl = pydantic.AnyHttpUrl(
@@ -33,12 +39,79 @@ class AppSettings(BaseAppSettings):
     storj_s3_access_key_id = ""
     storj_s3_secret_access_key = ""
     storj_s3_bucket = ""
+    storj_s3_max_concurrency = 16
+    storj_s3_part_size = 8 * 1024 * 1024
+    storj_s3_quota_bytes: int | None = None
+
+    # Seconds a storage backend is skipped after an upload to it failed.
+    storage_failure_cooldown = 30.0
+    # Presigned POSTs for direct uploads to the buckets.
+    storage_presign_expiration = 3600
+    storage_presign_max_bytes: int | None = None
+    # Index of stored objects by content hash, used to skip re-uploading identical
+    # bytes. Kept in memory unless a SQLite database path is set.
+    content_index_max_entries = 100_000
+    content_index_path: str | None = None
 
     # NFT.storage access keys
     nft_storage_api_endpoint_url: pydantic.AnyHttpUrl = pydantic.AnyHttpUrl(
         url="https://", scheme="https"
     )
     nft_storage_api_key = ""
+    # Batches whose files add up to more bytes are split across several uploads.
+    # Unlimited if not set.
+    nft_storage_max_request_bytes: int | None = 100 * 1000 * 1000
+
+    # Number of worker processes used to render e-Certificates. Defaults to the
+    # number of CPUs on the machine.
+    image_processor_max_workers: int | None = None
+    # Number of parsed fonts (per font file and size) each render worker keeps.
+    font_cache_size = 32
+    # Number of e-Certificates of a batch that may be rendering or waiting for
+    # upload at the same time.
+    image_processor_max_pending = 16
+    # Number of decoded and resized templates kept between batches.
+    prepared_template_cache_size = 4
+    # Template heights pre-scaled when a template is uploaded, so e-Certificates
+    # rendered at those heights skip the resize. The index of stored variants is
+    # kept in memory unless a SQLite database path is set.
+    template_variant_heights: list[int] = [720, 1080]
+    template_variant_index_max_entries = 10_000
+    template_variant_index_path: str | None = None
+    # Where generated e-Certificates were uploaded, so retried batches reuse them.
+    render_result_cache_max_entries = 10_000
+    render_result_cache_ttl = 3600.0
+    # Responses of POST /certificates kept for replays of the same Idempotency-Key.
+    idempotency_key_max_entries = 10_000
+    idempotency_key_ttl = 86400.0
+
+    # Cache for downloaded templates and fonts. The on-disk tier is disabled unless
+    # a directory is set.
+    asset_cache_max_memory_bytes = 64 * 1024 * 1024
+    asset_cache_dir: str | None = None
+    asset_cache_max_disk_bytes = 512 * 1024 * 1024
+    # Seconds a cached asset is used before it is revalidated with its origin.
+    asset_cache_max_age = 60.0
+    # Limits applied while downloading a template or font.
+    asset_fetch_max_bytes = 20 * 1024 * 1024
+    asset_fetch_timeout = 10.0
+
+    # Google Drive uploads of generated e-Certificates
+    gdrive_max_concurrent_uploads = 8
+    gdrive_max_upload_retries = 3
+    # Pooled connections kept open to the Drive API.
+    gdrive_max_connections_per_host = 16
+    gdrive_keepalive_timeout = 30.0
+    # Number of files deleted at the same time when cleaning up Drive.
+    gdrive_max_concurrent_deletes = 16
+
+    # Background certificate jobs. Jobs are kept in memory unless a SQLite database
+    # path is set.
+    certificate_job_queue_size = 32
+    certificate_job_workers = 1
+    certificate_job_store_path: str | None = None
+    # Minimum seconds between two saves of a running job's progress.
+    certificate_job_progress_interval = 1.0
 
     logging_level = "INFO"
 
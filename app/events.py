@@ -1,10 +1,12 @@
 import contextlib
 import typing
+from concurrent import futures
+from multiprocessing import resource_tracker
 
 import aiohttp
 import fastapi
 import orjson
-from aiobotocore import session
+from aiobotocore import config, session
 
 from app import services
 from app.config import settings
@@ -25,7 +27,70 @@ async def dispose_imagekit_client(app: fastapi.FastAPI) -> None:
 
 
 async def create_image_processor(app: fastapi.FastAPI) -> None:
-    app.state.image_processor = services.ImageProcessor()
+    # Prepared templates are handed to the render workers through shared memory.
+    # Start the resource tracker before any worker is forked so that every worker
+    # reports to the same tracker instead of spawning one of its own, which would
+    # unlink the blocks it saw when that worker exits.
+    resource_tracker.ensure_running()
+    services.configure_font_cache(settings.font_cache_size)
+    app.state.image_processor = services.ImageProcessor(
+        executor=futures.ProcessPoolExecutor(
+            max_workers=settings.image_processor_max_workers,
+            initializer=services.configure_font_cache,
+            initargs=(settings.font_cache_size,),
+        ),
+        max_templates=settings.prepared_template_cache_size,
+        max_pending=settings.image_processor_max_pending,
+    )
+
+
+async def dispose_image_processor(app: fastapi.FastAPI) -> None:
+    if isinstance(app.state.image_processor, services.ImageProcessor):
+        app.state.image_processor.shutdown()
+
+
+async def create_asset_cache(app: fastapi.FastAPI) -> None:
+    app.state.asset_cache = services.AssetCache(
+        max_memory_bytes=settings.asset_cache_max_memory_bytes,
+        disk_dir=settings.asset_cache_dir,
+        max_disk_bytes=settings.asset_cache_max_disk_bytes,
+        max_age=settings.asset_cache_max_age,
+        max_download_bytes=settings.asset_fetch_max_bytes,
+        download_timeout=settings.asset_fetch_timeout,
+    )
+
+
+async def create_render_result_cache(app: fastapi.FastAPI) -> None:
+    app.state.render_result_cache = services.RenderResultCache(
+        max_entries=settings.render_result_cache_max_entries,
+        ttl=settings.render_result_cache_ttl,
+    )
+
+
+async def create_certificate_coalescer(app: fastapi.FastAPI) -> None:
+    app.state.certificate_coalescer = services.RequestCoalescer(
+        max_entries=settings.idempotency_key_max_entries,
+        ttl=settings.idempotency_key_ttl,
+    )
+
+
+async def create_template_variant_index(app: fastapi.FastAPI) -> None:
+    if settings.template_variant_index_path:
+        app.state.template_variant_index = services.SQLiteTemplateVariantIndex(
+            settings.template_variant_index_path
+        )
+    else:
+        app.state.template_variant_index = services.InMemoryTemplateVariantIndex(
+            max_entries=settings.template_variant_index_max_entries
+        )
+
+
+async def dispose_template_variant_index(app: fastapi.FastAPI) -> None:
+    if isinstance(
+        app.state.template_variant_index,
+        (services.InMemoryTemplateVariantIndex, services.SQLiteTemplateVariantIndex),
+    ):
+        await app.state.template_variant_index.close()
 
 
 async def create_http_client_session(app: fastapi.FastAPI) -> None:
@@ -43,8 +108,19 @@ async def dispose_http_client_session(app: fastapi.FastAPI) -> None:
 
 async def create_gdrive_client(app: fastapi.FastAPI) -> None:
     app.state.gdrive = services.GoogleDriveClient(
-        client_json_file_path="certinize-gdrive-client.json"
+        client_json_file_path="certinize-gdrive-client.json",
+        max_concurrent_uploads=settings.gdrive_max_concurrent_uploads,
+        max_upload_retries=settings.gdrive_max_upload_retries,
+        max_connections_per_host=settings.gdrive_max_connections_per_host,
+        keepalive_timeout=settings.gdrive_keepalive_timeout,
+        max_concurrent_deletes=settings.gdrive_max_concurrent_deletes,
     )
+    app.state.gdrive_session = app.state.gdrive.session
+
+
+async def dispose_gdrive_client(app: fastapi.FastAPI) -> None:
+    if isinstance(app.state.gdrive_session, aiohttp.ClientSession):
+        await app.state.gdrive_session.close()
 
 
 async def create_s3_client_interface(app: fastapi.FastAPI) -> None:
@@ -62,8 +138,13 @@ async def create_filebase_s3_client(app: fastapi.FastAPI) -> None:
                 endpoint_url=settings.filebase_s3_api_endpoint_url,
                 aws_secret_access_key=settings.filebase_s3_secret_access_key,
                 aws_access_key_id=settings.filebase_s3_access_key_id,
+                config=config.AioConfig(
+                    max_pool_connections=settings.filebase_s3_max_concurrency
+                ),
             )
         ),
+        max_concurrency=settings.filebase_s3_max_concurrency,
+        part_size=settings.filebase_s3_part_size,
     )
 
 
@@ -85,8 +166,13 @@ async def create_storj_s3_client(app: fastapi.FastAPI) -> None:
                 endpoint_url=settings.storj_s3_api_endpoint_url,
                 aws_secret_access_key=settings.storj_s3_secret_access_key,
                 aws_access_key_id=settings.storj_s3_access_key_id,
+                config=config.AioConfig(
+                    max_pool_connections=settings.storj_s3_max_concurrency
+                ),
             )
         ),
+        max_concurrency=settings.storj_s3_max_concurrency,
+        part_size=settings.storj_s3_part_size,
     )
 
 
@@ -95,32 +181,109 @@ async def dispose_storj_s3_client(app: fastapi.FastAPI) -> None:
         await app.state.storj_client_session.exit_stack.aclose()
 
 
+async def create_storage_router(app: fastapi.FastAPI) -> None:
+    content_index: services.ContentIndex
+
+    if settings.content_index_path:
+        content_index = services.SQLiteContentIndex(settings.content_index_path)
+    else:
+        content_index = services.InMemoryContentIndex(
+            max_entries=settings.content_index_max_entries
+        )
+
+    # Only buckets that are configured take writes.
+    backends = [
+        services.StorageBackend(
+            name="filebase.com",
+            network="IPFS",
+            session=app.state.filebase_client_session,
+            quota_bytes=settings.filebase_s3_quota_bytes,
+        ),
+        services.StorageBackend(
+            name="storj.io",
+            network="Storj",
+            session=app.state.storj_client_session,
+            quota_bytes=settings.storj_s3_quota_bytes,
+        ),
+    ]
+    app.state.storage_router = services.StorageRouter(
+        backends=[backend for backend in backends if backend.session.bucket_name],
+        failure_cooldown=settings.storage_failure_cooldown,
+        presign_expiration=settings.storage_presign_expiration,
+        presign_max_bytes=settings.storage_presign_max_bytes,
+        content_index=content_index,
+    )
+
+
+async def dispose_storage_router(app: fastapi.FastAPI) -> None:
+    if isinstance(app.state.storage_router, services.StorageRouter) and (
+        app.state.storage_router.content_index is not None
+    ):
+        await app.state.storage_router.content_index.close()
+
+
 async def create_nft_storage_client(app: fastapi.FastAPI) -> None:
     app.state.nft_storage_client = services.NftStorageClient(
         nft_storage_api=settings.nft_storage_api_endpoint_url,
         api_key=settings.nft_storage_api_key,
+        max_request_bytes=settings.nft_storage_max_request_bytes,
     )
 
 
+async def create_certificate_job_runner(app: fastapi.FastAPI) -> None:
+    store: services.JobStore
+
+    if settings.certificate_job_store_path:
+        store = services.SQLiteJobStore(settings.certificate_job_store_path)
+        await store.fail_unfinished()
+    else:
+        store = services.InMemoryJobStore()
+
+    app.state.certificate_job_runner = services.CertificateJobRunner(
+        store=store,
+        max_queue_size=settings.certificate_job_queue_size,
+        workers=settings.certificate_job_workers,
+        progress_interval=settings.certificate_job_progress_interval,
+    )
+    app.state.certificate_job_runner.start()
+
+
+async def dispose_certificate_job_runner(app: fastapi.FastAPI) -> None:
+    if isinstance(app.state.certificate_job_runner, services.CertificateJobRunner):
+        await app.state.certificate_job_runner.stop()
+
+
 def create_start_app_handler(app: fastapi.FastAPI) -> typing.Callable[..., typing.Any]:
     async def start_app() -> None:
         await create_http_client_session(app)
         await create_imagekit_client(app)
         await create_image_processor(app)
+        await create_asset_cache(app)
+        await create_render_result_cache(app)
+        await create_certificate_coalescer(app)
+        await create_template_variant_index(app)
         await create_gdrive_client(app)
         await create_s3_client_interface(app)
         await create_filebase_s3_client(app)
         await create_storj_s3_client(app)
+        await create_storage_router(app)
         await create_nft_storage_client(app)
+        await create_certificate_job_runner(app)
 
     return start_app
 
 
 def create_stop_app_handler(app: fastapi.FastAPI) -> typing.Callable[..., typing.Any]:
     async def stop_app() -> None:
+        # Stop the jobs first; they depend on the clients disposed below.
+        await dispose_certificate_job_runner(app)
         await dispose_http_client_session(app)
         await dispose_imagekit_client(app)
+        await dispose_image_processor(app)
+        await dispose_gdrive_client(app)
         await dispose_filebase_s3_client(app)
         await dispose_storj_s3_client(app)
+        await dispose_storage_router(app)
+        await dispose_template_variant_index(app)
 
     return stop_app
@@ -1,19 +1,60 @@
 import base64
 import dataclasses
+import enum
+import mimetypes
+import time
 import typing
 
 import pydantic
+from PIL import Image
+
+# Number of leading bytes needed to tell the format of an uploaded template.
+IMAGE_HEADER_SIZE = 16
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+)
+
+# Not every platform's MIME type table knows the newer image formats, and Drive
+# tells the type of an uploaded e-Certificate from its extension.
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+
+
+def sniff_image_type(header: bytes) -> str | None:
+    """Tell the content type of an image from its first `IMAGE_HEADER_SIZE` bytes.
+
+    Args:
+        header (bytes): The start of the file.
+
+    Returns:
+        str | None: The content type, or `None` if it isn't a supported image.
+    """
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+
+    for signature, content_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return content_type
+
+    return None
 
 
 class Recipient(pydantic.BaseModel):
     recipient_name: str = pydantic.Field(min_length=1)
+    # Values of the per-recipient text layers, by field name.
+    fields: dict[str, str] = pydantic.Field(default_factory=dict)
 
 
-class CertificateTextMeta(pydantic.BaseModel):
+class TextStyle(pydantic.BaseModel):
     font_size: int
     font_url: pydantic.HttpUrl
     position: dict[str, int]
-    template_height: int | None = None
 
     @pydantic.validator("position")
     @classmethod
@@ -27,10 +68,91 @@ class CertificateTextMeta(pydantic.BaseModel):
         return value
 
 
+class CertificateTextMeta(TextStyle):
+    template_height: int | None = None
+    # Box, centered on `position`, that names are shrunk to fit in.
+    max_width: int | None = pydantic.Field(None, gt=0)
+    max_height: int | None = pydantic.Field(None, gt=0)
+
+
+class TextLayer(TextStyle):
+    # Static layers are drawn once per batch; otherwise `text` names the
+    # recipient field the layer shows.
+    text: str = pydantic.Field(min_length=1)
+    static: bool = True
+    font_color: str = "black"
+
+
+class OutputFormat(str, enum.Enum):
+    JPEG = "jpeg"
+    WEBP = "webp"
+    AVIF = "avif"
+    PDF = "pdf"
+
+    @property
+    def extension(self) -> str:
+        return f".{self.value}"
+
+    @property
+    def mimetype(self) -> str:
+        return mimetypes.types_map[self.extension]
+
+
+class OutputOptions(pydantic.BaseModel):
+    format: OutputFormat = OutputFormat.JPEG
+    # Used by every format; PDF pages embed the image as a JPEG.
+    quality: int = pydantic.Field(75, ge=1, le=100)
+    # JPEG only: an extra pass for smaller Huffman tables, and progressive scans.
+    optimize: bool = False
+    progressive: bool = False
+    # JPEG and AVIF chroma subsampling; the encoder's default when unset.
+    subsampling: typing.Literal["4:4:4", "4:2:2", "4:2:0"] | None = None
+    # PDF only: dots per inch the page is printed at.
+    resolution: float = pydantic.Field(72.0, gt=0)
+
+    @pydantic.validator("format")
+    @classmethod
+    def format_must_be_supported(cls, value: OutputFormat):
+        # AVIF needs a Pillow build, or plugin, that can encode it.
+        Image.init()
+
+        if value.name not in Image.SAVE:
+            raise ValueError(f"{value.value} output is not supported")
+
+        return value
+
+
 class CertificateTemplateMeta(pydantic.BaseModel):
     recipient_name_meta: CertificateTextMeta
     template_url: pydantic.HttpUrl
     recipients: list[Recipient]
+    text_layers: list[TextLayer] = pydantic.Field(default_factory=list)
+    output: OutputOptions = pydantic.Field(default_factory=OutputOptions)
+
+    @pydantic.validator("text_layers")
+    @classmethod
+    def recipients_must_have_layer_fields(
+        cls, value: list[TextLayer], values: dict[str, typing.Any]
+    ):
+        fields = {layer.text for layer in value if not layer.static}
+
+        for recipient in values.get("recipients", []):
+            if missing := fields - recipient.fields.keys():
+                raise ValueError(
+                    f"recipient {recipient.recipient_name!r} is missing fields: "
+                    f"{', '.join(sorted(missing))}"
+                )
+
+        return value
+
+
+class PresignRequest(pydantic.BaseModel):
+    keys: pydantic.conlist(str, min_items=1, max_items=1000)  # type: ignore
+
+
+class PresignCompletion(pydantic.BaseModel):
+    backend: str
+    keys: pydantic.conlist(str, min_items=1, max_items=1000)  # type: ignore
 
 
 class TemplateUpload(pydantic.BaseModel):
@@ -41,11 +163,17 @@ class TemplateUpload(pydantic.BaseModel):
     @pydantic.validator("fileb")
     @classmethod
     def fileb_must_be_valid_base64(cls, value: str):
+        # Only the image header is decoded; the payload is passed on as is.
+        data = value.partition(",")[2] if value.startswith("data:") else value
+
         try:
-            base64.b64decode(value)
+            header = base64.b64decode(data[:24], validate=True)
         except Exception as exc:
             raise ValueError("fileb must be a valid base64 encoded image") from exc
 
+        if sniff_image_type(header) is None:
+            raise ValueError("fileb must be a valid base64 encoded image")
+
         return value
 
 
@@ -54,11 +182,65 @@ class CertificateRecipient:
     recipient_name: str
     text_position: tuple[int, int]
     text_size: int
+    fields: dict[str, str] = dataclasses.field(default_factory=dict)
 
 
 @dataclasses.dataclass
-class CertificateMeta:
+class CertificateTextLayer:
+    text: str
+    text_position: tuple[int, int]
+    text_size: int
+    font_style: bytes
+    font_color: str = "black"
+    static: bool = True
+    font_digest: str | None = None
+
+
+@dataclasses.dataclass
+class CertificateMeta:  # pylint: disable=too-many-instance-attributes
     font_color: str
     template: bytes
     name_font_style: bytes
     template_height: int | None = None
+    template_digest: str | None = None
+    name_font_digest: str | None = None
+    name_max_width: int | None = None
+    name_max_height: int | None = None
+    text_layers: list[CertificateTextLayer] = dataclasses.field(default_factory=list)
+    output: OutputOptions = dataclasses.field(default_factory=OutputOptions)
+
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    @property
+    def is_finished(self) -> bool:
+        return self not in (JobStatus.QUEUED, JobStatus.RUNNING)
+
+
+@dataclasses.dataclass
+class CertificateJob:  # pylint: disable=too-many-instance-attributes
+    job_id: str
+    total: int
+    status: JobStatus = JobStatus.QUEUED
+    completed: int = 0
+    # Per-recipient results, filled in as each e-Certificate is uploaded.
+    results: list[dict[str, str] | None] = dataclasses.field(default_factory=list)
+    error: str | None = None
+    created_at: float = dataclasses.field(default_factory=time.time)
+    updated_at: float = dataclasses.field(default_factory=time.time)
+
+    def __post_init__(self) -> None:
+        if not self.results:
+            self.results = [None] * self.total
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        return dataclasses.asdict(self) | {"status": self.status.value}
+
+    @classmethod
+    def from_dict(cls, value: dict[str, typing.Any]) -> "CertificateJob":
+        return cls(**value | {"status": JobStatus(value["status"])})
@@ -0,0 +1,154 @@
+"""
+app.services
+~~~~~~~~~~~~
+
+Clients and helpers used by the API, split by concern:
+
+- `caches`: parsed fonts, glyph metrics, downloaded assets and rendered results.
+- `rendering`: template preparation and e-Certificate rendering.
+- `jobs`: bounded task runners, request coalescing and background jobs.
+- `drive`, `imagekit`, `s3` and `storage`: storage providers.
+- `metrics`: counters, gauges and histograms exposed on GET /metrics.
+
+Everything is re-exported here, so callers can keep using `services.<name>`.
+"""
+
+from app.services.caches import (
+    FONT_CONTENT_TYPES,
+    TEMPLATE_CONTENT_TYPES,
+    AssetCache,
+    AssetFetchError,
+    CachedAsset,
+    FontCache,
+    FontSource,
+    GlyphMetricsCache,
+    RenderResultCache,
+    SharedFontSource,
+    configure_font_cache,
+    font_cache,
+    glyph_metrics,
+)
+from app.services.drive import (
+    GDRIVE_API_URL,
+    GDRIVE_FOLDER_MIME_TYPE,
+    GDRIVE_SCOPE,
+    GDRIVE_UPLOAD_API_URL,
+    GOOGLE_TOKEN_URI,
+    GoogleDriveClient,
+    ServiceAccountTokenSource,
+    drive_download_link,
+)
+from app.services.imagekit import (
+    IMAGEKIT_FILE_UPLOAD,
+    IMAGEKIT_UPLOAD_API,
+    ImageKitClient,
+)
+from app.services.jobs import (
+    RETRYABLE_STATUS_CODES,
+    BoundedTaskRunner,
+    CertificateJobRunner,
+    IdempotencyKeyConflictError,
+    InMemoryJobStore,
+    JobFunction,
+    JobQueueFullError,
+    JobStore,
+    RequestCoalescer,
+    RetryPolicy,
+    SQLiteJobStore,
+    get_error_status,
+    is_retryable_error,
+)
+from app.services.metrics import LATENCY_BUCKETS, METRICS, Metrics, metrics
+from app.services.rendering import (
+    CertificateRenderSpec,
+    ImageProcessor,
+    InMemoryTemplateVariantIndex,
+    PreparedTemplate,
+    SQLiteTemplateVariantIndex,
+    TemplateVariant,
+    TemplateVariantIndex,
+    TextLayerSpec,
+    encode_image,
+    make_template_variants,
+    prepare_template,
+    render_certificate,
+    render_certificate_timed,
+    select_template_variant,
+)
+from app.services.s3 import AsyncReadable, S3Client, S3ClientSession, read_chunk
+from app.services.storage import (
+    ContentIndex,
+    InMemoryContentIndex,
+    NftStorageClient,
+    SQLiteContentIndex,
+    StorageBackend,
+    StorageRouter,
+)
+
+__all__ = [
+    "FONT_CONTENT_TYPES",
+    "GDRIVE_API_URL",
+    "GDRIVE_FOLDER_MIME_TYPE",
+    "GDRIVE_SCOPE",
+    "GDRIVE_UPLOAD_API_URL",
+    "GOOGLE_TOKEN_URI",
+    "IMAGEKIT_FILE_UPLOAD",
+    "IMAGEKIT_UPLOAD_API",
+    "LATENCY_BUCKETS",
+    "METRICS",
+    "RETRYABLE_STATUS_CODES",
+    "TEMPLATE_CONTENT_TYPES",
+    "AssetCache",
+    "AssetFetchError",
+    "AsyncReadable",
+    "BoundedTaskRunner",
+    "CachedAsset",
+    "CertificateJobRunner",
+    "CertificateRenderSpec",
+    "ContentIndex",
+    "FontCache",
+    "FontSource",
+    "GlyphMetricsCache",
+    "GoogleDriveClient",
+    "IdempotencyKeyConflictError",
+    "ImageKitClient",
+    "ImageProcessor",
+    "InMemoryContentIndex",
+    "InMemoryJobStore",
+    "InMemoryTemplateVariantIndex",
+    "JobFunction",
+    "JobQueueFullError",
+    "JobStore",
+    "Metrics",
+    "NftStorageClient",
+    "PreparedTemplate",
+    "RenderResultCache",
+    "RequestCoalescer",
+    "RetryPolicy",
+    "S3Client",
+    "S3ClientSession",
+    "SQLiteContentIndex",
+    "SQLiteJobStore",
+    "SQLiteTemplateVariantIndex",
+    "ServiceAccountTokenSource",
+    "SharedFontSource",
+    "StorageBackend",
+    "StorageRouter",
+    "TemplateVariant",
+    "TemplateVariantIndex",
+    "TextLayerSpec",
+    "configure_font_cache",
+    "drive_download_link",
+    "encode_image",
+    "font_cache",
+    "get_error_status",
+    "glyph_metrics",
+    "is_retryable_error",
+    "make_template_variants",
+    "metrics",
+    "prepare_template",
+    "read_chunk",
+    "render_certificate",
+    "render_certificate_timed",
+    "select_template_variant",
+]
@@ -0,0 +1,733 @@
+"""
+app.services.caches
+~~~~~~~~~~~~~~~~~~~
+"""
+
+import asyncio
+import collections
+import dataclasses
+import fnmatch
+import hashlib
+import io
+import json
+import pathlib
+import threading
+import time
+import typing
+
+import aiohttp
+from PIL import ImageFont
+
+from app import models
+from app.services import shm
+from app.services.metrics import metrics
+
+
+@dataclasses.dataclass(frozen=True)
+class FontSource:
+    """A TrueType/OpenType font file identified by the hash of its content."""
+
+    digest: str
+    data: bytes = dataclasses.field(repr=False, compare=False)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "FontSource":
+        return cls(digest=hashlib.sha256(data).hexdigest(), data=data)
+
+
+@dataclasses.dataclass(frozen=True)
+class SharedFontSource:
+    """A font file kept in a shared memory block.
+
+    Pickling it only sends the name of the block, so the render spec of every
+    e-Certificate doesn't carry the whole font file to the worker; the font is read
+    from the block when a worker's cache misses.
+    """
+
+    digest: str
+    shm_name: str
+    nbytes: int
+
+    @classmethod
+    def create(cls, font: FontSource) -> "SharedFontSource":
+        return cls(
+            digest=font.digest, shm_name=shm.create(font.data), nbytes=len(font.data)
+        )
+
+    @property
+    def data(self) -> bytes:
+        return shm.read(self.shm_name, self.nbytes)
+
+    def unlink(self) -> None:
+        """Free the shared memory block holding the font file."""
+        shm.unlink(self.shm_name)
+
+
+class FontCache:
+    """Bounded LRU cache of parsed FreeType fonts.
+
+    Fonts are keyed by the hash of the font file and the font size, so every
+    request that uses the same font file shares the parsed font. Each process keeps
+    its own cache; in a process pool, every render worker has one.
+    """
+
+    max_size: int
+    hits: int
+    misses: int
+
+    def __init__(self, max_size: int = 32) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._fonts: collections.OrderedDict[
+            tuple[str, int], ImageFont.FreeTypeFont
+        ] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._fonts)
+
+    def get(
+        self, font: FontSource | SharedFontSource, size: int
+    ) -> ImageFont.FreeTypeFont:
+        """Get a parsed font, parsing and caching it on a miss.
+
+        Args:
+            font (FontSource | SharedFontSource): The font file.
+            size (int): The requested size, in pixels.
+
+        Returns:
+            ImageFont.FreeTypeFont: The parsed font.
+        """
+        key = (font.digest, size)
+
+        with self._lock:
+            if (cached := self._fonts.get(key)) is not None:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return cached
+
+            self.misses += 1
+
+        parsed = ImageFont.truetype(io.BytesIO(font.data), size)
+
+        with self._lock:
+            self._fonts[key] = parsed
+            self._fonts.move_to_end(key)
+
+            while len(self._fonts) > self.max_size:
+                self._fonts.popitem(last=False)
+
+        return parsed
+
+    def resize(self, max_size: int) -> None:
+        """Change the number of fonts the cache holds, evicting the oldest ones."""
+        with self._lock:
+            self.max_size = max_size
+
+            while len(self._fonts) > self.max_size:
+                self._fonts.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._fonts),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+font_cache = FontCache()
+
+
+# Size glyphs are measured at; metrics at other sizes are scaled from it. Hinting
+# barely changes advances at this size, so they scale about linearly.
+GLYPH_METRICS_REFERENCE_SIZE = 1000
+
+
+class GlyphMetricsCache:
+    """Bounded LRU cache of glyph advance widths and line heights.
+
+    Each font is parsed once at `GLYPH_METRICS_REFERENCE_SIZE` and each of its
+    glyphs measured once; metrics at any other size are scaled linearly, so
+    measuring a name is a sum of cached advances instead of a layout pass, and
+    trying out font sizes doesn't parse the font again. Kerning and hinting are
+    not applied, so measured widths may be off by a few pixels.
+    """
+
+    max_size: int
+
+    def __init__(self, max_size: int = 32) -> None:
+        self.max_size = max_size
+        self._metrics: collections.OrderedDict[
+            str, tuple[ImageFont.FreeTypeFont, int, dict[str, float]]
+        ] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._metrics)
+
+    def _get(
+        self, font: FontSource | SharedFontSource
+    ) -> tuple[ImageFont.FreeTypeFont, int, dict[str, float]]:
+        with self._lock:
+            if (cached := self._metrics.get(font.digest)) is not None:
+                self._metrics.move_to_end(font.digest)
+                return cached
+
+        # Not parsed through `font_cache`, so it doesn't evict the fonts that
+        # e-Certificates are drawn with.
+        parsed = ImageFont.truetype(io.BytesIO(font.data), GLYPH_METRICS_REFERENCE_SIZE)
+        ascent, descent = parsed.getmetrics()
+
+        with self._lock:
+            cached = self._metrics.setdefault(
+                font.digest, (parsed, ascent + descent, {})
+            )
+            self._metrics.move_to_end(font.digest)
+
+            while len(self._metrics) > self.max_size:
+                self._metrics.popitem(last=False)
+
+        return cached
+
+    def text_width(
+        self, font: FontSource | SharedFontSource, size: int, text: str
+    ) -> float:
+        """Measure the width of a single line of text.
+
+        Args:
+            font (FontSource | SharedFontSource): The font file.
+            size (int): The font size, in pixels.
+            text (str): The text to measure.
+
+        Returns:
+            float: The width of the text, in pixels.
+        """
+        parsed, _, advances = self._get(font)
+
+        if missing := set(text) - advances.keys():
+            advances.update({glyph: parsed.getlength(glyph) for glyph in missing})
+
+        width = sum(advances[glyph] for glyph in text)
+        return width * size / GLYPH_METRICS_REFERENCE_SIZE
+
+    def line_height(self, font: FontSource | SharedFontSource, size: int) -> float:
+        return self._get(font)[1] * size / GLYPH_METRICS_REFERENCE_SIZE
+
+    def fit(
+        self,
+        font: FontSource | SharedFontSource,
+        size: int,
+        text: str,
+        max_width: int | None = None,
+        max_height: int | None = None,
+    ) -> int:
+        """Get the largest font size, up to `size`, at which a text fits in a box.
+
+        The size is estimated from the scaled metrics, then confirmed with the font
+        parsed at that size, which is the one the text is drawn with.
+
+        Args:
+            font (FontSource | SharedFontSource): The font file.
+            size (int): The preferred font size, in pixels.
+            text (str): The text to fit.
+            max_width (int | None, optional): Width of the box. Defaults to None.
+            max_height (int | None, optional): Height of the box. Defaults to None.
+
+        Returns:
+            int: The fitted font size; at least 1.
+        """
+        fitted = size
+
+        if max_width is not None and (
+            width := self.text_width(font, GLYPH_METRICS_REFERENCE_SIZE, text)
+        ):
+            fitted = min(fitted, int(GLYPH_METRICS_REFERENCE_SIZE * max_width / width))
+
+        if max_height is not None:
+            line_height = self.line_height(font, GLYPH_METRICS_REFERENCE_SIZE)
+            fitted = min(
+                fitted, int(GLYPH_METRICS_REFERENCE_SIZE * max_height / line_height)
+            )
+
+        fitted = max(fitted, 1)
+
+        def fits(parsed: ImageFont.FreeTypeFont) -> bool:
+            return (max_width is None or parsed.getlength(text) <= max_width) and (
+                max_height is None or sum(parsed.getmetrics()) <= max_height
+            )
+
+        # Hinting may make the parsed font slightly larger than the estimate.
+        while fitted > 1 and not fits(font_cache.get(font, fitted)):
+            fitted -= 1
+
+        return fitted
+
+    def resize(self, max_size: int) -> None:
+        """Change the number of fonts the cache holds, evicting the oldest ones."""
+        with self._lock:
+            self.max_size = max_size
+
+            while len(self._metrics) > self.max_size:
+                self._metrics.popitem(last=False)
+
+
+glyph_metrics = GlyphMetricsCache()
+
+
+def configure_font_cache(max_size: int) -> None:
+    """Size the font and glyph metrics caches of the current process.
+
+    Doubles as the initializer of render worker processes.
+    """
+    font_cache.resize(max_size)
+    glyph_metrics.resize(max_size)
+
+
+class AssetFetchError(ValueError):
+    """Raised when a remote asset can't be downloaded."""
+
+    status_code: int
+
+    def __init__(self, message: str, status_code: int = 400) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+TEMPLATE_CONTENT_TYPES = ("image/*",)
+FONT_CONTENT_TYPES = (
+    "font/*",
+    "application/font-*",
+    "application/x-font-*",
+    "application/vnd.ms-opentype",
+    "application/octet-stream",
+    "binary/octet-stream",
+)
+
+
+@dataclasses.dataclass
+class CachedAsset:
+    """A downloaded asset and the validators needed to revalidate it."""
+
+    url: str
+    data: bytes = dataclasses.field(repr=False)
+    digest: str
+    etag: str | None = None
+    last_modified: str | None = None
+    validated_at: float = 0.0
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+
+class AssetCache:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """Content-addressed cache for downloaded e-Certificate templates and fonts.
+
+    Assets are kept in an in-memory LRU tier and, if `disk_dir` is set, in an
+    on-disk tier; both are bounded by bytes. Files on disk are stored by content
+    hash, so the same file served from several URLs is stored once. Cached assets
+    younger than `max_age` seconds are served as is; older ones are revalidated
+    with `If-None-Match`/`If-Modified-Since` and only downloaded again if they
+    changed.
+
+    Downloads are streamed into a buffer sized from `Content-Length` and aborted as
+    soon as they exceed `max_download_bytes`, take longer than `download_timeout`
+    seconds, or have an unexpected `Content-Type`.
+    """
+
+    max_memory_bytes: int
+    max_disk_bytes: int
+    max_age: float
+    max_download_bytes: int
+    download_timeout: float
+    disk_dir: pathlib.Path | None
+
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        *,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        disk_dir: str | None = None,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+        max_age: float = 60.0,
+        max_download_bytes: int = 20 * 1024 * 1024,
+        download_timeout: float = 10.0,
+    ) -> None:
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+        self.max_download_bytes = max_download_bytes
+        self.download_timeout = download_timeout
+        self.disk_dir = pathlib.Path(disk_dir) if disk_dir else None
+        self._assets: collections.OrderedDict[str, CachedAsset] = (
+            collections.OrderedDict()
+        )
+        self._memory_bytes = 0
+        self._inflight: dict[str, asyncio.Task[CachedAsset]] = {}
+        self._waiters: collections.Counter[asyncio.Task[CachedAsset]] = (
+            collections.Counter()
+        )
+
+    async def get(
+        self,
+        http_client: aiohttp.ClientSession,
+        url: str,
+        content_types: typing.Sequence[str] = ("*/*",),
+    ) -> CachedAsset:
+        """Get an asset from the cache, downloading or revalidating it if needed.
+
+        Concurrent requests for the same URL share a single download. The download
+        runs as a task of its own, so cancelling one request doesn't fail the
+        others; it is only cancelled once every request waiting on it is.
+
+        Args:
+            http_client (aiohttp.ClientSession): Session used for downloads.
+            url (str): URL of the asset.
+            content_types (typing.Sequence[str]): Accepted `Content-Type` patterns,
+                e.g. `image/*`.
+
+        Raises:
+            AssetFetchError: If the asset could not be downloaded.
+
+        Returns:
+            CachedAsset: The asset.
+        """
+        if (download := self._inflight.get(url)) is None:
+            download = asyncio.create_task(
+                self._download(http_client, url, content_types)
+            )
+            self._inflight[url] = download
+            download.add_done_callback(lambda _: self._inflight.pop(url, None))
+
+        self._waiters[download] += 1
+
+        try:
+            return await asyncio.shield(download)
+        finally:
+            self._waiters[download] -= 1
+
+            if not self._waiters[download]:
+                del self._waiters[download]
+                download.cancel()
+
+    async def _download(
+        self,
+        http_client: aiohttp.ClientSession,
+        url: str,
+        content_types: typing.Sequence[str],
+    ) -> CachedAsset:
+        with metrics.time("certinize_stage_duration_seconds", stage="asset_fetch"):
+            return await self._get(http_client, url, content_types)
+
+    async def _get(
+        self,
+        http_client: aiohttp.ClientSession,
+        url: str,
+        content_types: typing.Sequence[str],
+    ) -> CachedAsset:
+        cached = self._assets.get(url) or await self._load_from_disk(url)
+
+        if cached is not None and time.monotonic() - cached.validated_at < self.max_age:
+            self._store_in_memory(cached)
+            return cached
+
+        headers: dict[str, str] = {}
+
+        if cached is not None and cached.etag:
+            headers["If-None-Match"] = cached.etag
+
+        if cached is not None and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+        try:
+            async with http_client.get(
+                url,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=self.download_timeout),
+            ) as response:
+                if response.status == 304 and cached is not None:
+                    cached.validated_at = time.monotonic()
+                    self._store_in_memory(cached)
+                    return cached
+
+                if response.status != 200:
+                    raise AssetFetchError(
+                        f"Unable to download {url}: HTTP {response.status}"
+                    )
+
+                if not any(
+                    fnmatch.fnmatch(response.content_type, pattern)
+                    for pattern in content_types
+                ):
+                    raise AssetFetchError(
+                        f"{url} has an unsupported content type "
+                        f"{response.content_type}",
+                        status_code=415,
+                    )
+
+                data = await self._read_body(url, response)
+                metrics.inc(
+                    "certinize_stage_bytes_total", len(data), stage="asset_fetch"
+                )
+                asset = CachedAsset(
+                    url=url,
+                    data=data,
+                    digest=hashlib.sha256(data).hexdigest(),
+                    etag=response.headers.get("ETag"),
+                    last_modified=response.headers.get("Last-Modified"),
+                    validated_at=time.monotonic(),
+                )
+        except asyncio.TimeoutError as timeout_err:
+            raise AssetFetchError(
+                f"Timed out while downloading {url}", status_code=504
+            ) from timeout_err
+        except aiohttp.ClientError as client_err:
+            raise AssetFetchError(
+                f"Unable to download {url}: {client_err}"
+            ) from client_err
+
+        self._store_in_memory(asset)
+        await self._store_on_disk(asset)
+        return asset
+
+    async def _read_body(self, url: str, response: aiohttp.ClientResponse) -> bytes:
+        """Stream a response body into a preallocated buffer, enforcing the size
+        limit before and while reading."""
+        too_large = AssetFetchError(
+            f"{url} is larger than {self.max_download_bytes} bytes", status_code=413
+        )
+        expected = response.content_length
+
+        if expected is not None and expected > self.max_download_bytes:
+            raise too_large
+
+        buffer = bytearray(expected or 0)
+        received = 0
+
+        async for chunk in response.content.iter_chunked(self.DOWNLOAD_CHUNK_SIZE):
+            end = received + len(chunk)
+
+            if end > self.max_download_bytes:
+                raise too_large
+
+            buffer[received:end] = chunk
+            received = end
+
+        del buffer[received:]
+        return bytes(buffer)
+
+    def _store_in_memory(self, asset: CachedAsset) -> None:
+        if (previous := self._assets.pop(asset.url, None)) is not None:
+            self._memory_bytes -= previous.size
+
+        if asset.size > self.max_memory_bytes:
+            return
+
+        self._assets[asset.url] = asset
+        self._memory_bytes += asset.size
+
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._assets.popitem(last=False)
+            self._memory_bytes -= evicted.size
+
+    @staticmethod
+    def _url_key(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    async def _load_from_disk(self, url: str) -> CachedAsset | None:
+        if self.disk_dir is None:
+            return None
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._read_disk_entry, url)
+
+    def _read_disk_entry(self, url: str) -> CachedAsset | None:
+        assert self.disk_dir is not None
+
+        try:
+            meta = json.loads(
+                (self.disk_dir / f"{self._url_key(url)}.json").read_text()
+            )
+            blob = self.disk_dir / "objects" / meta["digest"]
+            data = blob.read_bytes()
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # Touch the object so eviction treats it as recently used.
+        blob.touch()
+
+        # Assets loaded from disk are always revalidated before use.
+        return CachedAsset(
+            url=url,
+            data=data,
+            digest=meta["digest"],
+            etag=meta.get("etag"),
+            last_modified=meta.get("last_modified"),
+        )
+
+    async def _store_on_disk(self, asset: CachedAsset) -> None:
+        if self.disk_dir is None:
+            return
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_disk_entry, asset)
+
+    def _write_disk_entry(self, asset: CachedAsset) -> None:
+        assert self.disk_dir is not None
+
+        if asset.size > self.max_disk_bytes:
+            return
+
+        objects_dir = self.disk_dir / "objects"
+        objects_dir.mkdir(parents=True, exist_ok=True)
+        blob = objects_dir / asset.digest
+
+        if not blob.exists():
+            partial = blob.with_suffix(".partial")
+            partial.write_bytes(asset.data)
+            partial.replace(blob)
+
+        (self.disk_dir / f"{self._url_key(asset.url)}.json").write_text(
+            json.dumps(
+                {
+                    "url": asset.url,
+                    "digest": asset.digest,
+                    "etag": asset.etag,
+                    "last_modified": asset.last_modified,
+                }
+            )
+        )
+
+        blobs = sorted(
+            (path.stat().st_mtime, path.stat().st_size, path)
+            for path in objects_dir.iterdir()
+            if path.suffix != ".partial"
+        )
+        disk_bytes = sum(size for _, size, _ in blobs)
+
+        for _, size, path in blobs:
+            if disk_bytes <= self.max_disk_bytes:
+                break
+
+            # URL entries pointing at an evicted object become misses on load.
+            path.unlink(missing_ok=True)
+            disk_bytes -= size
+
+
+class RenderResultCache:
+    """Bounded LRU cache of where generated e-Certificates were uploaded.
+
+    Entries are keyed by everything that affects the rendered image, so a retried
+    batch gets back the e-Certificates it already produced instead of rendering
+    and uploading them again. Entries expire after `ttl` seconds.
+    """
+
+    max_entries: int
+    ttl: float
+    hits: int
+    misses: int
+
+    def __init__(self, max_entries: int = 10_000, ttl: float = 3600.0) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: collections.OrderedDict[str, tuple[float, tuple[str, str]]] = (
+            collections.OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(
+        certificate_meta: models.CertificateMeta,
+        recipient_meta: models.CertificateRecipient,
+    ) -> str | None:
+        """Build the cache key of an e-Certificate.
+
+        Args:
+            certificate_meta (models.CertificateMeta): e-Certificate metadata.
+            recipient_meta (models.CertificateRecipient): Metadata of the recipient.
+
+        Returns:
+            str | None: The cache key, or `None` if the template or font hash is
+                unknown.
+        """
+        if not (certificate_meta.template_digest and certificate_meta.name_font_digest):
+            return None
+
+        return hashlib.sha256(
+            json.dumps(
+                [
+                    certificate_meta.template_digest,
+                    certificate_meta.name_font_digest,
+                    certificate_meta.template_height,
+                    certificate_meta.font_color,
+                    certificate_meta.output.json(),
+                    certificate_meta.name_max_width,
+                    certificate_meta.name_max_height,
+                    [
+                        [
+                            layer.text,
+                            layer.static,
+                            layer.text_position,
+                            layer.text_size,
+                            layer.font_color,
+                            layer.font_digest
+                            or hashlib.sha256(layer.font_style).hexdigest(),
+                        ]
+                        for layer in certificate_meta.text_layers
+                    ],
+                    recipient_meta.text_position,
+                    recipient_meta.text_size,
+                    recipient_meta.recipient_name,
+                    sorted(recipient_meta.fields.items()),
+                ]
+            ).encode()
+        ).hexdigest()
+
+    def get(self, key: str | None) -> tuple[str, str] | None:
+        """Get the shareable link and file ID of an e-Certificate, if cached.
+
+        Args:
+            key (str | None): The cache key.
+
+        Returns:
+            tuple[str, str] | None: The shareable link and file ID.
+        """
+        if key is None or (entry := self._entries.get(key)) is None:
+            self.misses += 1
+            return None
+
+        expires_at, location = entry
+
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return location
+
+    def put(self, key: str | None, location: tuple[str, str]) -> None:
+        if key is None:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, location)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,518 @@
+"""
+app.services.drive
+~~~~~~~~~~~~~~~~~~
+"""
+
+import asyncio
+import io
+import json
+import mimetypes
+import pathlib
+import time
+import typing
+
+import aiohttp
+from google.auth import crypt, jwt
+
+from app.services import jobs
+from app.services.metrics import metrics
+
+GDRIVE_API_URL = "https://www.googleapis.com/drive/v3"
+GDRIVE_UPLOAD_API_URL = "https://www.googleapis.com/upload/drive/v3"
+GDRIVE_SCOPE = "https://www.googleapis.com/auth/drive"
+GDRIVE_FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+GOOGLE_TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+
+def drive_download_link(file_id: str) -> str:
+    """Get the direct download link of a shared Google Drive file.
+
+    The download link is derived from the file ID, e.g.
+    https://drive.google.com/uc?export=download&id=10SyD3uzY07cHX0KK1dxxrF-l3Y6Tt1VA
+    """
+    return f"https://drive.google.com/uc?export=download&id={file_id}"
+
+
+class ServiceAccountTokenSource:
+    """Issues OAuth 2.0 access tokens for a Google service account.
+
+    A token is reused until shortly before it expires, and callers waiting on an
+    expired token share a single refresh.
+    """
+
+    token_uri: str
+    refresh_margin: float
+
+    def __init__(
+        self,
+        client_json_file_path: str,
+        session: aiohttp.ClientSession,
+        scopes: tuple[str, ...] = (GDRIVE_SCOPE,),
+        refresh_margin: float = 60.0,
+    ) -> None:
+        info = json.loads(pathlib.Path(client_json_file_path).read_text("utf-8"))
+        self.token_uri = info.get("token_uri", GOOGLE_TOKEN_URI)
+        self.refresh_margin = refresh_margin
+        self._claims = {
+            "iss": info["client_email"],
+            "scope": " ".join(scopes),
+            "aud": self.token_uri,
+        }
+        self._signer = crypt.RSASigner.from_service_account_info(info)
+        self._session = session
+        # The access token and the monotonic time at which it must be refreshed.
+        self._token: tuple[str, float] | None = None
+        self._lock = asyncio.Lock()
+
+    async def get_token(self) -> str:
+        """Get a valid access token, refreshing it if it is about to expire.
+
+        Returns:
+            str: The access token.
+        """
+        if self._token is not None and time.monotonic() < self._token[1]:
+            return self._token[0]
+
+        async with self._lock:
+            if self._token is None or time.monotonic() >= self._token[1]:
+                self._token = await self._refresh()
+
+            return self._token[0]
+
+    def invalidate(self) -> None:
+        """Drop the cached token, e.g. after the API rejected it."""
+        self._token = None
+
+    async def _refresh(self) -> tuple[str, float]:
+        issued_at = int(time.time())
+        assertion = jwt.encode(
+            self._signer,
+            self._claims | {"iat": issued_at, "exp": issued_at + 3600},
+        ).decode()
+
+        async with self._session.post(
+            self.token_uri,
+            data={
+                "grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer",
+                "assertion": assertion,
+            },
+            raise_for_status=True,
+        ) as response:
+            token = await response.json()
+
+        return (
+            token["access_token"],
+            time.monotonic() + token.get("expires_in", 3600) - self.refresh_margin,
+        )
+
+
+class GoogleDriveClient:
+    """Asynchronous Google Drive client.
+
+    Talks to the Drive v3 API directly over aiohttp.
+    """
+
+    # Files larger than this are sent with a resumable upload, in chunks of
+    # `resumable_chunk_size` bytes (a multiple of 256 KiB, as Drive requires).
+    resumable_upload_threshold = 5 * 1024 * 1024
+    resumable_chunk_size = 8 * 1024 * 1024
+
+    api_url: str
+    upload_api_url: str
+    max_concurrent_uploads: int
+    max_upload_retries: int
+    max_concurrent_deletes: int
+
+    session: aiohttp.ClientSession
+    token_source: ServiceAccountTokenSource
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        client_json_file_path: str,
+        *,
+        max_concurrent_uploads: int = 8,
+        max_upload_retries: int = 3,
+        max_connections_per_host: int = 16,
+        keepalive_timeout: float = 30.0,
+        max_concurrent_deletes: int = 16,
+        api_url: str = GDRIVE_API_URL,
+        upload_api_url: str = GDRIVE_UPLOAD_API_URL,
+    ) -> None:
+        self.api_url = api_url
+        self.upload_api_url = upload_api_url
+        self.max_concurrent_uploads = max_concurrent_uploads
+        self.max_upload_retries = max_upload_retries
+        self.max_concurrent_deletes = max_concurrent_deletes
+        self._create_client_session(max_connections_per_host, keepalive_timeout)
+        self.token_source = ServiceAccountTokenSource(
+            client_json_file_path=client_json_file_path, session=self.session
+        )
+
+    def _create_client_session(
+        self, max_connections_per_host: int, keepalive_timeout: float
+    ) -> None:
+        """Initialize the client session used for Drive API calls.
+
+        Connections are kept alive and reused, so a batch doesn't pay for a new TCP
+        and TLS handshake per request.
+        """
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit_per_host=max_connections_per_host,
+                keepalive_timeout=keepalive_timeout,
+            )
+        )
+
+    async def _request(
+        self, method: str, url: str, **kwargs: typing.Any
+    ) -> tuple[int, typing.Mapping[str, str], typing.Any]:
+        """Make an authorized Drive API request.
+
+        A request rejected with 401 is retried once with a fresh access token.
+
+        Raises:
+            aiohttp.ClientResponseError: If Drive responds with an error status.
+
+        Returns:
+            tuple[int, typing.Mapping[str, str], typing.Any]: The status, headers and
+                decoded JSON body (`None` if empty) of the response.
+        """
+        headers = dict(kwargs.pop("headers", None) or {})
+        refreshed = False
+
+        while True:
+            headers["Authorization"] = f"Bearer {await self.token_source.get_token()}"
+
+            async with self.session.request(
+                method, url, headers=headers, **kwargs
+            ) as response:
+                if response.status == 401 and not refreshed:
+                    self.token_source.invalidate()
+                    refreshed = True
+                    continue
+
+                response.raise_for_status()
+                body = await response.read()
+
+                return (
+                    response.status,
+                    response.headers,
+                    json.loads(body) if body else None,
+                )
+
+    async def share_publicly(self, file_id: str) -> None:
+        """Let anyone with the link read a file or folder.
+
+        Files inherit the permissions of their folder, so sharing a folder once
+        shares everything uploaded to it.
+
+        Args:
+            file_id (str): ID of the file or folder to share.
+        """
+        with metrics.track_request("gdrive", "share"):
+            await self._request(
+                "POST",
+                f"{self.api_url}/files/{file_id}/permissions",
+                params={"supportsAllDrives": "true"},
+                json={"type": "anyone", "role": "reader"},
+            )
+
+    async def create_folder(
+        self, folder_name: str, share: bool = False
+    ) -> dict[str, typing.Any]:
+        """Create a Google Drive folder.
+
+        Args:
+            folder_name (str): The name of the folder to create.
+            share (bool): Whether anyone with the link may read the folder and the
+                files uploaded to it.
+
+        Returns:
+            dict[str, typing.Any]: The ID and name of the folder.
+        """
+        with metrics.track_request("gdrive", "create_folder"):
+            _, _, folder = await self._request(
+                "POST",
+                f"{self.api_url}/files",
+                params={"supportsAllDrives": "true", "fields": "id, name"},
+                json={"name": folder_name, "mimeType": GDRIVE_FOLDER_MIME_TYPE},
+            )
+
+        if share:
+            await self.share_publicly(folder["id"])
+
+        return folder
+
+    async def upload_file(  # pylint: disable=too-many-arguments
+        self,
+        file: bytes | io.BytesIO,
+        file_name: str,
+        folder_id: str,
+        share: bool = True,
+    ) -> tuple[str, str]:
+        """Upload a file object to a Google Drive folder.
+
+        Small files are sent in a single multipart request; larger files use a
+        resumable upload. Creating a file isn't idempotent, so before a failed
+        upload is retried, the folder is searched for a file of the same name that
+        the failed attempt may have created. Sharing is retried on its own, on the
+        file that was already created.
+
+        Args:
+            file (io.BytesIO): The file content.
+            file_name (str): The name of the file to upload.
+            folder_id (str): ID of the where the file will be stored.
+            share (bool): Whether to share the file on its own. Pass `False` if the
+                folder is already shared.
+
+        Returns:
+            tuple[str, str]: A shareable link to the uploaded file and the file ID,
+                respectively.
+        """
+        content = file.getvalue() if isinstance(file, io.BytesIO) else file
+        metadata = {
+            "name": file_name,
+            "parents": [folder_id],
+            "mimeType": mimetypes.guess_type(file_name)[0]
+            or "application/octet-stream",
+        }
+
+        retry_policy = jobs.RetryPolicy(max_retries=self.max_upload_retries)
+        file_id = await retry_policy.call(
+            lambda: self._create_file(metadata, content),
+            recover=lambda: self._find_file(file_name, folder_id),
+        )
+        metrics.inc("certinize_stage_bytes_total", len(content), stage="upload")
+
+        if share:
+            await retry_policy.call(lambda: self.share_publicly(file_id))
+
+        return drive_download_link(file_id), file_id
+
+    async def _create_file(
+        self, metadata: dict[str, typing.Any], content: bytes
+    ) -> str:
+        with metrics.track_request("gdrive", "upload"):
+            if len(content) > self.resumable_upload_threshold:
+                return await self._upload_resumable(metadata, content)
+
+            return await self._upload_multipart(metadata, content)
+
+    async def _find_file(self, file_name: str, folder_id: str) -> str | None:
+        escaped_name = file_name.replace("\\", "\\\\").replace("'", "\\'")
+        files_ = await self.get_files(
+            query={
+                "q": f"name = '{escaped_name}' and '{folder_id}' in parents "
+                "and trashed = false"
+            }
+        )
+
+        return files_[0]["id"] if files_ else None
+
+    async def _upload_multipart(
+        self, metadata: dict[str, typing.Any], content: bytes
+    ) -> str:
+        with aiohttp.MultipartWriter("related") as body:
+            body.append_json(metadata)
+            body.append(content, {"Content-Type": metadata["mimeType"]})
+
+        _, _, file_ = await self._request(
+            "POST",
+            f"{self.upload_api_url}/files",
+            params={
+                "uploadType": "multipart",
+                "supportsAllDrives": "true",
+                "fields": "id",
+            },
+            data=body,
+        )
+
+        return file_["id"]
+
+    async def _upload_resumable(
+        self, metadata: dict[str, typing.Any], content: bytes
+    ) -> str:
+        _, headers, _ = await self._request(
+            "POST",
+            f"{self.upload_api_url}/files",
+            params={
+                "uploadType": "resumable",
+                "supportsAllDrives": "true",
+                "fields": "id",
+            },
+            headers={
+                "X-Upload-Content-Type": metadata["mimeType"],
+                "X-Upload-Content-Length": str(len(content)),
+            },
+            json=metadata,
+        )
+        session_uri = headers["Location"]
+        view = memoryview(content)
+        offset = 0
+
+        while True:
+            end = min(offset + self.resumable_chunk_size, len(content))
+            chunk = view[offset:end]
+            status, headers, file_ = await self._request(
+                "PUT",
+                session_uri,
+                headers={"Content-Range": f"bytes {offset}-{end - 1}/{len(content)}"},
+                data=chunk,
+                # Drive answers 308 to a chunk that doesn't finish the upload.
+                allow_redirects=False,
+            )
+
+            if status != 308:
+                return file_["id"]
+
+            # The Range header holds the bytes Drive has received so far, e.g.
+            # "bytes=0-524287".
+            received = headers.get("Range")
+            offset = int(received.rpartition("-")[2]) + 1 if received else 0
+
+    async def upload_files_as_ready(
+        self,
+        files_: typing.AsyncIterable[tuple[int, tuple[bytes | io.BytesIO, str]]],
+        folder_id: str,
+        share: bool = True,
+        on_uploaded: (
+            typing.Callable[[int, tuple[str, str]], typing.Awaitable[None]] | None
+        ) = None,
+    ) -> list[tuple[str, str]]:
+        """Upload file objects to a Google Drive folder as they are produced.
+
+        At most `max_concurrent_uploads` files are uploaded at a time, and uploads
+        rejected with a rate-limit or server error are retried with backoff. The
+        next file is pulled only when an upload slot is free, so files can be
+        streamed in without holding the whole batch.
+
+        Args:
+            files_ (typing.AsyncIterable[tuple[int, tuple[bytes | io.BytesIO, str]]]):
+                The position of each file in the result, and its content and name.
+            folder_id (str): ID of the where the files will be stored.
+            share (bool): Whether to share each file on its own. Pass `False` if the
+                folder is already shared.
+            on_uploaded (typing.Callable[[int, tuple[str, str]],
+                typing.Awaitable[None]] | None): Called with the position, shareable
+                link and file ID of each file as soon as it is uploaded.
+
+        Returns:
+            list[tuple[str, str]]: The shareable link and file ID of each file,
+                ordered by position.
+        """
+
+        async def upload(file: tuple[bytes | io.BytesIO, str]) -> tuple[str, str]:
+            content, file_name = file
+            return await self.upload_file(
+                file=content,
+                file_name=file_name,
+                folder_id=folder_id,
+                share=share,
+            )
+
+        # Uploads aren't safe to repeat as a whole; `upload_file()` retries each of
+        # its steps on its own.
+        return await jobs.BoundedTaskRunner(
+            task=upload, max_concurrency=self.max_concurrent_uploads
+        ).run_as_ready(files_, on_result=on_uploaded)
+
+    async def get_files(self, query: dict[str, str]) -> list[dict[str, typing.Any]]:
+        """Retrieve all files using a specified search query.
+
+        For a list of possible search terms, refer to the Drive API docs:
+        https://developers.google.com/drive/api/guides/ref-search-terms
+
+        Args:
+            query (dict[str, str]): A query string containing a query term, operator,
+                and values.
+
+        Returns:
+            list[dict[str, typing.Any]]: Files that matched the search query.
+        """
+        params = {
+            "pageSize": "1000",
+            "fields": "nextPageToken, files(id, name, mimeType, parents)",
+            "supportsAllDrives": "true",
+            "includeItemsFromAllDrives": "true",
+        } | query
+        gdrive_files: list[dict[str, typing.Any]] = []
+
+        while True:
+            with metrics.track_request("gdrive", "list"):
+                _, _, file_list = await self._request(
+                    "GET", f"{self.api_url}/files", params=params
+                )
+            gdrive_files.extend(file_list.get("files", []))
+
+            if not (page_token := file_list.get("nextPageToken")):
+                return gdrive_files
+
+            params = params | {"pageToken": page_token}
+
+    async def get_all_files(self) -> list[dict[str, typing.Any]]:
+        """Retrieve all files, including folders and subfolders, from Google Drive.
+
+        Returns:
+            list[dict[str, typing.Any]]: List of files stored in Google Drive.
+        """
+        return await self.get_files(query={"q": "trashed=false"})
+
+    async def delete_file(self, file_id: str) -> None:
+        """Permanently delete a file or folder.
+
+        Args:
+            file_id (str): ID of the file to delete.
+        """
+        with metrics.track_request("gdrive", "delete"):
+            await self._request(
+                "DELETE",
+                f"{self.api_url}/files/{file_id}",
+                params={"supportsAllDrives": "true"},
+            )
+
+    async def delete_files(self, file_ids: typing.Iterable[str]) -> None:
+        """Permanently delete files concurrently.
+
+        At most `max_concurrent_deletes` files are deleted at a time, and deletes
+        rejected with a rate-limit or server error are retried with backoff. Files
+        that are already gone, e.g. because their folder was deleted first, are
+        skipped.
+
+        Args:
+            file_ids (typing.Iterable[str]): IDs of the files to delete.
+        """
+
+        async def delete(file_id: str) -> None:
+            try:
+                await self.delete_file(file_id=file_id)
+            except aiohttp.ClientResponseError as response_err:
+                if response_err.status != 404:
+                    raise
+
+        # Deleting a file again is harmless, so whole deletes are retried.
+        await jobs.BoundedTaskRunner(
+            task=delete,
+            max_concurrency=self.max_concurrent_deletes,
+            retry_policy=jobs.RetryPolicy(max_retries=self.max_upload_retries),
+        ).run(file_ids)
+
+    async def delete_folder(self, folder_id: str) -> None:
+        """Permanently delete a folder's content and the folder itself.
+
+        Args:
+            folder_id (str): ID of the folder to delete.
+        """
+        folder_files = await self.get_files(
+            query={"q": f"'{folder_id}' in parents and trashed=false"}
+        )
+
+        await self.delete_files(file_ids=[file["id"] for file in folder_files])
+        await self.delete_file(file_id=folder_id)
+
+    async def delete_all_files(self) -> None:
+        """Permanently delete all files, including folders and subfolders."""
+        # Every file is listed before anything is deleted, so the deletes can't
+        # shift the pages still to be read.
+        gdrive_files = await self.get_files(query={"q": "trashed=false"})
+
+        await self.delete_files(file_ids=[file["id"] for file in gdrive_files])
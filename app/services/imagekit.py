@@ -0,0 +1,127 @@
+"""
+app.services.imagekit
+~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import base64
+import typing
+
+import aiohttp
+
+from app.services.metrics import metrics
+
+IMAGEKIT_UPLOAD_API = "https://upload.imagekit.io"
+IMAGEKIT_FILE_UPLOAD = "/api/v1/files/upload"
+
+
+class ImageKitClient:
+    """Asynchronous ImageKit client."""
+
+    DEFAULT_ENCODING = "utf-8"
+
+    _private_key = ""
+    _public_key = ""
+    _endpoint_url = ""
+    _headers = {}
+
+    session: aiohttp.ClientSession
+    upload_api_url: str
+
+    def __init__(
+        self,
+        private_key: str,
+        public_key: str,
+        url_endpoint: str,
+        upload_api_url: str = IMAGEKIT_UPLOAD_API,
+    ) -> None:
+        self._private_key = private_key
+        self._public_key = public_key
+        self._endpoint_url = url_endpoint
+        self.upload_api_url = upload_api_url
+        self._create_request_header()
+        self._create_client_session()
+
+    def _create_request_header(self) -> None:
+        """Create default headers for the client session."""
+        base64_private_key = base64.b64encode(
+            f"{self._private_key}:".encode(encoding=self.DEFAULT_ENCODING)
+        ).decode(encoding=self.DEFAULT_ENCODING)
+        self._headers = {"Authorization": f"Basic {base64_private_key}"}
+
+    def _create_client_session(self) -> None:
+        """Initialize the client session."""
+        self.session = aiohttp.ClientSession(headers=self._headers)
+
+    async def create_folder(
+        self, folder_name: str, parent_folder_path: str
+    ) -> dict[str, str | typing.Any]:
+        """Create a folder in the ImageKit.io media library.
+
+        References:
+            https://docs.imagekit.io/api-reference
+
+        Args:
+            folder_name (str): The name of the folder to be created.
+            parent_folder_path (str): The folder where the new folder should be
+                created.
+
+        Returns:
+            dict[str, str | typing.Any]: JSON object containing the result of the
+                folder creation process.
+        """
+        url = f"{self.upload_api_url}{IMAGEKIT_FILE_UPLOAD}"
+        request_body = {
+            "folderName": folder_name,
+            "parentFolderPath": parent_folder_path,
+        }
+        with metrics.track_request("imagekit", "create_folder"):
+            response = await self.session.post(url=url, json=request_body)
+            json_response = await response.json()
+
+        if json_response == "{}":
+            return request_body
+        return json_response
+
+    async def upload_file(
+        self,
+        file: str | bytes | typing.AsyncIterable[bytes],
+        file_name: str,
+        options: dict[str, typing.Any],
+        content_type: str = "image/jpeg",
+    ) -> dict[str, typing.Any]:
+        """Upload files to the ImageKit.io media library.
+
+        Binary content is sent as is; an async iterable of chunks is streamed into
+        the request body without being buffered.
+
+        References:
+            https://docs.imagekit.io/api-reference
+
+        Args:
+            file (str | bytes | typing.AsyncIterable[bytes]): The file content,
+                either raw or base64 encoded, or URL.
+            file_name (str): The name with which the file has to be uploaded.
+            options (dict[str, typing.Any]): The rest of the requst structure.
+            content_type (str, optional): The content type of binary content.
+                Defaults to "image/jpeg".
+
+        Returns:
+            dict[str, typing.Any]: Dictionary containing the uploaded file details.
+        """
+        url = f"{self.upload_api_url}{IMAGEKIT_FILE_UPLOAD}"
+        request_body = {**{"fileName": file_name}, **options}
+        form_data = aiohttp.FormData()
+
+        for key, value in request_body.items():
+            form_data.add_field(key, value)
+
+        if isinstance(file, str):
+            form_data.add_field("file", file, content_type=content_type)
+        else:
+            form_data.add_field(
+                "file", file, content_type=content_type, filename=file_name
+            )
+
+        with metrics.track_request("imagekit", "upload"):
+            response = await self.session.post(url=url, data=form_data)
+            return await response.json()
@@ -0,0 +1,601 @@
+"""
+app.services.jobs
+~~~~~~~~~~~~~~~~~
+"""
+
+import asyncio
+import collections
+import dataclasses
+import hashlib
+import json
+import math
+import os
+import random
+import socket
+import time
+import typing
+
+import aiohttp
+
+from app import models
+from app.services import sqlite
+
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+TaskInput = typing.TypeVar("TaskInput")
+TaskOutput = typing.TypeVar("TaskOutput")
+RetryResult = typing.TypeVar("RetryResult")
+
+
+def get_error_status(err: BaseException) -> int | None:
+    """Get the HTTP status code carried by a storage client error, if any."""
+    if isinstance(err, aiohttp.ClientResponseError):
+        return err.status
+
+    return None
+
+
+def is_retryable_error(err: BaseException) -> bool:
+    """Check whether a failed storage call is worth retrying."""
+    if isinstance(err, (aiohttp.ServerDisconnectedError, asyncio.TimeoutError)):
+        return True
+
+    return get_error_status(err) in RETRYABLE_STATUS_CODES
+
+
+@dataclasses.dataclass(frozen=True)
+class RetryPolicy:
+    """Retries calls that fail with a rate-limit or server error.
+
+    Each retry waits with exponential backoff and full jitter.
+    """
+
+    max_retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+
+    async def call(
+        self,
+        func: typing.Callable[[], typing.Awaitable[RetryResult]],
+        recover: (
+            typing.Callable[[], typing.Awaitable[RetryResult | None]] | None
+        ) = None,
+    ) -> RetryResult:
+        """Call `func`, retrying it if it fails with a retryable error.
+
+        Args:
+            func (typing.Callable[[], typing.Awaitable[RetryResult]]): The call.
+            recover (typing.Callable[[], typing.Awaitable[RetryResult | None]]
+                | None): Called before each retry of a call that isn't idempotent.
+                If the failed call took effect after all, it returns that result
+                and `func` isn't called again.
+
+        Returns:
+            RetryResult: The result of the call.
+        """
+        attempt = 0
+
+        while True:
+            try:
+                if attempt and recover is not None:
+                    if (result := await recover()) is not None:
+                        return result
+
+                return await func()
+            except Exception as err:  # pylint: disable=broad-except
+                if attempt >= self.max_retries or not is_retryable_error(err):
+                    raise
+
+                delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+                await asyncio.sleep(random.uniform(0, delay))
+                attempt += 1
+
+
+class BoundedTaskRunner(typing.Generic[TaskInput, TaskOutput]):
+    """Run a task for each item concurrently, with a bounded number in flight.
+
+    Results are returned in input order. With a `retry_policy`, tasks that fail
+    with a rate-limit or server error are retried; only pass one if the task is
+    safe to repeat.
+    """
+
+    task: typing.Callable[[TaskInput], typing.Awaitable[TaskOutput]]
+    max_concurrency: int
+    retry_policy: RetryPolicy | None
+
+    def __init__(
+        self,
+        task: typing.Callable[[TaskInput], typing.Awaitable[TaskOutput]],
+        max_concurrency: int = 8,
+        retry_policy: RetryPolicy | None = None,
+    ) -> None:
+        self.task = task
+        self.max_concurrency = max_concurrency
+        self.retry_policy = retry_policy
+
+    async def _run_task(self, item: TaskInput) -> TaskOutput:
+        if self.retry_policy is None:
+            return await self.task(item)
+
+        return await self.retry_policy.call(lambda: self.task(item))
+
+    async def run(self, items: typing.Iterable[TaskInput]) -> list[TaskOutput]:
+        """Run the task for every item.
+
+        Args:
+            items (typing.Iterable[TaskInput]): The items to run the task for.
+
+        Returns:
+            list[TaskOutput]: The task results, in the same order as `items`.
+        """
+
+        async def indexed() -> typing.AsyncIterator[tuple[int, TaskInput]]:
+            for index, item in enumerate(items):
+                yield index, item
+
+        return await self.run_as_ready(indexed())
+
+    async def run_as_ready(
+        self,
+        items: typing.AsyncIterable[tuple[int, TaskInput]],
+        on_result: (
+            typing.Callable[[int, TaskOutput], typing.Awaitable[None]] | None
+        ) = None,
+    ) -> list[TaskOutput]:
+        """Run the task for items as they are produced.
+
+        The next item is only pulled from `items` once a slot is free, so a slow
+        task applies backpressure to the producer, and each item is released as
+        soon as its task finishes. If a task fails, no further items are pulled and
+        the remaining tasks are cancelled.
+
+        Args:
+            items (typing.AsyncIterable[tuple[int, TaskInput]]): The position of
+                each item in the result and the item itself.
+            on_result (typing.Callable[[int, TaskOutput], typing.Awaitable[None]]
+                | None): Called with the position and result of each item as soon
+                as its task is done.
+
+        Returns:
+            list[TaskOutput]: The task results, ordered by position.
+        """
+
+        async def run_task(index: int, item: TaskInput) -> TaskOutput:
+            result = await self._run_task(item)
+
+            if on_result is not None:
+                await on_result(index, result)
+
+            return result
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks: dict[int, asyncio.Task[TaskOutput]] = {}
+        failures: list[asyncio.Task[TaskOutput]] = []
+
+        def on_done(task: asyncio.Task[TaskOutput]) -> None:
+            semaphore.release()
+
+            if not task.cancelled() and task.exception() is not None:
+                failures.append(task)
+
+        iterator = aiter(items)
+
+        try:
+            while not failures:
+                await semaphore.acquire()
+
+                try:
+                    index, item = await anext(iterator)
+                except StopAsyncIteration:
+                    semaphore.release()
+                    break
+
+                task = asyncio.create_task(run_task(index, item))
+                task.add_done_callback(on_done)
+                tasks[index] = task
+
+            results = await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        return [result for _, result in sorted(zip(tasks, results), key=lambda r: r[0])]
+
+
+class IdempotencyKeyConflictError(ValueError):
+    """Raised when an idempotency key is reused for a different request."""
+
+
+CoalescedResult = typing.TypeVar("CoalescedResult")
+
+
+class RequestCoalescer:
+    """Runs identical requests once and shares the result.
+
+    While a request is running, a request with the same key waits for its result
+    instead of running again. Results of requests that carried an idempotency key
+    are also kept for `ttl` seconds so that replays get the same response.
+    """
+
+    max_entries: int
+    ttl: float
+    coalesced: int
+    replayed: int
+
+    def __init__(self, max_entries: int = 10_000, ttl: float = 86400.0) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.coalesced = 0
+        self.replayed = 0
+        self._in_flight: dict[str, tuple[str, asyncio.Future[typing.Any]]] = {}
+        self._results: collections.OrderedDict[str, tuple[float, str, typing.Any]] = (
+            collections.OrderedDict()
+        )
+
+    @staticmethod
+    def fingerprint(payload: bytes) -> str:
+        """Hash a request payload.
+
+        Args:
+            payload (bytes): The request payload.
+
+        Returns:
+            str: The payload's fingerprint.
+        """
+        return hashlib.sha256(payload).hexdigest()
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: str,
+        func: typing.Callable[[], typing.Awaitable[CoalescedResult]],
+        remember: bool = False,
+    ) -> CoalescedResult:
+        """Run a request, or share the result of an identical one.
+
+        The request keeps running if the caller goes away, so that the callers
+        still waiting on it, and replays of it, get its result.
+
+        Args:
+            key (str): The request key, e.g. its idempotency key.
+            fingerprint (str): The fingerprint of the request payload.
+            func (typing.Callable[[], typing.Awaitable[CoalescedResult]]): Runs the
+                request.
+            remember (bool, optional): Whether to keep the result for replays.
+                Defaults to False.
+
+        Raises:
+            IdempotencyKeyConflictError: The key was used for a different payload.
+
+        Returns:
+            CoalescedResult: The result of the request.
+        """
+        if (entry := self._results.get(key)) is not None:
+            expires_at, result_fingerprint, result = entry
+
+            if time.monotonic() < expires_at:
+                self._check_fingerprint(key, result_fingerprint, fingerprint)
+                self._results.move_to_end(key)
+                self.replayed += 1
+                return result
+
+            del self._results[key]
+
+        if (in_flight := self._in_flight.get(key)) is not None:
+            task_fingerprint, task = in_flight
+            self._check_fingerprint(key, task_fingerprint, fingerprint)
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(func())
+        self._in_flight[key] = (fingerprint, task)
+        task.add_done_callback(
+            lambda task_: self._finish(key, fingerprint, task_, remember)
+        )
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _check_fingerprint(key: str, expected: str, actual: str) -> None:
+        if expected != actual:
+            raise IdempotencyKeyConflictError(
+                f"Key {key!r} was already used for a different request."
+            )
+
+    def _finish(
+        self,
+        key: str,
+        fingerprint: str,
+        task: asyncio.Future[typing.Any],
+        remember: bool,
+    ) -> None:
+        self._in_flight.pop(key, None)
+
+        if not remember or task.cancelled() or task.exception() is not None:
+            return
+
+        self._results[key] = (time.monotonic() + self.ttl, fingerprint, task.result())
+        self._results.move_to_end(key)
+
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "in_flight": len(self._in_flight),
+            "size": len(self._results),
+            "max_entries": self.max_entries,
+            "coalesced": self.coalesced,
+            "replayed": self.replayed,
+        }
+
+
+class JobQueueFullError(Exception):
+    """Raised when the job queue can't take any more jobs."""
+
+
+class InMemoryJobStore:
+    """Keeps certificate jobs in memory.
+
+    Only the most recent `max_jobs` jobs are kept; the oldest finished jobs are
+    dropped first.
+    """
+
+    max_jobs: int
+
+    def __init__(self, max_jobs: int = 1000) -> None:
+        self.max_jobs = max_jobs
+        self._jobs: dict[str, models.CertificateJob] = {}
+
+    async def save(self, job: models.CertificateJob) -> None:
+        job.updated_at = time.time()
+        self._jobs[job.job_id] = job
+
+        if len(self._jobs) > self.max_jobs:
+            finished = [job_ for job_ in self._jobs.values() if job_.status.is_finished]
+
+            for job_ in sorted(finished, key=lambda job_: job_.updated_at)[
+                : len(self._jobs) - self.max_jobs
+            ]:
+                del self._jobs[job_.job_id]
+
+    async def get(self, job_id: str) -> models.CertificateJob | None:
+        return self._jobs.get(job_id)
+
+    async def close(self) -> None:
+        self._jobs.clear()
+
+
+def _is_process_alive(pid: int) -> bool:
+    """Check whether a process with the given ID is running on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to another user.
+        return True
+
+    return True
+
+
+class SQLiteJobStore(sqlite.SQLiteStore):
+    """Keeps certificate jobs in a local SQLite database.
+
+    Jobs survive a restart of the app. Every job records the host and process that
+    saved it, so several worker processes on one host can share the database: when
+    a worker starts, `fail_unfinished()` only marks as failed the queued or running
+    jobs of processes that are gone, never those a sibling worker is still running.
+    """
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS certificate_jobs "
+        "(job_id TEXT PRIMARY KEY, job TEXT NOT NULL, updated_at REAL NOT NULL, "
+        "owner_host TEXT NOT NULL, owner_pid INTEGER NOT NULL)"
+    )
+
+    def _save(self, job: models.CertificateJob) -> None:
+        self._execute(
+            "INSERT OR REPLACE INTO certificate_jobs "
+            "(job_id, job, updated_at, owner_host, owner_pid) VALUES (?, ?, ?, ?, ?)",
+            (
+                job.job_id,
+                json.dumps(job.to_dict()),
+                job.updated_at,
+                socket.gethostname(),
+                os.getpid(),
+            ),
+        )
+
+    def _get(self, job_id: str) -> models.CertificateJob | None:
+        row = self._fetchone(
+            "SELECT job FROM certificate_jobs WHERE job_id = ?", (job_id,)
+        )
+        return models.CertificateJob.from_dict(json.loads(row[0])) if row else None
+
+    def _fail_unfinished(self) -> None:
+        rows = self._connection.execute(
+            "SELECT job, owner_pid FROM certificate_jobs WHERE owner_host = ?",
+            (socket.gethostname(),),
+        ).fetchall()
+
+        for row, owner_pid in rows:
+            job = models.CertificateJob.from_dict(json.loads(row))
+
+            # This runs before the process saves any job, so a job that claims to
+            # be ours belongs to an earlier process that had the same ID.
+            if not job.status.is_finished and (
+                owner_pid == os.getpid() or not _is_process_alive(owner_pid)
+            ):
+                job.status = models.JobStatus.FAILED
+                job.error = "The job was interrupted by a restart."
+                job.updated_at = time.time()
+                self._save(job)
+
+    async def save(self, job: models.CertificateJob) -> None:
+        job.updated_at = time.time()
+        await self._run(self._save, job)
+
+    async def get(self, job_id: str) -> models.CertificateJob | None:
+        return await self._run(self._get, job_id)
+
+    async def fail_unfinished(self) -> None:
+        """Mark as failed the unfinished jobs of processes that are no longer running.
+
+        Call this when the store is opened, before any job is saved.
+        """
+        await self._run(self._fail_unfinished)
+
+
+JobStore = InMemoryJobStore | SQLiteJobStore
+JobFunction = typing.Callable[[models.CertificateJob], typing.Awaitable[None]]
+
+
+class CertificateJobRunner:  # pylint: disable=too-many-instance-attributes
+    """Runs certificate jobs in the background.
+
+    Jobs wait in a bounded queue and are picked up by `workers` worker tasks. A job
+    function reports progress by updating the job and calling `save_progress()`,
+    which saves the job at most once every `progress_interval` seconds; the job is
+    always saved once more when it finishes.
+    """
+
+    store: JobStore
+    workers: int
+    progress_interval: float
+
+    def __init__(
+        self,
+        store: JobStore,
+        max_queue_size: int = 32,
+        workers: int = 1,
+        progress_interval: float = 1.0,
+    ):
+        self.store = store
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self._queue: asyncio.Queue[tuple[models.CertificateJob, JobFunction]] = (
+            asyncio.Queue(max_queue_size)
+        )
+        self._worker_tasks: list[asyncio.Task[None]] = []
+        self._running: dict[str, asyncio.Task[None]] = {}
+        self._cancelled: set[str] = set()
+        self._saved_at: dict[str, float] = {}
+
+    @property
+    def queued(self) -> int:
+        """Number of jobs waiting for a worker."""
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        self._worker_tasks = [
+            asyncio.create_task(self._work()) for _ in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in [*self._worker_tasks, *self._running.values()]:
+            task.cancel()
+
+        await asyncio.gather(
+            *self._worker_tasks, *self._running.values(), return_exceptions=True
+        )
+        await self.store.close()
+
+    async def save_progress(self, job: models.CertificateJob) -> None:
+        now = time.monotonic()
+
+        if now - self._saved_at.get(job.job_id, -math.inf) >= self.progress_interval:
+            await self.store.save(job)
+            self._saved_at[job.job_id] = now
+
+    async def submit(self, job: models.CertificateJob, func: JobFunction) -> None:
+        """Queue a job.
+
+        Args:
+            job (models.CertificateJob): The job to run.
+            func (JobFunction): Coroutine function that does the work of the job.
+
+        Raises:
+            JobQueueFullError: If the queue is full.
+        """
+        try:
+            self._queue.put_nowait((job, func))
+        except asyncio.QueueFull as queue_err:
+            raise JobQueueFullError("Too many certificate jobs are queued.") from (
+                queue_err
+            )
+
+        await self.store.save(job)
+
+    async def cancel(self, job_id: str) -> models.CertificateJob | None:
+        """Cancel a queued or running job.
+
+        Args:
+            job_id (str): ID of the job to cancel.
+
+        Returns:
+            models.CertificateJob | None: The job, or `None` if it doesn't exist.
+        """
+        if (job := await self.store.get(job_id)) is None or job.status.is_finished:
+            return job
+
+        if (task := self._running.get(job_id)) is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        else:
+            # Still queued; the worker skips it when it comes up.
+            self._cancelled.add(job_id)
+
+        # A job cancelled before it got to run never records its own cancellation.
+        if (job := await self.store.get(job_id)) is not None and (
+            not job.status.is_finished
+        ):
+            job.status = models.JobStatus.CANCELLED
+            await self.store.save(job)
+
+        return job
+
+    async def _work(self) -> None:
+        while True:
+            job, func = await self._queue.get()
+
+            try:
+                if job.job_id in self._cancelled:
+                    self._cancelled.discard(job.job_id)
+                    continue
+
+                task = asyncio.create_task(self._run(job, func))
+                self._running[job.job_id] = task
+
+                try:
+                    # Unlike awaiting the task, this doesn't raise when only the job
+                    # is cancelled, and it doesn't cancel the job when the runner
+                    # is stopping.
+                    await asyncio.wait([task])
+                finally:
+                    self._running.pop(job.job_id, None)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: models.CertificateJob, func: JobFunction) -> None:
+        job.status = models.JobStatus.RUNNING
+        await self.store.save(job)
+        self._saved_at[job.job_id] = time.monotonic()
+
+        try:
+            await func(job)
+        except asyncio.CancelledError:
+            job.status = models.JobStatus.CANCELLED
+            await self.store.save(job)
+            raise
+        except Exception as err:  # pylint: disable=broad-except
+            job.status = models.JobStatus.FAILED
+            job.error = getattr(err, "detail", None) or str(err) or repr(err)
+            await self.store.save(job)
+        else:
+            job.status = models.JobStatus.SUCCEEDED
+            await self.store.save(job)
+        finally:
+            self._saved_at.pop(job.job_id, None)
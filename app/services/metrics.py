@@ -0,0 +1,197 @@
+"""
+app.services.metrics
+~~~~~~~~~~~~~~~~~~~~
+"""
+
+import bisect
+import collections
+import contextlib
+import threading
+import time
+import typing
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS = {
+    "certinize_stage_duration_seconds": (
+        "histogram",
+        "Time spent in each stage of e-Certificate generation.",
+    ),
+    "certinize_stage_bytes_total": (
+        "counter",
+        "Bytes downloaded or produced by each stage of e-Certificate generation.",
+    ),
+    "certinize_render_tasks_in_flight": (
+        "gauge",
+        "e-Certificates queued or rendering on the image processor's executor.",
+    ),
+    "certinize_font_cache_lookups_total": (
+        "counter",
+        "Parsed-font cache lookups made by the render workers, by outcome.",
+    ),
+    "certinize_font_cache_fonts": (
+        "gauge",
+        "Parsed fonts held in the render workers' font caches.",
+    ),
+    "certinize_storage_requests_total": (
+        "counter",
+        "Requests made to storage providers, by operation and outcome.",
+    ),
+    "certinize_storage_request_duration_seconds": (
+        "histogram",
+        "Latency of requests made to storage providers.",
+    ),
+    "certinize_storage_requests_in_flight": (
+        "gauge",
+        "Requests to storage providers that haven't finished yet.",
+    ),
+    "certinize_certificate_jobs_queued": (
+        "gauge",
+        "Certificate jobs waiting for a worker.",
+    ),
+}
+
+MetricLabels = tuple[tuple[str, str], ...]
+
+
+class Metrics:
+    """Counters, gauges and histograms of this process, rendered in the Prometheus
+    text format.
+
+    Recording a value is a dictionary update under a lock, cheap enough to leave
+    on for every request. Metrics are described in `METRICS`.
+    """
+
+    buckets: tuple[float, ...]
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self._values: dict[tuple[str, MetricLabels], float] = {}
+        # Per-bucket counts, followed by the sum and count of the observations.
+        self._histograms: dict[tuple[str, MetricLabels], list[float]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        """Add to a counter or gauge."""
+        key = (name, tuple(sorted(labels.items())))
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        """Set a gauge."""
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = float(value)
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Record an observation in a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            if (histogram := self._histograms.get(key)) is None:
+                histogram = self._histograms[key] = [0.0] * (len(self.buckets) + 2)
+
+            if bucket < len(self.buckets):
+                histogram[bucket] += 1
+
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, name: str, **labels: str) -> typing.Iterator[None]:
+        """Record how long the block takes in a histogram."""
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @contextlib.contextmanager
+    def track_request(self, provider: str, operation: str) -> typing.Iterator[None]:
+        """Count, time and track a request made to a storage provider."""
+        self.inc("certinize_storage_requests_in_flight", provider=provider)
+        started = time.perf_counter()
+        outcome = "error"
+
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            self.inc("certinize_storage_requests_in_flight", -1, provider=provider)
+            self.inc(
+                "certinize_storage_requests_total",
+                provider=provider,
+                operation=operation,
+                outcome=outcome,
+            )
+            self.observe(
+                "certinize_storage_request_duration_seconds",
+                time.perf_counter() - started,
+                provider=provider,
+                operation=operation,
+            )
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        with self._lock:
+            values = sorted(self._values.items())
+            histograms = sorted(
+                (key, list(histogram)) for key, histogram in self._histograms.items()
+            )
+
+        samples: dict[str, list[str]] = collections.defaultdict(list)
+
+        for (name, labels), value in values:
+            samples[name].append(
+                f"{name}{_format_labels(labels)} {_format_value(value)}"
+            )
+
+        for (name, labels), histogram in histograms:
+            cumulative = 0.0
+
+            for bound, count in zip(self.buckets, histogram):
+                cumulative += count
+                samples[name].append(
+                    f"{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} "
+                    f"{_format_value(cumulative)}"
+                )
+
+            samples[name].extend(
+                (
+                    f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} "
+                    f"{_format_value(histogram[-1])}",
+                    f"{name}_sum{_format_labels(labels)} "
+                    f"{_format_value(histogram[-2])}",
+                    f"{name}_count{_format_labels(labels)} "
+                    f"{_format_value(histogram[-1])}",
+                )
+            )
+
+        lines: list[str] = []
+
+        for name, (type_, help_) in METRICS.items():
+            lines.extend((f"# HELP {name} {help_}", f"# TYPE {name} {type_}"))
+            lines.extend(samples.get(name, ()))
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: MetricLabels) -> str:
+    if not labels:
+        return ""
+
+    pairs = ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels)
+    return f"{{{pairs}}}"
+
+
+def _format_value(value: float) -> str:
+    # Large counters, e.g. of bytes, must not lose precision to an exponent.
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+metrics = Metrics()
@@ -0,0 +1,753 @@
+"""
+app.services.rendering
+~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import dataclasses
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+import typing
+
+from PIL import Image, ImageDraw
+
+from app import models
+from app.services import caches, shm, sqlite
+from app.services.metrics import metrics
+
+
+@dataclasses.dataclass(frozen=True)
+class PreparedTemplate:
+    """An e-Certificate template that has already been decoded, converted to RGB and
+    resized.
+
+    The raw pixels live in a shared memory block, so worker processes can render
+    onto a copy of the template without decoding or resizing it again.
+    """
+
+    shm_name: str
+    size: tuple[int, int]
+    mode: str = "RGB"
+
+    @property
+    def nbytes(self) -> int:
+        return self.size[0] * self.size[1] * len(self.mode)
+
+    def load(self) -> Image.Image:
+        """Copy the prepared pixels into a new, writable image.
+
+        Returns:
+            Image.Image: A fresh copy of the prepared template.
+        """
+        return Image.frombytes(
+            self.mode, self.size, shm.read(self.shm_name, self.nbytes)
+        )
+
+    def unlink(self) -> None:
+        """Free the shared memory block holding the prepared pixels."""
+        shm.unlink(self.shm_name)
+
+
+@dataclasses.dataclass(frozen=True)
+class TextLayerSpec:
+    """A text layer of a batch. The text of a per-recipient layer is the name of
+    the recipient field it shows."""
+
+    text: str
+    position: tuple[int, int]
+    size: int
+    color: str
+    font: caches.FontSource | caches.SharedFontSource
+
+    @property
+    def key(self) -> tuple[str, tuple[int, int], int, str, str]:
+        return (self.text, self.position, self.size, self.color, self.font.digest)
+
+    def draw(self, draw: ImageDraw.ImageDraw, text: str) -> None:
+        draw.text(  # type: ignore
+            xy=self.position,
+            text=text,
+            fill=self.color,
+            font=caches.font_cache.get(self.font, self.size),
+            anchor="mm",
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class CertificateRenderSpec:
+    """Everything a worker needs to render the e-Certificates of a single batch."""
+
+    template: PreparedTemplate
+    font_color: str
+    name_font: caches.FontSource | caches.SharedFontSource
+    output: models.OutputOptions = dataclasses.field(
+        default_factory=models.OutputOptions
+    )
+    # Per-recipient layers drawn besides the recipient name.
+    text_layers: tuple[TextLayerSpec, ...] = ()
+    # Box that recipient names are shrunk to fit in.
+    name_max_width: int | None = None
+    name_max_height: int | None = None
+
+
+def prepare_template(
+    template: bytes,
+    template_height: int | None,
+    static_layers: typing.Sequence[TextLayerSpec] = (),
+) -> PreparedTemplate:
+    """Decode, convert and resize an e-Certificate template once for a whole batch.
+
+    Static text layers are drawn onto the prepared template, so rendering each
+    e-Certificate only draws its per-recipient text.
+
+    Args:
+        template (bytes): The encoded e-Certificate template.
+        template_height (int | None): Height the template should be scaled down to.
+        static_layers (typing.Sequence[TextLayerSpec], optional): Text layers that
+            are the same for every recipient. Defaults to ().
+
+    Returns:
+        PreparedTemplate: The prepared template, stored in shared memory.
+    """
+    image = Image.open(io.BytesIO(template))
+    image = image.convert("RGB")
+
+    if template_height is not None:
+        image.thumbnail((sys.maxsize, template_height), Image.LANCZOS)
+
+    if static_layers:
+        draw = ImageDraw.Draw(image)
+
+        for layer in static_layers:
+            layer.draw(draw, layer.text)
+
+    return PreparedTemplate(
+        shm_name=shm.create(image.tobytes()), size=image.size, mode=image.mode
+    )
+
+
+def make_template_variants(
+    template: bytes, heights: typing.Iterable[int]
+) -> list[tuple[tuple[int, int], bytes]]:
+    """Decode an e-Certificate template once and encode its render-ready variants.
+
+    Every variant is converted to RGB and scaled exactly like `prepare_template()`
+    would, so rendering onto a variant gives the same e-Certificate as rendering
+    onto the original. Variants are stored as PNGs at the fastest compression
+    level, which decode without loss in a fraction of the time of a resize. The
+    template is never scaled up; at its own size, it is rendered from as is.
+
+    Args:
+        template (bytes): The encoded e-Certificate template.
+        heights (typing.Iterable[int]): Heights to pre-scale the template to;
+            heights the template is already within are skipped.
+
+    Raises:
+        OSError: If the template isn't a complete image Pillow can decode.
+
+    Returns:
+        list[tuple[tuple[int, int], bytes]]: The size and content of each variant,
+            largest first.
+    """
+    image = Image.open(io.BytesIO(template))
+    image = image.convert("RGB")
+    scaled: list[Image.Image] = []
+
+    for height in sorted(set(heights), reverse=True):
+        if height < image.height:
+            variant = image.copy()
+            variant.thumbnail((sys.maxsize, height), Image.LANCZOS)
+            scaled.append(variant)
+
+    variants: list[tuple[tuple[int, int], bytes]] = []
+
+    for variant in scaled:
+        writer = io.BytesIO()
+        variant.save(writer, format="png", compress_level=1)
+        variants.append((variant.size, writer.getvalue()))
+
+    return variants
+
+
+def encode_image(image: Image.Image, output: models.OutputOptions) -> bytes:
+    """Encode a rendered e-Certificate.
+
+    Args:
+        image (Image.Image): The rendered e-Certificate.
+        output (models.OutputOptions): The output format and its encoder settings.
+
+    Returns:
+        bytes: The encoded e-Certificate.
+    """
+    params: dict[str, typing.Any] = {"quality": output.quality}
+
+    match output.format:
+        case models.OutputFormat.JPEG:
+            params.update(optimize=output.optimize, progressive=output.progressive)
+
+            if output.subsampling is not None:
+                params["subsampling"] = output.subsampling
+        case models.OutputFormat.AVIF:
+            if output.subsampling is not None:
+                params["subsampling"] = output.subsampling
+        case models.OutputFormat.PDF:
+            params["resolution"] = output.resolution
+
+    writer = io.BytesIO()
+    image.save(writer, format=output.format.name, **params)
+    return writer.getvalue()
+
+
+def render_certificate(
+    render_spec: CertificateRenderSpec,
+    certificate_recipient: models.CertificateRecipient,
+) -> bytes:
+    """Attach a bunch of texts on an e-Certificate template.
+
+    This is a plain, blocking function so it can be pickled and dispatched to the
+    worker processes of an `ImageProcessor`.
+
+    Args:
+        render_spec (CertificateRenderSpec): The prepared template and text style
+            shared by the batch.
+        certificate_recipient (models.CertificateRecipient): e-Certificate recipient
+            metadata.
+
+    Returns:
+        bytes: Generated e-Certificate in bytes.
+    """
+    return render_certificate_timed(render_spec, certificate_recipient)[0]
+
+
+def render_certificate_timed(
+    render_spec: CertificateRenderSpec,
+    certificate_recipient: models.CertificateRecipient,
+) -> tuple[bytes, dict[str, float], tuple[int, dict[str, int]]]:
+    """Render an e-Certificate like `render_certificate()`, also timing each step.
+
+    Worker processes can't record metrics of the parent process, so the time
+    spent in each step and the stats of the worker's font cache are sent back with
+    the e-Certificate.
+
+    Returns:
+        tuple[bytes, dict[str, float], tuple[int, dict[str, int]]]: Generated
+            e-Certificate in bytes, the seconds spent loading the template, drawing
+            and encoding, and the process ID and font cache stats of the worker.
+    """
+    started = time.perf_counter()
+    image = render_spec.template.load()
+    loaded = time.perf_counter()
+    text_size = certificate_recipient.text_size
+
+    if render_spec.name_max_width or render_spec.name_max_height:
+        text_size = caches.glyph_metrics.fit(
+            render_spec.name_font,
+            text_size,
+            certificate_recipient.recipient_name,
+            max_width=render_spec.name_max_width,
+            max_height=render_spec.name_max_height,
+        )
+
+    draw = ImageDraw.Draw(image)
+    draw.text(  # type: ignore
+        xy=certificate_recipient.text_position,
+        text=certificate_recipient.recipient_name,
+        fill=render_spec.font_color,
+        font=caches.font_cache.get(render_spec.name_font, text_size),
+        anchor="mm",
+    )
+
+    for layer in render_spec.text_layers:
+        layer.draw(draw, certificate_recipient.fields[layer.text])
+
+    drawn = time.perf_counter()
+    ecert = encode_image(image, render_spec.output)
+
+    return (
+        ecert,
+        {
+            "template_load": loaded - started,
+            "draw": drawn - loaded,
+            "encode": time.perf_counter() - drawn,
+        },
+        (os.getpid(), caches.font_cache.stats()),
+    )
+
+
+class ImageProcessor:  # pylint: disable=R0903
+    """Image processing client.
+
+    Rendering is CPU-bound, so every certificate is rendered on `executor` instead of
+    the event loop. Pass a `concurrent.futures.ProcessPoolExecutor` to spread a batch
+    across cores; when no executor is given, the loop's default executor is used.
+
+    Prepared templates are kept in a small LRU cache keyed by the template's content
+    hash and requested height, so consecutive batches that use the same template skip
+    the decode and resize entirely.
+    """
+
+    executor: concurrent.futures.Executor | None
+    max_templates: int
+    max_pending: int
+
+    def __init__(
+        self,
+        executor: concurrent.futures.Executor | None = None,
+        max_templates: int = 4,
+        max_pending: int = 16,
+    ) -> None:
+        self.executor = executor
+        self.max_templates = max_templates
+        self.max_pending = max_pending
+        self._templates: collections.OrderedDict[
+            tuple[str, int | None, tuple[typing.Hashable, ...]], PreparedTemplate
+        ] = collections.OrderedDict()
+        self._template_users: collections.Counter[PreparedTemplate] = (
+            collections.Counter()
+        )
+        # Latest font cache stats of each process that rendered an e-Certificate.
+        self._font_cache_stats: dict[int, dict[str, int]] = {}
+
+    async def prepare_template(
+        self, certificate_meta: models.CertificateMeta
+    ) -> PreparedTemplate:
+        """Decode and resize the template of a batch on the executor.
+
+        The caller owns the returned template and must `unlink()` it once the batch
+        has been rendered.
+
+        Args:
+            certificate_meta (models.CertificateMeta): e-Certificate metadata.
+
+        Returns:
+            PreparedTemplate: The prepared template.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            prepare_template,
+            certificate_meta.template,
+            certificate_meta.template_height,
+            self._text_layer_specs(certificate_meta, static=True),
+        )
+
+    async def make_template_variants(
+        self, template: bytes, heights: typing.Iterable[int]
+    ) -> list[tuple[tuple[int, int], bytes]]:
+        """Encode the render-ready variants of a template on the executor.
+
+        Args:
+            template (bytes): The encoded e-Certificate template.
+            heights (typing.Iterable[int]): Heights to pre-scale the template to.
+
+        Returns:
+            list[tuple[tuple[int, int], bytes]]: The size and content of each
+                variant, largest first.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, make_template_variants, template, list(heights)
+        )
+
+    async def acquire_template(
+        self, certificate_meta: models.CertificateMeta
+    ) -> PreparedTemplate:
+        """Get the prepared template of a batch, preparing it on a cache miss.
+
+        Every call must be paired with `release_template()`.
+
+        Args:
+            certificate_meta (models.CertificateMeta): e-Certificate metadata.
+
+        Returns:
+            PreparedTemplate: The prepared template.
+        """
+        key = (
+            certificate_meta.template_digest
+            or hashlib.sha256(certificate_meta.template).hexdigest(),
+            certificate_meta.template_height,
+            tuple(
+                layer.key
+                for layer in self._text_layer_specs(certificate_meta, static=True)
+            ),
+        )
+
+        if (template := self._templates.get(key)) is None:
+            with metrics.time(
+                "certinize_stage_duration_seconds", stage="template_prepare"
+            ):
+                prepared = await self.prepare_template(certificate_meta)
+
+            # Another batch may have prepared the same template in the meantime.
+            if (template := self._templates.get(key)) is None:
+                template = prepared
+                self._templates[key] = template
+            else:
+                prepared.unlink()
+
+        self._templates.move_to_end(key)
+        self._template_users[template] += 1
+        self._evict_templates()
+        return template
+
+    def release_template(self, template: PreparedTemplate) -> None:
+        """Mark a template acquired through `acquire_template()` as no longer used."""
+        self._template_users[template] -= 1
+
+        if self._template_users[template] <= 0:
+            del self._template_users[template]
+
+            if template not in self._templates.values():
+                template.unlink()
+
+    @contextlib.contextmanager
+    def _create_render_spec(
+        self, certificate_meta: models.CertificateMeta, template: PreparedTemplate
+    ) -> typing.Iterator[CertificateRenderSpec]:
+        # The spec is sent along with every e-Certificate, so its fonts are put in
+        # shared memory for the duration of the batch instead of being copied to a
+        # worker each time.
+        shared_fonts: dict[str, caches.SharedFontSource] = {}
+
+        def share(font: caches.FontSource) -> caches.SharedFontSource:
+            if (shared := shared_fonts.get(font.digest)) is None:
+                shared = shared_fonts[font.digest] = caches.SharedFontSource.create(
+                    font
+                )
+
+            return shared
+
+        try:
+            yield CertificateRenderSpec(
+                template=template,
+                font_color=certificate_meta.font_color,
+                name_font=share(
+                    caches.FontSource(
+                        digest=certificate_meta.name_font_digest
+                        or hashlib.sha256(certificate_meta.name_font_style).hexdigest(),
+                        data=certificate_meta.name_font_style,
+                    )
+                ),
+                output=certificate_meta.output,
+                text_layers=tuple(
+                    dataclasses.replace(layer, font=share(layer.font))
+                    for layer in self._text_layer_specs(certificate_meta, static=False)
+                ),
+                name_max_width=certificate_meta.name_max_width,
+                name_max_height=certificate_meta.name_max_height,
+            )
+        finally:
+            for shared in shared_fonts.values():
+                shared.unlink()
+
+    @staticmethod
+    def _text_layer_specs(
+        certificate_meta: models.CertificateMeta, static: bool
+    ) -> tuple[TextLayerSpec, ...]:
+        return tuple(
+            TextLayerSpec(
+                text=layer.text,
+                position=layer.text_position,
+                size=layer.text_size,
+                color=layer.font_color,
+                font=caches.FontSource(
+                    digest=layer.font_digest
+                    or hashlib.sha256(layer.font_style).hexdigest(),
+                    data=layer.font_style,
+                ),
+            )
+            for layer in certificate_meta.text_layers
+            if layer.static == static
+        )
+
+    def _evict_templates(self) -> None:
+        while len(self._templates) > self.max_templates:
+            _, template = self._templates.popitem(last=False)
+
+            # Templates still in use are unlinked when their last user releases them.
+            if template not in self._template_users:
+                template.unlink()
+
+    async def _attach_text(
+        self,
+        render_spec: CertificateRenderSpec,
+        certificate_recipient: models.CertificateRecipient,
+    ) -> bytes:
+        """Render a single e-Certificate on the image processor's executor.
+
+        Args:
+            render_spec (CertificateRenderSpec): The prepared template and text style
+                shared by the batch.
+            certificate_recipient (models.CertificateRecipient): e-Certificate recipient
+                metadata.
+
+        Returns:
+            bytes: Generated e-Certificate in bytes.
+        """
+        loop = asyncio.get_running_loop()
+        metrics.inc("certinize_render_tasks_in_flight")
+        started = time.perf_counter()
+
+        try:
+            ecert, timings, (pid, font_cache_stats) = await loop.run_in_executor(
+                self.executor,
+                render_certificate_timed,
+                render_spec,
+                certificate_recipient,
+            )
+        finally:
+            metrics.inc("certinize_render_tasks_in_flight", -1)
+
+        # Whatever the render itself didn't take was spent waiting for a worker.
+        timings["render_queue"] = time.perf_counter() - started - sum(timings.values())
+
+        for stage, seconds in timings.items():
+            metrics.observe("certinize_stage_duration_seconds", seconds, stage=stage)
+
+        metrics.inc("certinize_stage_bytes_total", len(ecert), stage="encode")
+        self._record_font_cache_stats(pid, font_cache_stats)
+        return ecert
+
+    def _record_font_cache_stats(self, pid: int, stats: dict[str, int]) -> None:
+        # Each worker reports the running totals of its own cache, so the totals of
+        # the pool are the sum of the latest report of every worker.
+        self._font_cache_stats[pid] = stats
+        worker_stats = self._font_cache_stats.values()
+
+        for outcome, stat in (("hit", "hits"), ("miss", "misses")):
+            metrics.set(
+                "certinize_font_cache_lookups_total",
+                float(sum(stats[stat] for stats in worker_stats)),
+                outcome=outcome,
+            )
+
+        metrics.set(
+            "certinize_font_cache_fonts",
+            float(sum(stats["size"] for stats in worker_stats)),
+        )
+
+    async def attach_text(
+        self,
+        certificate_meta: models.CertificateMeta,
+        certificate_recipients: list[models.CertificateRecipient],
+    ) -> list[bytes]:
+        """Attach a bunch of texts on an e-Certificate template.
+
+        The template is decoded and resized once; every recipient is then rendered
+        onto a copy of it.
+
+        Args:
+            certificate_meta (models.CertificateMeta): e-Certificate metadata.
+            certificate_recipients (list[models.CertificateRecipient]): Metadata of
+                each e-Certificate recipient.
+
+        Returns:
+            list[bytes]: Generated e-Certificates in bytes, in the same order as
+                `certificate_recipients`.
+        """
+        template = await self.acquire_template(certificate_meta)
+
+        try:
+            with self._create_render_spec(certificate_meta, template) as render_spec:
+                results = await asyncio.gather(
+                    *(
+                        self._attach_text(
+                            render_spec,
+                            recipient_meta,
+                        )
+                        for recipient_meta in certificate_recipients
+                    )
+                )
+        finally:
+            self.release_template(template)
+
+        return results
+
+    async def iter_attach_text(
+        self,
+        certificate_meta: models.CertificateMeta,
+        certificate_recipients: list[models.CertificateRecipient],
+    ) -> typing.AsyncIterator[tuple[int, bytes]]:
+        """Attach a bunch of texts on an e-Certificate template, yielding each
+        e-Certificate as soon as it is rendered.
+
+        At most `max_pending` e-Certificates are rendering or waiting to be consumed
+        at any time, so memory stays flat regardless of the batch size. Close the
+        iterator (e.g. with `contextlib.aclosing`) to stop rendering early.
+
+        Args:
+            certificate_meta (models.CertificateMeta): e-Certificate metadata.
+            certificate_recipients (list[models.CertificateRecipient]): Metadata of
+                each e-Certificate recipient.
+
+        Yields:
+            tuple[int, bytes]: The index of the recipient in
+                `certificate_recipients` and the generated e-Certificate, in
+                completion order.
+        """
+        template = await self.acquire_template(certificate_meta)
+
+        with self._create_render_spec(certificate_meta, template) as render_spec:
+            slots = asyncio.Semaphore(self.max_pending)
+            rendered: asyncio.Queue[asyncio.Task[tuple[int, bytes]]] = asyncio.Queue()
+            pending: set[asyncio.Task[tuple[int, bytes]]] = set()
+
+            async def render(
+                index: int, recipient_meta: models.CertificateRecipient
+            ) -> tuple[int, bytes]:
+                return index, await self._attach_text(render_spec, recipient_meta)
+
+            def on_rendered(task: asyncio.Task[tuple[int, bytes]]) -> None:
+                pending.discard(task)
+                rendered.put_nowait(task)
+
+            async def produce() -> None:
+                for index, recipient_meta in enumerate(certificate_recipients):
+                    await slots.acquire()
+                    task = asyncio.create_task(render(index, recipient_meta))
+                    pending.add(task)
+                    task.add_done_callback(on_rendered)
+
+            producer = asyncio.create_task(produce())
+
+            try:
+                for _ in certificate_recipients:
+                    task = await rendered.get()
+                    slots.release()
+                    yield task.result()
+            finally:
+                producer.cancel()
+
+                for task in pending:
+                    task.cancel()
+
+                await asyncio.gather(producer, *pending, return_exceptions=True)
+
+                # Renders that finished after the batch was abandoned, e.g. because a
+                # worker crashed, are discarded along with their errors.
+                while not rendered.empty():
+                    task = rendered.get_nowait()
+
+                    if not task.cancelled():
+                        task.exception()
+
+                self.release_template(template)
+
+    def shutdown(self) -> None:
+        """Release the executor's workers, cancelling renders that haven't started,
+        and free the cached templates."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+        while self._templates:
+            _, template = self._templates.popitem()
+            template.unlink()
+
+
+@dataclasses.dataclass(frozen=True)
+class TemplateVariant:
+    """A stored, render-ready copy of an uploaded e-Certificate template."""
+
+    url: str
+    width: int
+    height: int
+
+
+def select_template_variant(
+    variants: list[TemplateVariant], template_height: int | None
+) -> TemplateVariant | None:
+    """Pick the variant that renders like the original at the requested height.
+
+    Args:
+        variants (list[TemplateVariant]): The variants of a template.
+        template_height (int | None): Height the template should be scaled down to.
+
+    Returns:
+        TemplateVariant | None: The matching variant, if there is one. Templates
+            rendered at their own size are rendered from the original.
+    """
+    if template_height is None:
+        return None
+
+    return next(
+        (variant for variant in variants if variant.height == template_height), None
+    )
+
+
+class InMemoryTemplateVariantIndex:
+    """Maps template URLs to their render-ready variants.
+
+    Only the `max_entries` most recently used templates are kept.
+    """
+
+    max_entries: int
+
+    def __init__(self, max_entries: int = 10_000) -> None:
+        self.max_entries = max_entries
+        self._entries: collections.OrderedDict[str, list[TemplateVariant]] = (
+            collections.OrderedDict()
+        )
+
+    async def get(self, template_url: str) -> list[TemplateVariant]:
+        if (variants := self._entries.get(template_url)) is None:
+            return []
+
+        self._entries.move_to_end(template_url)
+        return variants
+
+    async def put(self, template_url: str, variants: list[TemplateVariant]) -> None:
+        self._entries[template_url] = variants
+        self._entries.move_to_end(template_url)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def close(self) -> None:
+        self._entries.clear()
+
+
+class SQLiteTemplateVariantIndex(sqlite.SQLiteStore):
+    """Maps template URLs to their render-ready variants in a local SQLite
+    database."""
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS template_variants "
+        "(template_url TEXT PRIMARY KEY, variants TEXT NOT NULL)"
+    )
+
+    def _get(self, template_url: str) -> list[TemplateVariant]:
+        row = self._fetchone(
+            "SELECT variants FROM template_variants WHERE template_url = ?",
+            (template_url,),
+        )
+
+        if row is None:
+            return []
+
+        return [TemplateVariant(**variant) for variant in json.loads(row[0])]
+
+    def _put(self, template_url: str, variants: list[TemplateVariant]) -> None:
+        self._execute(
+            "INSERT OR REPLACE INTO template_variants (template_url, variants) "
+            "VALUES (?, ?)",
+            (
+                template_url,
+                json.dumps([dataclasses.asdict(variant) for variant in variants]),
+            ),
+        )
+
+    async def get(self, template_url: str) -> list[TemplateVariant]:
+        return await self._run(self._get, template_url)
+
+    async def put(self, template_url: str, variants: list[TemplateVariant]) -> None:
+        await self._run(self._put, template_url, variants)
+
+
+TemplateVariantIndex = InMemoryTemplateVariantIndex | SQLiteTemplateVariantIndex
@@ -0,0 +1,320 @@
+"""
+app.services.s3
+~~~~~~~~~~~~~~~
+"""
+
+import asyncio
+import contextlib
+import dataclasses
+import typing
+
+import aiohttp
+import types_aiobotocore_s3
+from types_aiobotocore_s3 import client as s3client
+from types_aiobotocore_s3 import type_defs
+
+from app.services.metrics import metrics
+
+
+@dataclasses.dataclass
+class S3ClientSession:
+    bucket_name: str
+    exit_stack: contextlib.AsyncExitStack
+    s3client: types_aiobotocore_s3.S3Client
+    # Number of requests made at the same time; matches the connection pool size.
+    max_concurrency: int = 10
+    # Size of each part of a streamed multipart upload. S3 requires at least 5 MiB.
+    part_size: int = 8 * 1024 * 1024
+
+
+class AsyncReadable(typing.Protocol):  # pylint: disable=too-few-public-methods
+    """A file-like source that is read asynchronously, e.g. `fastapi.UploadFile`."""
+
+    async def read(self, size: int = -1) -> bytes: ...
+
+
+async def read_chunk(file: AsyncReadable, size: int) -> bytes:
+    """Read exactly `size` bytes from a file, or fewer only at the end of it."""
+    chunk = await file.read(size)
+
+    while chunk and len(chunk) < size:
+        if not (rest := await file.read(size - len(chunk))):
+            break
+
+        chunk += rest
+
+    return chunk
+
+
+def _metadata_args(metadata: dict[str, str] | None) -> dict[str, typing.Any]:
+    return {"Metadata": metadata} if metadata else {}
+
+
+class S3Client:
+    """Client implementation for Filebase's S3-compatible API."""
+
+    @staticmethod
+    async def create_bucket(
+        client: s3client.S3Client, bucket: str
+    ) -> type_defs.CreateBucketOutputTypeDef:
+        """Create a new S3 bucket.
+
+        Args:
+            client (s3client.S3Client): A client representing S3.
+            bucket (str): The name of the bucket to create.
+
+        Returns:
+            type_defs.CreateBucketOutputTypeDef: Create bucket output.
+        """
+        return await client.create_bucket(Bucket=bucket)
+
+    @staticmethod
+    async def put_object(
+        client: s3client.S3Client,
+        bucket: str,
+        key: str,
+        body: bytes,
+        *,
+        metadata: dict[str, str] | None = None,
+    ) -> type_defs.PutObjectOutputTypeDef | dict[str, str]:
+        """Upload an object to an S3 bucket.
+
+        Args:
+            client (s3client.S3Client): A client representing S3.
+            bucket (str): Name of the bucket containing the object.
+            key (str): Object key for which the PUT action was initiated.
+            body (bytes): Object data.
+            metadata (dict[str, str] | None): User metadata stored with the object.
+
+        Returns:
+            type_defs.PutObjectOutputTypeDef: Put object output.
+        """
+        try:
+            with metrics.track_request("s3", "put"):
+                return await client.put_object(
+                    Bucket=bucket, Key=key, Body=body, **_metadata_args(metadata)
+                )
+        except client.exceptions.NoSuchBucket as bucket_err:
+            raise ValueError(f"Bucket {bucket} does not exist.") from bucket_err
+
+    @staticmethod
+    async def upload_fileobj(  # pylint: disable=too-many-arguments
+        client: s3client.S3Client,
+        bucket: str,
+        key: str,
+        file: AsyncReadable,
+        *,
+        part_size: int = 8 * 1024 * 1024,
+        max_concurrency: int = 4,
+        metadata: dict[str, str] | None = None,
+    ) -> (
+        type_defs.PutObjectOutputTypeDef
+        | type_defs.CompleteMultipartUploadOutputTypeDef
+    ):
+        """Stream a file to an S3 bucket.
+
+        The file is read one part at a time and at most `max_concurrency` parts are
+        uploaded at once, so memory use doesn't depend on the size of the file. A
+        file that fits in a single part is sent with a plain put instead.
+
+        Args:
+            client (s3client.S3Client): A client representing S3.
+            bucket (str): Name of the bucket to put the object in.
+            key (str): Key of the object.
+            file (AsyncReadable): The object data.
+            part_size (int): Size of each part; S3 requires at least 5 MiB.
+            max_concurrency (int): Number of parts uploaded at the same time.
+            metadata (dict[str, str] | None): User metadata stored with the object.
+
+        Raises:
+            ValueError: If the bucket doesn't exist.
+
+        Returns:
+            type_defs.PutObjectOutputTypeDef
+                | type_defs.CompleteMultipartUploadOutputTypeDef: The put object or
+                complete multipart upload output.
+        """
+        part = await read_chunk(file, part_size)
+
+        if len(part) < part_size:
+            return await S3Client.put_object(
+                client, bucket, key, part, metadata=metadata
+            )
+
+        try:
+            with metrics.track_request("s3", "create_multipart_upload"):
+                upload_id = (
+                    await client.create_multipart_upload(
+                        Bucket=bucket, Key=key, **_metadata_args(metadata)
+                    )
+                )["UploadId"]
+        except client.exceptions.NoSuchBucket as bucket_err:
+            raise ValueError(f"Bucket {bucket} does not exist.") from bucket_err
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+        tasks: list[asyncio.Task[type_defs.CompletedPartTypeDef]] = []
+
+        async def upload_part(
+            part_number: int, body: bytes
+        ) -> type_defs.CompletedPartTypeDef:
+            try:
+                with metrics.track_request("s3", "upload_part"):
+                    response = await client.upload_part(
+                        Bucket=bucket,
+                        Key=key,
+                        UploadId=upload_id,
+                        PartNumber=part_number,
+                        Body=body,
+                    )
+            finally:
+                semaphore.release()
+
+            return {"ETag": response["ETag"], "PartNumber": part_number}
+
+        try:
+            while part:
+                await semaphore.acquire()
+
+                # Stop reading once a part has failed; gathering raises its error.
+                if any(task.done() and task.exception() for task in tasks):
+                    semaphore.release()
+                    break
+
+                tasks.append(asyncio.create_task(upload_part(len(tasks) + 1, part)))
+                part = await read_chunk(file, part_size)
+
+            parts = await asyncio.gather(*tasks)
+
+            with metrics.track_request("s3", "complete_multipart_upload"):
+                return await client.complete_multipart_upload(
+                    Bucket=bucket,
+                    Key=key,
+                    UploadId=upload_id,
+                    MultipartUpload={"Parts": list(parts)},
+                )
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+            with metrics.track_request("s3", "abort_multipart_upload"):
+                await client.abort_multipart_upload(
+                    Bucket=bucket, Key=key, UploadId=upload_id
+                )
+
+            raise
+
+    @staticmethod
+    async def get_object(
+        client: s3client.S3Client, bucket: str, key: str
+    ) -> type_defs.GetObjectOutputTypeDef:
+        """Get an object from an S3 bucket.
+
+        Args:
+            client (s3client.S3Client): A client representing S3.
+            bucket (str): Key of the object to get.
+            key (str): Name of the object to get.
+
+        Returns:
+            type_defs.GetObjectOutputTypeDef: Get object output.
+        """
+        with metrics.track_request("s3", "get"):
+            return await client.get_object(Bucket=bucket, Key=key)
+
+    @staticmethod
+    async def delete_object(
+        client: s3client.S3Client, bucket: str, key: str
+    ) -> type_defs.DeleteObjectOutputTypeDef:
+        """Delete an object from an S3 bucket.
+
+        Args:
+            client (s3client.S3Client): A client representing S3.
+            bucket (str): The bucket name of the bucket containing the object.
+            key (str): Name of the object to delete.
+
+        Returns:
+            type_defs.DeleteObjectOutputTypeDef: Delete object output.
+        """
+        with metrics.track_request("s3", "delete"):
+            return await client.delete_object(Bucket=bucket, Key=key)
+
+    @staticmethod
+    async def copy_object(
+        client: s3client.S3Client, bucket: str, source_key: str, key: str
+    ) -> type_defs.CopyObjectOutputTypeDef:
+        """Copy an object within an S3 bucket, without downloading it.
+
+        Args:
+            client (s3client.S3Client): A client representing S3.
+            bucket (str): Name of the bucket containing the object.
+            source_key (str): Key of the object to copy.
+            key (str): Key of the copy.
+
+        Returns:
+            type_defs.CopyObjectOutputTypeDef: Copy object output.
+        """
+        with metrics.track_request("s3", "copy"):
+            return await client.copy_object(
+                Bucket=bucket, Key=key, CopySource={"Bucket": bucket, "Key": source_key}
+            )
+
+    @staticmethod
+    async def head_object(
+        client: s3client.S3Client, bucket: str, key: str
+    ) -> type_defs.HeadObjectOutputTypeDef | None:
+        """Get the metadata of an object in an S3 bucket.
+
+        Args:
+            client (s3client.S3Client): A client representing S3.
+            bucket (str): Name of the bucket containing the object.
+            key (str): Key of the object.
+
+        Returns:
+            type_defs.HeadObjectOutputTypeDef | None: Head object output, or `None`
+                if the object doesn't exist.
+        """
+        with metrics.track_request("s3", "head"):
+            try:
+                return await client.head_object(Bucket=bucket, Key=key)
+            except client.exceptions.ClientError as client_err:
+                if client_err.response.get("Error", {}).get("Code") in (
+                    "404",
+                    "NoSuchKey",
+                    "NotFound",
+                ):
+                    return None
+
+                raise
+
+    @staticmethod
+    async def generate_presigned_post(
+        client: s3client.S3Client,
+        bucket: str,
+        key: str,
+        expiration: int | None = None,
+        max_bytes: int | None = None,
+    ) -> dict[str, typing.Any]:
+        conditions = (
+            [["content-length-range", 0, max_bytes]] if max_bytes is not None else None
+        )
+
+        try:
+            return await client.generate_presigned_post(
+                Bucket=bucket,
+                Key=key,
+                Conditions=conditions,  # type: ignore
+                ExpiresIn=expiration or 3600,
+            )
+        except client.exceptions.ClientError as client_err:
+            return {"details": str(client_err)}
+
+    @staticmethod
+    async def upload_with_presigned_post(
+        http_client: aiohttp.ClientSession,
+        presigned: dict[str, typing.Any],
+        file: bytes,
+    ):
+        return await http_client.post(
+            presigned["url"], data=presigned["fields"] | {"file": file}
+        )
@@ -0,0 +1,50 @@
+"""
+app.services.shm
+~~~~~~~~~~~~~~~~
+
+Shared memory blocks that hand large, read-only inputs to render workers by name.
+"""
+
+from multiprocessing import shared_memory
+
+
+def create(data: bytes) -> str:
+    """Copy bytes into a new shared memory block.
+
+    The caller owns the block and must `unlink()` it once it is no longer used.
+
+    Args:
+        data (bytes): The content of the block.
+
+    Returns:
+        str: The name of the block.
+    """
+    # Blocks can't be empty.
+    shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+
+    try:
+        shm.buf[: len(data)] = data
+    except BaseException:
+        shm.unlink()
+        raise
+    finally:
+        shm.close()
+
+    return shm.name
+
+
+def read(name: str, nbytes: int) -> bytes:
+    """Copy the first `nbytes` bytes out of a shared memory block."""
+    shm = shared_memory.SharedMemory(name=name)
+
+    try:
+        return bytes(shm.buf[:nbytes])
+    finally:
+        shm.close()
+
+
+def unlink(name: str) -> None:
+    """Free a shared memory block."""
+    shm = shared_memory.SharedMemory(name=name)
+    shm.close()
+    shm.unlink()
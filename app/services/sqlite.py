@@ -0,0 +1,43 @@
+"""
+app.services.sqlite
+~~~~~~~~~~~~~~~~~~~
+"""
+
+import asyncio
+import concurrent.futures
+import sqlite3
+import typing
+
+
+class SQLiteStore:  # pylint: disable=too-few-public-methods
+    """Base class of the stores kept in a local SQLite database.
+
+    The table described by `schema` is created when the store is opened. SQLite
+    connections must not be used from several threads at once, so every query runs
+    on a single-thread executor instead of the event loop.
+    """
+
+    schema: typing.ClassVar[str]
+
+    def __init__(self, database: str) -> None:
+        self._connection = sqlite3.connect(database, check_same_thread=False)
+        self._connection.execute(self.schema)
+        self._connection.commit()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    async def _run(self, func: typing.Callable[..., typing.Any], *args: typing.Any):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _fetchone(
+        self, sql: str, params: tuple[typing.Any, ...] = ()
+    ) -> tuple[typing.Any, ...] | None:
+        return self._connection.execute(sql, params).fetchone()
+
+    def _execute(self, sql: str, params: tuple[typing.Any, ...] = ()) -> None:
+        self._connection.execute(sql, params)
+        self._connection.commit()
+
+    async def close(self) -> None:
+        await self._run(self._connection.close)
+        self._executor.shutdown()
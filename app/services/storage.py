@@ -0,0 +1,632 @@
+"""
+app.services.storage
+~~~~~~~~~~~~~~~~~~~~
+"""
+
+import asyncio
+import collections
+import dataclasses
+import hashlib
+import time
+import typing
+
+import aiohttp
+from types_aiobotocore_s3 import type_defs
+
+from app.services import s3, sqlite
+from app.services.metrics import metrics
+
+
+class InMemoryContentIndex:
+    """Maps content hashes to the backend and key the content is stored under.
+
+    Only the `max_entries` most recently used entries are kept.
+    """
+
+    max_entries: int
+
+    def __init__(self, max_entries: int = 100_000) -> None:
+        self.max_entries = max_entries
+        self._entries: collections.OrderedDict[str, tuple[str, str]] = (
+            collections.OrderedDict()
+        )
+
+    async def get(self, digest: str) -> tuple[str, str] | None:
+        if (location := self._entries.get(digest)) is not None:
+            self._entries.move_to_end(digest)
+
+        return location
+
+    async def put(self, digest: str, backend: str, key: str) -> None:
+        self._entries[digest] = (backend, key)
+        self._entries.move_to_end(digest)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, digest: str) -> None:
+        self._entries.pop(digest, None)
+
+    async def close(self) -> None:
+        self._entries.clear()
+
+
+class SQLiteContentIndex(sqlite.SQLiteStore):
+    """Maps content hashes to storage locations in a local SQLite database."""
+
+    schema = (
+        "CREATE TABLE IF NOT EXISTS stored_objects "
+        "(digest TEXT PRIMARY KEY, backend TEXT NOT NULL, key TEXT NOT NULL)"
+    )
+
+    def _get(self, digest: str) -> tuple[str, str] | None:
+        row = self._fetchone(
+            "SELECT backend, key FROM stored_objects WHERE digest = ?", (digest,)
+        )
+        return (row[0], row[1]) if row else None
+
+    async def get(self, digest: str) -> tuple[str, str] | None:
+        return await self._run(self._get, digest)
+
+    async def put(self, digest: str, backend: str, key: str) -> None:
+        await self._run(
+            self._execute,
+            "INSERT OR REPLACE INTO stored_objects (digest, backend, key) "
+            "VALUES (?, ?, ?)",
+            (digest, backend, key),
+        )
+
+    async def delete(self, digest: str) -> None:
+        await self._run(
+            self._execute, "DELETE FROM stored_objects WHERE digest = ?", (digest,)
+        )
+
+
+ContentIndex = InMemoryContentIndex | SQLiteContentIndex
+
+
+@dataclasses.dataclass
+class StorageBackend:  # pylint: disable=too-many-instance-attributes
+    """An S3-compatible bucket that permanent objects can be written to."""
+
+    name: str
+    network: str
+    session: s3.S3ClientSession
+    # Bytes this backend may still take; unlimited if not set.
+    quota_bytes: int | None = None
+    bytes_written: int = 0
+    # Quota set aside for uploads that are still in progress.
+    bytes_reserved: int = 0
+    in_flight: int = 0
+    # A backend that failed is skipped until this time (see `time.monotonic()`).
+    unavailable_until: float = 0.0
+    # Keys presigned for direct uploads that haven't been counted towards the quota
+    # yet, and when their POSTs expire (see `time.monotonic()`).
+    presigned_keys: dict[str, float] = dataclasses.field(default_factory=dict)
+
+    @property
+    def label(self) -> str:
+        return f"{self.session.bucket_name} ({self.name})"
+
+    def accepts(self, size: int | None) -> bool:
+        """Check whether the backend is available and has room for an object."""
+        if time.monotonic() < self.unavailable_until:
+            return False
+
+        if self.quota_bytes is None:
+            return True
+
+        return (
+            self.bytes_written + self.bytes_reserved + (size or 0) <= self.quota_bytes
+        )
+
+    def reserve(self, size: int | None) -> bool:
+        """Set quota aside for an object before it is uploaded.
+
+        The check and the reservation happen without yielding to the event loop,
+        so concurrent uploads can't take the same room.
+
+        Returns:
+            bool: Whether the backend had room for the object.
+        """
+        if not self.accepts(size):
+            return False
+
+        self.bytes_reserved += size or 0
+        return True
+
+    def release(self, size: int | None, written: bool) -> None:
+        """Give back reserved quota, counting it as used if the upload succeeded."""
+        self.bytes_reserved -= size or 0
+
+        if written:
+            self.bytes_written += size or 0
+
+    @property
+    def load(self) -> float:
+        return self.in_flight / max(1, self.session.max_concurrency)
+
+
+class StorageRouter:
+    """Spread permanent object writes across several S3-compatible backends.
+
+    Each object goes to the least loaded backend that has quota left for it. If the
+    upload fails, the backend is skipped for `failure_cooldown` seconds and the
+    object is retried on the next backend. An optional content index maps the hash
+    of each stored object to its location so identical bytes are stored once.
+    """
+
+    backends: list[StorageBackend]
+    failure_cooldown: float
+    presign_expiration: int
+    presign_max_bytes: int | None
+    content_index: ContentIndex | None
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        backends: list[StorageBackend],
+        failure_cooldown: float = 30.0,
+        presign_expiration: int = 3600,
+        presign_max_bytes: int | None = None,
+        content_index: ContentIndex | None = None,
+    ) -> None:
+        self.backends = backends
+        self.failure_cooldown = failure_cooldown
+        self.presign_expiration = presign_expiration
+        self.presign_max_bytes = presign_max_bytes
+        self.content_index = content_index
+
+    def get_backend(self, name: str) -> StorageBackend | None:
+        return next(
+            (backend for backend in self.backends if backend.name == name), None
+        )
+
+    async def presign_posts(
+        self, keys: list[str]
+    ) -> tuple[StorageBackend, list[dict[str, typing.Any]]]:
+        """Issue presigned POSTs so clients can upload straight to a bucket.
+
+        The whole batch goes to the least loaded backend, so it can be verified
+        with a single `verify_objects()` call once uploaded.
+
+        Args:
+            keys (list[str]): Keys of the objects to upload.
+
+        Raises:
+            ValueError: If no backend can take the objects.
+
+        Returns:
+            tuple[StorageBackend, list[dict[str, typing.Any]]]: The backend and the
+                URL and form fields to post each object with.
+        """
+        if not (candidates := self.candidates()):
+            raise ValueError("No storage backend has room for the objects.")
+
+        backend = candidates[0]
+        now = time.monotonic()
+        # Keys that were never completed are forgotten once their POSTs have long
+        # expired.
+        backend.presigned_keys = {
+            key: expires_at
+            for key, expires_at in backend.presigned_keys.items()
+            if expires_at + self.presign_expiration > now
+        }
+        backend.presigned_keys.update(
+            dict.fromkeys(keys, now + self.presign_expiration)
+        )
+        presigned = await asyncio.gather(
+            *(
+                s3.S3Client.generate_presigned_post(
+                    backend.session.s3client,
+                    backend.session.bucket_name,
+                    key,
+                    expiration=self.presign_expiration,
+                    max_bytes=self.presign_max_bytes,
+                )
+                for key in keys
+            )
+        )
+
+        return backend, [{"key": key} | post for key, post in zip(keys, presigned)]
+
+    async def verify_objects(
+        self, backend: StorageBackend, keys: list[str]
+    ) -> list[type_defs.HeadObjectOutputTypeDef | None]:
+        """Check which objects uploaded with presigned POSTs arrived.
+
+        The stored size of each object that arrived counts towards the backend's
+        quota, once per presigned key, so the check can safely be repeated.
+
+        Args:
+            backend (StorageBackend): The backend the POSTs were issued for.
+            keys (list[str]): Keys of the uploaded objects.
+
+        Returns:
+            list[type_defs.HeadObjectOutputTypeDef | None]: Head object output of
+                each object, or `None` if it is missing.
+        """
+        semaphore = asyncio.Semaphore(backend.session.max_concurrency)
+
+        async def head_object(key: str) -> type_defs.HeadObjectOutputTypeDef | None:
+            async with semaphore:
+                return await s3.S3Client.head_object(
+                    backend.session.s3client, backend.session.bucket_name, key
+                )
+
+        heads = await asyncio.gather(*(head_object(key) for key in keys))
+
+        for key, head in zip(keys, heads):
+            if head is not None and backend.presigned_keys.pop(key, None) is not None:
+                backend.bytes_written += head["ContentLength"]
+
+        return list(heads)
+
+    def candidates(self, size: int | None = None) -> list[StorageBackend]:
+        """Get the backends that can take an object, least loaded first.
+
+        Args:
+            size (int | None): Size of the object, if known.
+
+        Returns:
+            list[StorageBackend]: The backends to try, in order.
+        """
+        return sorted(
+            (backend for backend in self.backends if backend.accepts(size)),
+            key=lambda backend: (
+                backend.load,
+                backend.bytes_written + backend.bytes_reserved,
+            ),
+        )
+
+    async def put_object(
+        self,
+        key: str,
+        body: bytes | s3.AsyncReadable,
+        size: int | None = None,
+        max_part_concurrency: int = 1,
+    ) -> tuple[
+        StorageBackend,
+        type_defs.PutObjectOutputTypeDef
+        | type_defs.CompleteMultipartUploadOutputTypeDef
+        | dict[str, typing.Any],
+    ]:
+        """Upload an object to one of the backends, failing over if needed.
+
+        A streamed body can only be retried on another backend if it can seek back
+        to its start. With a content index, an object whose bytes are already
+        stored isn't uploaded again; the result then holds the key it is stored
+        under and `"Deduplicated": True`. Identical bytes stored under another key
+        are copied to `key` inside the bucket instead of being uploaded again.
+
+        Args:
+            key (str): Key of the object.
+            body (bytes | s3.AsyncReadable): The object data.
+            size (int | None): Size of the object, if known; used for quotas.
+            max_part_concurrency (int): Number of parts of a streamed object
+                uploaded at the same time.
+
+        Raises:
+            ValueError: If no backend can take the object.
+
+        Returns:
+            tuple[StorageBackend, type_defs.PutObjectOutputTypeDef
+                | type_defs.CompleteMultipartUploadOutputTypeDef
+                | dict[str, typing.Any]]: The backend the object was written to and
+                its put output.
+        """
+        if isinstance(body, bytes):
+            size = len(body)
+
+        digest = await self._get_digest(body) if self.content_index else None
+
+        if digest is not None and (stored := await self._find_stored(digest, key)):
+            return stored
+
+        # The hash is stored with the object, so a later put can check that the
+        # indexed object still holds the same bytes.
+        metadata = {"sha256": digest} if digest is not None else None
+
+        last_err: Exception | None = None
+
+        for backend in self.candidates(size):
+            if last_err is not None and not isinstance(body, bytes):
+                if not hasattr(body, "seek"):
+                    break
+
+                await body.seek(0)  # type: ignore
+
+            # Another upload may have taken the room since the candidates were
+            # picked.
+            if not backend.reserve(size):
+                continue
+
+            backend.in_flight += 1
+
+            try:
+                if isinstance(body, bytes):
+                    result = await s3.S3Client.put_object(
+                        backend.session.s3client,
+                        backend.session.bucket_name,
+                        key,
+                        body,
+                        metadata=metadata,
+                    )
+                else:
+                    result = await s3.S3Client.upload_fileobj(
+                        backend.session.s3client,
+                        backend.session.bucket_name,
+                        key,
+                        body,
+                        part_size=backend.session.part_size,
+                        max_concurrency=max_part_concurrency,
+                        metadata=metadata,
+                    )
+            except Exception as err:  # pylint: disable=broad-except
+                backend.release(size, written=False)
+                backend.unavailable_until = time.monotonic() + self.failure_cooldown
+                last_err = err
+                continue
+            finally:
+                backend.in_flight -= 1
+
+            backend.release(size, written=True)
+
+            if digest is not None and self.content_index is not None:
+                await self.content_index.put(digest, backend.name, key)
+
+            return backend, result
+
+        if last_err is None:
+            raise ValueError("No storage backend has room for the object.")
+
+        raise last_err
+
+    @staticmethod
+    async def _get_digest(body: bytes | s3.AsyncReadable) -> str | None:
+        if isinstance(body, bytes):
+            return hashlib.sha256(body).hexdigest()
+
+        # The body has to be read twice, once to hash it and once to upload it.
+        if not hasattr(body, "seek"):
+            return None
+
+        digest = hashlib.sha256()
+
+        while chunk := await s3.read_chunk(body, 1024 * 1024):
+            digest.update(chunk)
+
+        await body.seek(0)  # type: ignore
+        return digest.hexdigest()
+
+    async def _find_stored(
+        self, digest: str, key: str
+    ) -> tuple[StorageBackend, dict[str, typing.Any]] | None:
+        assert self.content_index is not None
+
+        if (location := await self.content_index.get(digest)) is None:
+            return None
+
+        backend_name, stored_key = location
+
+        if (backend := self.get_backend(backend_name)) is None:
+            return None
+
+        # The index may be stale; make sure the object is still in the bucket and
+        # wasn't overwritten with other bytes.
+        try:
+            head = await s3.S3Client.head_object(
+                backend.session.s3client, backend.session.bucket_name, stored_key
+            )
+        except Exception:  # pylint: disable=broad-except
+            return None
+
+        if head is None or head.get("Metadata", {}).get("sha256") != digest:
+            await self.content_index.delete(digest)
+            return None
+
+        if stored_key == key:
+            return backend, dict(head) | {"Key": key, "Deduplicated": True}
+
+        # The client expects the object under its own key; a copy inside the bucket
+        # saves uploading the bytes again.
+        return await self._copy_stored(backend, stored_key, key, head["ContentLength"])
+
+    @staticmethod
+    async def _copy_stored(
+        backend: StorageBackend, stored_key: str, key: str, size: int
+    ) -> tuple[StorageBackend, dict[str, typing.Any]] | None:
+        if not backend.reserve(size):
+            return None
+
+        try:
+            result = await s3.S3Client.copy_object(
+                backend.session.s3client, backend.session.bucket_name, stored_key, key
+            )
+        except Exception:  # pylint: disable=broad-except
+            backend.release(size, written=False)
+            return None
+
+        backend.release(size, written=True)
+        return backend, dict(result) | {"Key": key, "Deduplicated": True}
+
+    async def put_objects(
+        self, objects: typing.Iterable[tuple[str, bytes | s3.AsyncReadable, int | None]]
+    ) -> list[
+        tuple[
+            StorageBackend | None,
+            type_defs.PutObjectOutputTypeDef
+            | type_defs.CompleteMultipartUploadOutputTypeDef
+            | dict[str, str],
+        ]
+    ]:
+        """Upload objects concurrently across the backends.
+
+        At most as many objects as the backends have connections are uploaded at a
+        time; connections not needed for whole objects go to parallel parts. A
+        failed upload doesn't stop the others; its result holds the object
+        key and the error, and no backend.
+
+        Args:
+            objects (typing.Iterable[tuple[str, bytes | s3.AsyncReadable, int | None]]):
+                The key, data and size (if known) of each object.
+
+        Returns:
+            list[tuple[StorageBackend | None, type_defs.PutObjectOutputTypeDef
+                | type_defs.CompleteMultipartUploadOutputTypeDef | dict[str, str]]]:
+                The backend and result of each upload, in the same order as
+                `objects`.
+        """
+        objects = list(objects)
+        connections = max(
+            1, sum(backend.session.max_concurrency for backend in self.backends)
+        )
+        max_part_concurrency = max(1, connections // max(1, len(objects)))
+        semaphore = asyncio.Semaphore(connections)
+
+        async def put_object(
+            key: str, body: bytes | s3.AsyncReadable, size: int | None
+        ) -> tuple[
+            StorageBackend | None,
+            type_defs.PutObjectOutputTypeDef
+            | type_defs.CompleteMultipartUploadOutputTypeDef
+            | dict[str, str],
+        ]:
+            async with semaphore:
+                try:
+                    return await self.put_object(
+                        key, body, size, max_part_concurrency=max_part_concurrency
+                    )
+                except Exception as err:  # pylint: disable=broad-except
+                    return None, {"Key": key, "Error": str(err)}
+
+        return list(
+            await asyncio.gather(
+                *(put_object(key, body, size) for key, body, size in objects)
+            )
+        )
+
+
+class NftStorageClient:  # pylint: disable=too-few-public-methods
+    """nft.storage API client
+
+    Docs: https://nft.storage/api-docs/
+    """
+
+    nft_storage_upload = "/upload"
+    nft_storage_api = ""
+    api_key = ""
+    # Size of the chunks read from file-like sources while streaming a request.
+    chunk_size = 64 * 1024
+    max_request_bytes: int | None = None
+
+    def __init__(
+        self,
+        nft_storage_api: str,
+        api_key: str,
+        max_request_bytes: int | None = None,
+    ) -> None:
+        self.nft_storage_api = nft_storage_api
+        self.api_key = api_key
+        self.max_request_bytes = max_request_bytes
+
+    async def _iter_chunks(self, file: s3.AsyncReadable) -> typing.AsyncIterator[bytes]:
+        while chunk := await file.read(self.chunk_size):
+            yield chunk
+
+    async def upload_file(
+        self,
+        http_client: aiohttp.ClientSession,
+        file: dict[str, tuple[str, bytes | s3.AsyncReadable]],
+    ):
+        """Upload files in a single request.
+
+        File-like sources are streamed into the multipart body chunk by chunk, so
+        the memory used doesn't depend on the size of the files.
+
+        Args:
+            http_client (aiohttp.ClientSession): The session to send the request with.
+            file (dict[str, tuple[str, bytes | s3.AsyncReadable]]): The content type and
+                content of each file, by file name.
+        """
+        form_data = aiohttp.FormData()
+
+        for filename, file_object in file.items():
+            content = file_object[1]
+            form_data.add_field(
+                name="file",
+                value=(
+                    content
+                    if isinstance(content, bytes)
+                    else self._iter_chunks(content)
+                ),
+                content_type=file_object[0],
+                filename=filename,
+            )
+
+        with metrics.track_request("nft.storage", "upload"):
+            async with http_client.post(
+                url=f"{self.nft_storage_api}{self.nft_storage_upload}",
+                data=form_data,
+                headers={
+                    # "Content-Type": "multipart/form-data",
+                    "Authorization": f"Bearer {self.api_key}",
+                },
+            ) as response:
+                return await response.json()
+
+    async def upload_files(
+        self,
+        http_client: aiohttp.ClientSession,
+        file: dict[str, tuple[str, bytes | s3.AsyncReadable]],
+        sizes: typing.Mapping[str, int | None] | None = None,
+    ) -> list[typing.Any]:
+        """Upload files, split across several requests if they are too large.
+
+        Files are added to a request as long as their total size stays within
+        `max_request_bytes`, and the requests are sent one after another. A file
+        larger than that, or a file-like source of unknown size, is sent on its own.
+
+        Args:
+            http_client (aiohttp.ClientSession): The session to send the requests
+                with.
+            file (dict[str, tuple[str, bytes | s3.AsyncReadable]]): The content type and
+                content of each file, by file name.
+            sizes (typing.Mapping[str, int | None] | None): Size of the file-like
+                sources, by file name, if known.
+
+        Returns:
+            list[typing.Any]: The response of each request.
+        """
+        return [
+            await self.upload_file(http_client=http_client, file=batch)
+            for batch in self._split_batches(file, sizes or {})
+        ]
+
+    def _split_batches(
+        self,
+        file: dict[str, tuple[str, bytes | s3.AsyncReadable]],
+        sizes: typing.Mapping[str, int | None],
+    ) -> typing.Iterator[dict[str, tuple[str, bytes | s3.AsyncReadable]]]:
+        if self.max_request_bytes is None:
+            yield file
+            return
+
+        batch: dict[str, tuple[str, bytes | s3.AsyncReadable]] = {}
+        batch_bytes = 0
+
+        for filename, file_object in file.items():
+            content = file_object[1]
+            size = len(content) if isinstance(content, bytes) else sizes.get(filename)
+
+            if size is None:
+                size = self.max_request_bytes
+
+            if batch and batch_bytes + size > self.max_request_bytes:
+                yield batch
+                batch, batch_bytes = {}, 0
+
+            batch[filename] = file_object
+            batch_bytes += size
+
+        if batch:
+            yield batch
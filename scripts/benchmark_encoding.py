@@ -0,0 +1,61 @@
+"""
+scripts.benchmark_encoding
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Print how long each output option takes to encode an e-Certificate, and how big
+the result is. Run it from the repository root:
+
+    python -m scripts.benchmark_encoding path/to/font.ttf
+"""
+
+import argparse
+import pathlib
+import time
+
+import pydantic
+from PIL import Image, ImageDraw
+
+from app import models, services
+
+ENCODING_BENCHMARK_OPTIONS = {
+    "jpeg (defaults)": {},
+    "jpeg q60": {"quality": 60},
+    "jpeg q90 4:4:4": {"quality": 90, "subsampling": "4:4:4"},
+    "jpeg q75 optimized": {"optimize": True},
+    "jpeg q75 progressive": {"optimize": True, "progressive": True},
+    "webp q75": {"format": "webp"},
+    "webp q60": {"format": "webp", "quality": 60},
+    "avif q60": {"format": "avif", "quality": 60},
+    "pdf 150 dpi": {"format": "pdf", "resolution": 150},
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("font", type=pathlib.Path, help="A TrueType font.")
+    args = parser.parse_args()
+
+    font = services.FontSource.from_bytes(args.font.read_bytes())
+    image = Image.linear_gradient("L").resize((1200, 850)).convert("RGB")
+    ImageDraw.Draw(image).text(
+        (600, 425),
+        "Recipient Name",
+        fill="black",
+        font=services.font_cache.get(font, 48),
+    )
+
+    for name, options in ENCODING_BENCHMARK_OPTIONS.items():
+        try:
+            output = models.OutputOptions(**options)
+        except pydantic.ValidationError:
+            print(f"{name:<24} unsupported")
+            continue
+
+        started = time.perf_counter()
+        encoded = services.encode_image(image, output)
+        elapsed = time.perf_counter() - started
+        print(f"{name:<24} {elapsed * 1000:8.1f} ms {len(encoded):>10,} bytes")
+
+
+if __name__ == "__main__":
+    main()
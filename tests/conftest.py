@@ -0,0 +1,24 @@
+import os
+import pathlib
+
+import pytest
+
+FONT_DIRS = (
+    "/usr/share/fonts",
+    "/usr/local/share/fonts",
+    "/Library/Fonts",
+    "C:/Windows/Fonts",
+)
+
+
+@pytest.fixture(name="font_bytes", scope="session")
+def fixture_font_bytes() -> bytes:
+    """Any TrueType font; set CERTINIZE_TEST_FONT to pick one explicitly."""
+    if font_path := os.environ.get("CERTINIZE_TEST_FONT"):
+        return pathlib.Path(font_path).read_bytes()
+
+    for font_dir in FONT_DIRS:
+        for path in sorted(pathlib.Path(font_dir).glob("**/*.ttf")):
+            return path.read_bytes()
+
+    pytest.skip("no TrueType font available; set CERTINIZE_TEST_FONT")
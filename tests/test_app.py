@@ -1,5 +1,438 @@
-from app import __version__
+import asyncio
+import base64
+import io
+import json
+import time
+import types
+import typing
+from concurrent import futures
+
+import fastapi
+import pytest
+from botocore import exceptions
+from fastapi import testclient
+from PIL import Image
+
+from app import __version__, main, models, services
 
 
 def test_version():
-    assert __version__ == '0.1.0'
+    assert __version__ == "0.1.0"
+
+
+def _png(size: tuple[int, int] = (400, 200)) -> bytes:
+    template = io.BytesIO()
+    Image.new("RGB", size, "white").save(template, format="PNG")
+    return template.getvalue()
+
+
+class _FakeImageKitClient:  # pylint: disable=too-few-public-methods
+    def __init__(self) -> None:
+        self.uploads: dict[str, bytes] = {}
+
+    async def upload_file(
+        self,
+        file: str | bytes | typing.AsyncIterable[bytes],
+        file_name: str,
+        options: dict[str, typing.Any],
+        content_type: str = "image/jpeg",
+    ) -> dict[str, typing.Any]:
+        # pylint: disable=unused-argument
+        if isinstance(file, str):
+            self.uploads[file_name] = base64.b64decode(file.rpartition(",")[2])
+        elif isinstance(file, bytes):
+            self.uploads[file_name] = file
+        else:
+            self.uploads[file_name] = b"".join([chunk async for chunk in file])
+
+        return {"url": f"https://ik.example.com/{file_name}", "name": file_name}
+
+
+class _FakeS3Client:
+    def __init__(self) -> None:
+        self.exceptions = types.SimpleNamespace(
+            NoSuchBucket=LookupError, ClientError=exceptions.ClientError
+        )
+        self.objects: dict[str, bytes] = {}
+
+    async def generate_presigned_post(self, Bucket: str, Key: str, **_):
+        # pylint: disable=invalid-name
+        return {"url": f"https://{Bucket}.example.com", "fields": {"key": Key}}
+
+    async def head_object(self, Bucket: str, Key: str):
+        # pylint: disable=invalid-name,unused-argument
+        if Key not in self.objects:
+            raise exceptions.ClientError({"Error": {"Code": "404"}}, "HeadObject")
+
+        return {"ContentLength": len(self.objects[Key]), "ETag": '"etag"'}
+
+
+class _FakeNftStorageClient:  # pylint: disable=too-few-public-methods
+    def __init__(self) -> None:
+        self.files: dict[str, bytes] = {}
+
+    async def upload_files(self, http_client, file, sizes) -> list[dict[str, str]]:
+        # pylint: disable=unused-argument
+        for filename, (_, content) in file.items():
+            self.files[filename] = await content.read()
+
+        return [{"cid": "bafy"}]
+
+
+class _FakeAssetCache:  # pylint: disable=too-few-public-methods
+    def __init__(self, assets: dict[str, bytes]) -> None:
+        self.assets = assets
+
+    async def get(self, _, url: str, **__) -> services.CachedAsset:
+        return services.CachedAsset(url=url, data=self.assets[url], digest=url)
+
+
+class _FakeDriveClient:
+    def __init__(self) -> None:
+        # Holds uploads until it is cleared, or the request is cancelled.
+        self.hold = False
+        self.files: dict[str, bytes] = {}
+
+    async def create_folder(self, folder_name: str, share: bool) -> dict[str, str]:
+        # pylint: disable=unused-argument
+        while self.hold:
+            await asyncio.sleep(0.01)
+
+        return {"id": folder_name}
+
+    async def upload_files_as_ready(
+        self, files_, folder_id: str, share: bool, on_uploaded
+    ) -> list[tuple[str, str]]:
+        # pylint: disable=unused-argument
+        responses = []
+
+        async for index, (file, file_name) in files_:
+            self.files[file_name] = file.getvalue()
+            response = (f"https://drive.example.com/{file_name}", file_name)
+            await on_uploaded(index, response)
+            responses.append(response)
+
+        return responses
+
+
+@pytest.fixture(name="client")
+def fixture_client(font_bytes: bytes) -> typing.Iterator[testclient.TestClient]:
+    app = main.get_application()
+    # Fakes stand in for the clients the startup handlers would create.
+    app.router.on_startup.clear()
+    app.router.on_shutdown.clear()
+
+    storj = services.StorageBackend(
+        name="storj",
+        network="IPFS",
+        session=services.S3ClientSession(
+            bucket_name="bucket",
+            exit_stack=None,  # type: ignore
+            s3client=_FakeS3Client(),  # type: ignore
+        ),
+    )
+    job_runner = services.CertificateJobRunner(store=services.InMemoryJobStore())
+    app.state.imagekit_client = _FakeImageKitClient()
+    app.state.template_variant_index = services.InMemoryTemplateVariantIndex()
+    app.state.storage_router = services.StorageRouter([storj])
+    app.state.certificate_job_runner = job_runner
+    app.state.certificate_coalescer = services.RequestCoalescer()
+    app.state.http_client = None
+    app.state.nft_storage_client = _FakeNftStorageClient()
+    app.state.asset_cache = _FakeAssetCache(
+        {
+            "https://example.com/template.png": _png(),
+            "https://example.com/font.ttf": font_bytes,
+        }
+    )
+    app.state.gdrive = _FakeDriveClient()
+    app.state.render_result_cache = services.RenderResultCache()
+    app.add_event_handler("startup", job_runner.start)
+    app.add_event_handler("shutdown", job_runner.stop)
+
+    with futures.ThreadPoolExecutor(2) as executor:
+        app.state.image_processor = services.ImageProcessor(executor)
+
+        with testclient.TestClient(app) as client:
+            yield client
+
+
+def _app_state(client: testclient.TestClient) -> typing.Any:
+    return typing.cast(fastapi.FastAPI, client.app).state
+
+
+@pytest.mark.parametrize("upload_as", ["octet-stream", "multipart", "json"])
+def test_add_certificate_template_dispatches_on_content_type(
+    client: testclient.TestClient, upload_as: str
+):
+    template = _png((1600, 800))
+    options = {"folder": "templates"}
+
+    match upload_as:
+        case "octet-stream":
+            response = client.post(
+                "/templates",
+                params={"filename": "template.png", "options": json.dumps(options)},
+                content=template,
+                headers={"Content-Type": "application/octet-stream"},
+            )
+        case "multipart":
+            response = client.post(
+                "/templates",
+                files={"file": ("template.png", template, "image/png")},
+                data={"options": json.dumps(options)},
+            )
+        case _:
+            response = client.post(
+                "/templates",
+                json={
+                    "filename": "template.png",
+                    "options": options,
+                    "fileb": base64.b64encode(template).decode(),
+                },
+            )
+
+    assert response.status_code == 201, response.text
+    body = response.json()
+    uploads = _app_state(client).imagekit_client.uploads
+    assert body["url"] == "https://ik.example.com/template.png"
+    assert uploads["template.png"] == template
+    # The template is only scaled down, and its own size is the original.
+    assert [(variant["width"], variant["height"]) for variant in body["variants"]] == [
+        (1440, 720)
+    ]
+    assert Image.open(io.BytesIO(uploads["template-1440x720.png"])).size == (
+        1440,
+        720,
+    )
+
+
+def test_add_certificate_template_rejects_unknown_files(client: testclient.TestClient):
+    response = client.post(
+        "/templates",
+        params={"filename": "template.txt"},
+        content=b"not an image at all",
+        headers={"Content-Type": "application/octet-stream"},
+    )
+
+    assert response.status_code == 400
+    assert not _app_state(client).imagekit_client.uploads
+
+
+def test_add_certificate_template_rejects_truncated_images(
+    client: testclient.TestClient,
+):
+    response = client.post(
+        "/templates",
+        params={"filename": "template.png"},
+        content=_png((1600, 800))[:-100],
+        headers={"Content-Type": "application/octet-stream"},
+    )
+
+    assert response.status_code == 400
+    assert not _app_state(client).imagekit_client.uploads
+
+
+def test_add_certificate_template_survives_variant_failures(
+    client: testclient.TestClient,
+):
+    imagekit_client = _app_state(client).imagekit_client
+    upload_file = imagekit_client.upload_file
+
+    async def fail_variants(file, file_name: str, **kwargs) -> dict[str, typing.Any]:
+        if file_name != "template.png":
+            raise RuntimeError("upload failed")
+
+        return await upload_file(file, file_name, **kwargs)
+
+    imagekit_client.upload_file = fail_variants
+    response = client.post(
+        "/templates",
+        params={"filename": "template.png"},
+        content=_png((1600, 800)),
+        headers={"Content-Type": "application/octet-stream"},
+    )
+
+    assert response.status_code == 201
+    assert response.json()["variants"] == []
+    assert list(imagekit_client.uploads) == ["template.png"]
+
+
+def test_upload_permanent_object_returns_a_list_of_responses(
+    client: testclient.TestClient,
+):
+    response = client.post(
+        "/storages", files={"file": ("certificate.png", _png(), "image/png")}
+    )
+
+    assert response.status_code == 201, response.text
+    # The same shape whether or not the files were split across several requests.
+    assert response.json()["response_meta"] == [{"cid": "bafy"}]
+    assert response.json()["objects"] == [
+        {
+            "key": "certificate.png",
+            "bucket_name": "files (nft.storage)",
+            "network": "IPFS",
+        }
+    ]
+    assert _app_state(client).nft_storage_client.files == {"certificate.png": _png()}
+
+
+def test_presigned_uploads_are_completed_once(client: testclient.TestClient):
+    response = client.post("/storages/presign", json={"keys": ["0.png", "1.png"]})
+
+    assert response.status_code == 200
+    presigned = response.json()
+    assert presigned["backend"] == "storj"
+    assert [post["fields"]["key"] for post in presigned["presigned_posts"]] == [
+        "0.png",
+        "1.png",
+    ]
+
+    storage_router = _app_state(client).storage_router
+    storage_router.get_backend("storj").session.s3client.objects["0.png"] = b"image"
+
+    for _ in range(2):
+        response = client.post(
+            "/storages/presign/complete",
+            json={"backend": "storj", "keys": ["0.png", "1.png", "0.png"]},
+        )
+
+        assert response.status_code == 200
+        assert response.json()["response_meta"] == [
+            {"Key": "0.png", "ContentLength": 5, "ETag": '"etag"'}
+        ]
+        assert response.json()["missing"] == ["1.png"]
+
+    assert storage_router.get_backend("storj").bytes_written == 5
+
+    response = client.post(
+        "/storages/presign/complete", json={"backend": "filebase", "keys": ["0.png"]}
+    )
+
+    assert response.status_code == 404
+
+
+def test_get_metrics_renders_prometheus_text(client: testclient.TestClient):
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert "certinize_certificate_jobs_queued 0" in response.text.splitlines()
+
+
+def _certificate_job() -> dict[str, typing.Any]:
+    return models.CertificateTemplateMeta(
+        recipient_name_meta=models.CertificateTextMeta(
+            font_size=12,
+            font_url="https://example.com/font.ttf",  # type: ignore
+            position={"x": 200, "y": 100},
+        ),
+        template_url="https://example.com/template.png",  # type: ignore
+        recipients=[
+            models.Recipient(recipient_name=f"Recipient {i}") for i in range(3)
+        ],
+    ).dict()
+
+
+def test_generate_certificates_replays_idempotency_keys(
+    client: testclient.TestClient,
+):
+    headers = {"Idempotency-Key": "batch-1"}
+    first = client.post("/certificates", json=_certificate_job(), headers=headers)
+    replay = client.post("/certificates", json=_certificate_job(), headers=headers)
+
+    assert first.status_code == 201, first.text
+    assert replay.status_code == 201
+    assert replay.json() == first.json()
+    assert [ecert["recipient_name"] for ecert in first.json()["certificate"]] == [
+        f"Recipient {i}" for i in range(3)
+    ]
+    assert _app_state(client).certificate_coalescer.stats()["replayed"] == 1
+    assert len(_app_state(client).gdrive.files) == 3
+
+
+def test_generate_certificates_rejects_reused_idempotency_keys(
+    client: testclient.TestClient,
+):
+    headers = {"Idempotency-Key": "batch-1"}
+    other = _certificate_job()
+    other["recipients"] = other["recipients"][:1]
+
+    first = client.post("/certificates", json=_certificate_job(), headers=headers)
+    response = client.post("/certificates", json=other, headers=headers)
+
+    assert first.status_code == 201, first.text
+
+    assert response.status_code == 422
+    assert "batch-1" in response.json()["detail"]
+
+
+def test_generate_certificates_coalesces_concurrent_duplicates(
+    client: testclient.TestClient,
+):
+    state = _app_state(client)
+    state.gdrive.hold = True
+
+    with futures.ThreadPoolExecutor(2) as executor:
+        requests = [
+            executor.submit(client.post, "/certificates", json=_certificate_job())
+            for _ in range(2)
+        ]
+        deadline = time.monotonic() + 10.0
+
+        # Let the uploads go once the second request waits on the first one.
+        while state.certificate_coalescer.coalesced < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        state.gdrive.hold = False
+        first, second = [request.result() for request in requests]
+
+    assert first.status_code == second.status_code == 201
+    assert first.json() == second.json()
+    assert state.certificate_coalescer.stats()["coalesced"] == 1
+    assert len(state.gdrive.files) == 3
+
+
+def _wait_for_job(
+    client: testclient.TestClient, job_id: str, timeout: float = 10.0
+) -> dict[str, typing.Any]:
+    deadline = time.monotonic() + timeout
+
+    while True:
+        job = client.get(f"/certificates/jobs/{job_id}").json()
+
+        if job["status"] not in ("queued", "running") or time.monotonic() > deadline:
+            return job
+
+        time.sleep(0.01)
+
+
+def test_certificate_jobs_run_in_the_background(client: testclient.TestClient):
+    response = client.post("/certificates/jobs", json=_certificate_job())
+
+    assert response.status_code == 202
+    job = _wait_for_job(client, response.json()["job_id"])
+
+    assert job["status"] == "succeeded", job
+    assert job["completed"] == 3
+    assert [result["recipient_name"] for result in job["results"]] == [
+        f"Recipient {i}" for i in range(3)
+    ]
+    assert len(_app_state(client).gdrive.files) == 3
+    assert client.get("/certificates/jobs/unknown").status_code == 404
+
+
+def test_certificate_jobs_can_be_cancelled(client: testclient.TestClient):
+    _app_state(client).gdrive.hold = True
+    job_id = client.post("/certificates/jobs", json=_certificate_job()).json()["job_id"]
+
+    while client.get(f"/certificates/jobs/{job_id}").json()["status"] == "queued":
+        time.sleep(0.01)
+
+    response = client.delete(f"/certificates/jobs/{job_id}")
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "cancelled"
+    assert client.get(f"/certificates/jobs/{job_id}").json()["status"] == "cancelled"
+    assert client.delete("/certificates/jobs/unknown").status_code == 404
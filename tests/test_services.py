@@ -0,0 +1,1609 @@
+import asyncio
+import contextlib
+import io
+import json
+import mimetypes
+import multiprocessing
+import os
+import pickle
+import socket
+import subprocess
+import sys
+import types
+import typing
+from concurrent import futures
+from multiprocessing import resource_tracker
+
+import aiohttp
+import pydantic
+import pytest
+from botocore import exceptions
+from aiohttp import web
+from PIL import Image, ImageDraw
+
+from app import models, services
+
+
+@pytest.fixture(name="font")
+def fixture_font(font_bytes: bytes) -> services.FontSource:
+    return services.FontSource.from_bytes(font_bytes)
+
+
+def test_font_cache_counts_hits_and_misses(font: services.FontSource):
+    cache = services.FontCache(max_size=2)
+
+    first = cache.get(font, 24)
+    assert cache.get(font, 24) is first
+    cache.get(font, 32)
+
+    assert cache.stats() == {"size": 2, "max_size": 2, "hits": 1, "misses": 2}
+
+
+def test_font_cache_evicts_least_recently_used(font: services.FontSource):
+    cache = services.FontCache(max_size=2)
+
+    cache.get(font, 10)
+    cache.get(font, 20)
+    cache.get(font, 10)
+    cache.get(font, 30)
+    cache.get(font, 10)
+
+    assert cache.hits == 2
+    cache.get(font, 20)
+    assert cache.misses == 4
+
+
+async def _serve(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def test_asset_cache_revalidates_with_etag(tmp_path):
+    requests: list[str | None] = []
+
+    async def template(request: web.Request) -> web.Response:
+        requests.append(request.headers.get("If-None-Match"))
+
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+
+        return web.Response(body=b"template", headers={"ETag": '"v1"'})
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/template.png", template)
+        runner, base_url = await _serve(app)
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                cache = services.AssetCache(disk_dir=str(tmp_path), max_age=0)
+                first = await cache.get(session, f"{base_url}/template.png")
+                second = await cache.get(session, f"{base_url}/template.png")
+
+                # A fresh cache backed by the same directory reuses the disk tier.
+                restarted = services.AssetCache(disk_dir=str(tmp_path), max_age=0)
+                third = await restarted.get(session, f"{base_url}/template.png")
+        finally:
+            await runner.cleanup()
+
+        return first, second, third
+
+    first, second, third = asyncio.run(main())
+
+    assert requests == [None, '"v1"', '"v1"']
+    assert first is second
+    assert third.data == b"template"
+    assert third.digest == first.digest
+
+
+def test_asset_cache_downloads_survive_cancelled_waiters():
+    downloads = 0
+    release = asyncio.Event()
+
+    async def font(_: web.Request) -> web.Response:
+        nonlocal downloads
+        downloads += 1
+        await release.wait()
+        return web.Response(body=b"font")
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/font.ttf", font)
+        runner, base_url = await _serve(app)
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                cache = services.AssetCache()
+                first = asyncio.create_task(cache.get(session, f"{base_url}/font.ttf"))
+                second = asyncio.create_task(cache.get(session, f"{base_url}/font.ttf"))
+
+                while not downloads:
+                    await asyncio.sleep(0.01)
+
+                # The request that started the download goes away mid-download.
+                first.cancel()
+                await asyncio.gather(first, return_exceptions=True)
+                release.set()
+                asset = await second
+
+                # Once every waiter is gone, the download itself is cancelled.
+                release.clear()
+                cache = services.AssetCache()
+                waiter = asyncio.create_task(cache.get(session, f"{base_url}/font.ttf"))
+
+                while downloads < 2:
+                    await asyncio.sleep(0.01)
+
+                download = cache._inflight[
+                    f"{base_url}/font.ttf"
+                ]  # pylint: disable=W0212
+                waiter.cancel()
+                await asyncio.gather(waiter, download, return_exceptions=True)
+                release.set()
+        finally:
+            await runner.cleanup()
+
+        return first, asset, download
+
+    first, asset, download = asyncio.run(main())
+
+    assert first.cancelled()
+    assert asset.data == b"font"
+    assert downloads == 2
+    assert download.cancelled()
+
+
+def test_asset_cache_rejects_failed_downloads():
+    async def main():
+        app = web.Application()
+        runner, base_url = await _serve(app)
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                await services.AssetCache().get(session, f"{base_url}/missing.ttf")
+        finally:
+            await runner.cleanup()
+
+    with pytest.raises(services.AssetFetchError):
+        asyncio.run(main())
+
+
+@pytest.mark.parametrize(
+    ("body", "content_type", "status_code"),
+    [
+        (b"x" * 2048, "image/png", 413),
+        (b"<html></html>", "text/html", 415),
+    ],
+)
+def test_asset_cache_aborts_unacceptable_downloads(
+    body: bytes, content_type: str, status_code: int
+):
+    async def template(_: web.Request) -> web.Response:
+        return web.Response(body=body, content_type=content_type)
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/template", template)
+        runner, base_url = await _serve(app)
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                await services.AssetCache(max_download_bytes=1024).get(
+                    session,
+                    f"{base_url}/template",
+                    content_types=services.TEMPLATE_CONTENT_TYPES,
+                )
+        finally:
+            await runner.cleanup()
+
+    with pytest.raises(services.AssetFetchError) as fetch_err:
+        asyncio.run(main())
+
+    assert fetch_err.value.status_code == status_code
+
+
+def test_bounded_task_runner_retries_rate_limited_uploads_in_order():
+    attempts: dict[str, int] = {}
+    in_flight = 0
+    max_in_flight = 0
+
+    async def upload(request: web.Request) -> web.Response:
+        # A fake Drive upload endpoint that rate limits the first attempt of each
+        # file and reports how many uploads it served at once.
+        nonlocal in_flight, max_in_flight
+        name = request.match_info["name"]
+        attempts[name] = attempts.get(name, 0) + 1
+
+        if attempts[name] == 1:
+            return web.Response(status=429)
+
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return web.json_response({"id": name})
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/upload/{name}", upload)
+        runner, base_url = await _serve(app)
+
+        try:
+            async with aiohttp.ClientSession(raise_for_status=True) as session:
+
+                async def upload_file(name: str) -> str:
+                    async with session.post(f"{base_url}/upload/{name}") as response:
+                        return (await response.json())["id"]
+
+                runner_ = services.BoundedTaskRunner(
+                    task=upload_file,
+                    max_concurrency=2,
+                    retry_policy=services.RetryPolicy(backoff_base=0.001),
+                )
+                return await runner_.run(f"cert-{i}" for i in range(6))
+        finally:
+            await runner.cleanup()
+
+    results = asyncio.run(main())
+
+    assert results == [f"cert-{i}" for i in range(6)]
+    assert all(count == 2 for count in attempts.values())
+    assert max_in_flight <= 2
+
+
+def test_bounded_task_runner_does_not_retry_client_errors():
+    calls = 0
+
+    async def upload(_: str) -> str:
+        nonlocal calls
+        calls += 1
+        raise aiohttp.ClientResponseError(
+            request_info=None, history=(), status=403  # type: ignore
+        )
+
+    runner = services.BoundedTaskRunner(
+        task=upload, retry_policy=services.RetryPolicy(backoff_base=0.001)
+    )
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(runner.run(["cert"]))
+
+    assert calls == 1
+
+
+def test_image_processor_streams_every_recipient(font_bytes: bytes):
+    template = io.BytesIO()
+    Image.new("RGB", (400, 200), "white").save(template, format="PNG")
+    certificate_meta = models.CertificateMeta(
+        font_color="black",
+        template=template.getvalue(),
+        name_font_style=font_bytes,
+        template_height=100,
+    )
+    recipients = [
+        models.CertificateRecipient(
+            recipient_name=f"Recipient {i}", text_position=(100, 50), text_size=12
+        )
+        for i in range(5)
+    ]
+
+    async def main():
+        with futures.ThreadPoolExecutor(2) as executor:
+            image_processor = services.ImageProcessor(executor, max_pending=2)
+
+            async with contextlib.aclosing(
+                image_processor.iter_attach_text(certificate_meta, recipients)
+            ) as ecerts:
+                return [(index, ecert) async for index, ecert in ecerts]
+
+    rendered = asyncio.run(main())
+    lookups = {
+        line.rpartition(" ")[0]: float(line.rpartition(" ")[2])
+        for line in services.metrics.render().splitlines()
+        if line.startswith("certinize_font_cache_lookups_total")
+    }
+
+    assert sorted(index for index, _ in rendered) == list(range(5))
+    assert all(
+        Image.open(io.BytesIO(ecert)).size == (200, 100) for _, ecert in rendered
+    )
+    # The font cache stats of the workers are reported back to this process.
+    assert (
+        services.font_cache.hits
+        == lookups['certinize_font_cache_lookups_total{outcome="hit"}']
+    )
+    assert (
+        services.font_cache.misses
+        == lookups['certinize_font_cache_lookups_total{outcome="miss"}']
+    )
+
+
+def _shared_memory_blocks() -> set[str]:
+    if not os.path.isdir("/dev/shm"):
+        pytest.skip("shared memory blocks aren't listed under /dev/shm")
+
+    return set(os.listdir("/dev/shm"))
+
+
+def _crash_worker(*_: typing.Any) -> typing.NoReturn:
+    os._exit(1)  # pylint: disable=W0212
+
+
+def _fork_executor(max_workers: int) -> futures.ProcessPoolExecutor:
+    # Workers must report to the resource tracker of this process, as they do in
+    # `app.events.create_image_processor()`.
+    resource_tracker.ensure_running()
+    return futures.ProcessPoolExecutor(
+        max_workers, mp_context=multiprocessing.get_context("fork")
+    )
+
+
+def _certificate_batch(
+    font_bytes: bytes, count: int
+) -> tuple[models.CertificateMeta, list[models.CertificateRecipient]]:
+    template = io.BytesIO()
+    Image.new("RGB", (400, 200), "white").save(template, format="PNG")
+    certificate_meta = models.CertificateMeta(
+        font_color="black",
+        template=template.getvalue(),
+        name_font_style=font_bytes,
+        template_height=100,
+    )
+    recipients = [
+        models.CertificateRecipient(
+            recipient_name=f"Recipient {i}", text_position=(100, 50), text_size=12
+        )
+        for i in range(count)
+    ]
+    return certificate_meta, recipients
+
+
+def _load_prepared_template(
+    prepared: services.PreparedTemplate,
+) -> tuple[tuple[int, int], bytes]:
+    image = prepared.load()
+    return image.size, image.tobytes()
+
+
+def test_prepared_template_is_shared_until_unlinked():
+    template = io.BytesIO()
+    Image.new("RGB", (40, 20), "red").save(template, format="PNG")
+    blocks = _shared_memory_blocks()
+
+    prepared = services.prepare_template(template.getvalue(), template_height=10)
+
+    try:
+        assert _shared_memory_blocks() - blocks == {prepared.shm_name}
+
+        # Workers attach to the block by name and render onto their own copy.
+        with _fork_executor(1) as executor:
+            size, pixels = executor.submit(_load_prepared_template, prepared).result()
+
+        assert size == (20, 10)
+        assert pixels == prepared.load().tobytes()
+        assert _shared_memory_blocks() - blocks == {prepared.shm_name}
+    finally:
+        prepared.unlink()
+
+    assert _shared_memory_blocks() == blocks
+
+    with pytest.raises(FileNotFoundError):
+        prepared.load()
+
+
+def test_image_processor_renders_in_a_process_pool(font_bytes: bytes):
+    certificate_meta, recipients = _certificate_batch(font_bytes, 5)
+    blocks = _shared_memory_blocks()
+
+    async def main():
+        image_processor = services.ImageProcessor(_fork_executor(2), max_pending=2)
+
+        try:
+            async with contextlib.aclosing(
+                image_processor.iter_attach_text(certificate_meta, recipients)
+            ) as ecerts:
+                rendered = [(index, ecert) async for index, ecert in ecerts]
+
+            # The prepared template stays cached for the next batch.
+            assert len(_shared_memory_blocks() - blocks) == 1
+            return rendered
+        finally:
+            image_processor.shutdown()
+
+    rendered = asyncio.run(main())
+
+    assert sorted(index for index, _ in rendered) == list(range(5))
+    assert all(
+        Image.open(io.BytesIO(ecert)).size == (200, 100) for _, ecert in rendered
+    )
+    assert _shared_memory_blocks() == blocks
+
+
+class _PicklingExecutor(futures.ThreadPoolExecutor):
+    """Records how many bytes each call would send to a process pool worker."""
+
+    def __init__(self) -> None:
+        super().__init__(2)
+        self.payloads: list[int] = []
+
+    def submit(self, fn, /, *args, **kwargs):
+        self.payloads.append(len(pickle.dumps((fn, args, kwargs))))
+        return super().submit(fn, *args, **kwargs)
+
+
+def test_image_processor_shares_fonts_instead_of_sending_them(font_bytes: bytes):
+    certificate_meta, recipients = _certificate_batch(font_bytes, 3)
+    certificate_meta.name_max_width = 150
+    blocks = _shared_memory_blocks()
+    executor = _PicklingExecutor()
+
+    async def main():
+        image_processor = services.ImageProcessor(executor)
+
+        try:
+            return await image_processor.attach_text(certificate_meta, recipients)
+        finally:
+            image_processor.shutdown()
+
+    ecerts = asyncio.run(main())
+
+    assert len(ecerts) == 3
+    # The template is prepared once with the whole font file; renders only carry
+    # the names of the shared memory blocks.
+    assert len(executor.payloads) == 4
+    assert all(payload < 4096 < len(font_bytes) for payload in executor.payloads[1:])
+    assert _shared_memory_blocks() == blocks
+
+
+def test_image_processor_frees_templates_when_a_worker_crashes(
+    font_bytes: bytes, monkeypatch
+):
+    certificate_meta, recipients = _certificate_batch(font_bytes, 3)
+    blocks = _shared_memory_blocks()
+    monkeypatch.setattr(services.rendering, "render_certificate_timed", _crash_worker)
+
+    async def main():
+        image_processor = services.ImageProcessor(_fork_executor(2), max_pending=2)
+
+        try:
+            with pytest.raises(futures.process.BrokenProcessPool):
+                async with contextlib.aclosing(
+                    image_processor.iter_attach_text(certificate_meta, recipients)
+                ) as ecerts:
+                    async for _ in ecerts:
+                        pass
+
+            # The crashed batch no longer holds on to its template.
+            assert not image_processor._template_users  # pylint: disable=W0212
+        finally:
+            image_processor.shutdown()
+
+    asyncio.run(main())
+
+    assert _shared_memory_blocks() == blocks
+
+
+def test_glyph_metrics_fit_names_in_the_box(font: services.FontSource, monkeypatch):
+    font_cache = services.FontCache(max_size=64)
+    monkeypatch.setattr(services.caches, "font_cache", font_cache)
+    metrics = services.GlyphMetricsCache(max_size=8)
+    names = ["Ana"] + [f"Recipient {'Long ' * (i % 12)}Name {i}" for i in range(2000)]
+
+    sizes = [
+        metrics.fit(font, 48, name, max_width=400, max_height=60) for name in names
+    ]
+
+    assert sizes[0] == 48
+    assert min(sizes) < 48
+    # Candidate sizes are measured from scaled metrics; only the fitted sizes, which
+    # the names are drawn with, are parsed.
+    assert font_cache.misses == len(set(sizes))
+
+    for name, size in zip(names[:50], sizes):
+        parsed = font_cache.get(font, size)
+        assert parsed.getlength(name) <= 400
+        assert sum(parsed.getmetrics()) <= 60
+
+    assert metrics.fit(font, 48, "Name", max_height=10) < 48
+    assert len(metrics) <= 8
+
+
+def test_image_processor_draws_static_layers_once_per_template(font_bytes: bytes):
+    template = io.BytesIO()
+    Image.new("RGB", (400, 200), "white").save(template, format="PNG")
+
+    def layer(text: str, static: bool, y: int) -> models.CertificateTextLayer:
+        return models.CertificateTextLayer(
+            text=text,
+            text_position=(200, y),
+            text_size=16,
+            font_style=font_bytes,
+            static=static,
+        )
+
+    def certificate_meta(event: str) -> models.CertificateMeta:
+        return models.CertificateMeta(
+            font_color="black",
+            template=template.getvalue(),
+            name_font_style=font_bytes,
+            text_layers=[layer(event, True, 30), layer("award", False, 170)],
+            output=models.OutputOptions(quality=100, subsampling="4:4:4"),
+        )
+
+    recipient = models.CertificateRecipient(
+        recipient_name="Recipient",
+        text_position=(200, 100),
+        text_size=24,
+        fields={"award": "Best Paper"},
+    )
+
+    async def main():
+        with futures.ThreadPoolExecutor(2) as executor:
+            image_processor = services.ImageProcessor(executor)
+            rendered = [
+                await image_processor.attach_text(certificate_meta(event), [recipient])
+                for event in ("Event A", "Event A", "Event B")
+            ]
+            templates = len(image_processor._templates)  # pylint: disable=W0212
+            image_processor.shutdown()
+            return rendered, templates
+
+    rendered, templates = asyncio.run(main())
+
+    # The same template is prepared once per set of static layers.
+    assert templates == 2
+    assert rendered[0] == rendered[1] != rendered[2]
+
+    expected = Image.new("RGB", (400, 200), "white")
+    draw = ImageDraw.Draw(expected)
+    font = services.FontSource.from_bytes(font_bytes)
+
+    for text, size, y in (
+        ("Event A", 16, 30),
+        ("Recipient", 24, 100),
+        ("Best Paper", 16, 170),
+    ):
+        font_ = services.font_cache.get(font, size)
+        draw.text((200, y), text, fill="black", font=font_, anchor="mm")
+
+    actual = Image.open(io.BytesIO(rendered[0][0]))
+    assert max(abs(a - b) for a, b in zip(actual.tobytes(), expected.tobytes())) < 32
+
+    with pytest.raises(pydantic.ValidationError, match="missing fields: award"):
+        models.CertificateTemplateMeta(
+            recipient_name_meta={
+                "font_size": 24,
+                "font_url": "https://example.com/a.ttf",
+                "position": {"x": 200, "y": 100},
+            },
+            template_url="https://example.com/a.png",
+            recipients=[{"recipient_name": "Recipient"}],
+            text_layers=[
+                {
+                    "text": "award",
+                    "static": False,
+                    "font_size": 16,
+                    "font_url": "https://example.com/a.ttf",
+                    "position": {"x": 200, "y": 170},
+                }
+            ],
+        )
+
+
+@pytest.mark.parametrize("index_type", ["memory", "sqlite"])
+def test_template_variants_match_prepared_templates(index_type: str, tmp_path):
+    template = io.BytesIO()
+    Image.linear_gradient("L").resize((400, 300)).save(template, format="PNG")
+
+    variants = services.make_template_variants(template.getvalue(), [100, 300, 600])
+
+    # The template is rendered from as is at its own size.
+    assert [size for size, _ in variants] == [(133, 100)]
+    prepared = services.prepare_template(template.getvalue(), 100)
+
+    try:
+        pixels = Image.open(io.BytesIO(variants[0][1])).tobytes()
+        assert pixels == prepared.load().tobytes()
+    finally:
+        prepared.unlink()
+
+    with pytest.raises(OSError):
+        services.make_template_variants(template.getvalue()[:-100], [100])
+
+    async def main():
+        index: services.TemplateVariantIndex = (
+            services.InMemoryTemplateVariantIndex()
+            if index_type == "memory"
+            else services.SQLiteTemplateVariantIndex(str(tmp_path / "variants.db"))
+        )
+
+        try:
+            await index.put(
+                "https://templates/a.png",
+                [services.TemplateVariant("https://templates/a-100.png", 133, 100)],
+            )
+            return (
+                await index.get("https://templates/a.png"),
+                await index.get("https://templates/b.png"),
+            )
+        finally:
+            await index.close()
+
+    stored, missing = asyncio.run(main())
+
+    assert missing == []
+    assert services.select_template_variant(stored, 100) == stored[0]
+    assert services.select_template_variant(stored, None) is None
+    assert services.select_template_variant(stored, 300) is None
+    assert services.select_template_variant(stored, 200) is None
+
+
+def test_metrics_render_prometheus_text():
+    metrics = services.Metrics(buckets=(0.1, 1.0))
+    metrics.observe("certinize_stage_duration_seconds", 0.05, stage="draw")
+    metrics.observe("certinize_stage_duration_seconds", 0.5, stage="draw")
+    metrics.inc("certinize_stage_bytes_total", 1024, stage="encode")
+
+    with pytest.raises(RuntimeError):
+        with metrics.track_request("gdrive", "upload"):
+            raise RuntimeError
+
+    text = metrics.render()
+
+    assert "# TYPE certinize_stage_duration_seconds histogram" in text
+    assert 'certinize_stage_duration_seconds_bucket{stage="draw",le="0.1"} 1' in text
+    assert 'certinize_stage_duration_seconds_bucket{stage="draw",le="1"} 2' in text
+    assert 'certinize_stage_duration_seconds_bucket{stage="draw",le="+Inf"} 2' in text
+    assert 'certinize_stage_duration_seconds_sum{stage="draw"} 0.55' in text
+    assert 'certinize_stage_bytes_total{stage="encode"} 1024' in text
+    assert (
+        "certinize_storage_requests_total"
+        '{operation="upload",outcome="error",provider="gdrive"} 1'
+    ) in text
+    assert 'certinize_storage_requests_in_flight{provider="gdrive"} 0' in text
+
+
+def test_image_processor_records_render_stages(font_bytes: bytes):
+    template = io.BytesIO()
+    Image.new("RGB", (100, 50), "white").save(template, format="PNG")
+    certificate_meta = models.CertificateMeta(
+        font_color="black", template=template.getvalue(), name_font_style=font_bytes
+    )
+    recipient = models.CertificateRecipient(
+        recipient_name="Recipient", text_position=(50, 25), text_size=12
+    )
+
+    async def main():
+        with futures.ThreadPoolExecutor(1) as executor:
+            image_processor = services.ImageProcessor(executor)
+            await image_processor.attach_text(certificate_meta, [recipient])
+            image_processor.shutdown()
+
+    asyncio.run(main())
+    text = services.metrics.render()
+
+    for stage in ("template_prepare", "render_queue", "template_load", "draw"):
+        assert f'certinize_stage_duration_seconds_count{{stage="{stage}"}}' in text
+
+    assert 'certinize_stage_bytes_total{stage="encode"}' in text
+    assert "certinize_render_tasks_in_flight 0" in text
+
+
+@pytest.mark.parametrize("output_format", list(models.OutputFormat))
+def test_encode_image_writes_the_requested_format(output_format: models.OutputFormat):
+    image = Image.new("RGB", (120, 85), "white")
+    ImageDraw.Draw(image).rectangle((10, 10, 60, 40), fill="black")
+
+    # The extension and MIME type are what Drive stores the e-Certificate as.
+    assert mimetypes.guess_type(f"ecert{output_format.extension}")[0] == (
+        output_format.mimetype
+    )
+
+    try:
+        output = models.OutputOptions(format=output_format)
+    except pydantic.ValidationError:
+        pytest.skip(f"this Pillow build can't encode {output_format.value}")
+
+    encoded = services.encode_image(image, output)
+
+    if output_format is models.OutputFormat.PDF:
+        assert encoded.startswith(b"%PDF")
+    else:
+        with Image.open(io.BytesIO(encoded)) as decoded:
+            assert decoded.format == output_format.name
+            assert Image.MIME[decoded.format] == output_format.mimetype
+            assert decoded.size == image.size
+
+
+def test_output_formats_have_their_registered_mimetypes():
+    assert {
+        fmt.value: (fmt.extension, fmt.mimetype) for fmt in models.OutputFormat
+    } == {
+        "jpeg": (".jpeg", "image/jpeg"),
+        "webp": (".webp", "image/webp"),
+        "avif": (".avif", "image/avif"),
+        "pdf": (".pdf", "application/pdf"),
+    }
+
+
+def test_render_result_cache_expires_and_evicts_entries(monkeypatch):
+    now = 0.0
+    monkeypatch.setattr(services.caches.time, "monotonic", lambda: now)
+    certificate_meta = models.CertificateMeta(
+        font_color="black",
+        template=b"",
+        name_font_style=b"",
+        template_height=100,
+        template_digest="template",
+        name_font_digest="font",
+    )
+    keys = [
+        services.RenderResultCache.make_key(
+            certificate_meta,
+            models.CertificateRecipient(
+                recipient_name=name, text_position=(100, 50), text_size=12
+            ),
+        )
+        for name in ("Alice", "Bob", "Carol")
+    ]
+    cache = services.RenderResultCache(max_entries=2, ttl=10.0)
+
+    assert len(set(keys)) == 3
+    cache.put(keys[0], ("url-0", "id-0"))
+    cache.put(keys[1], ("url-1", "id-1"))
+    assert cache.get(keys[0]) == ("url-0", "id-0")
+
+    cache.put(keys[2], ("url-2", "id-2"))
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) == ("url-2", "id-2")
+
+    now = 10.0
+    assert cache.get(keys[0]) is None
+    assert cache.stats() == {"size": 1, "max_entries": 2, "hits": 2, "misses": 2}
+
+    certificate_meta.template_digest = None
+    assert (
+        services.RenderResultCache.make_key(
+            certificate_meta,
+            models.CertificateRecipient(
+                recipient_name="Alice", text_position=(100, 50), text_size=12
+            ),
+        )
+        is None
+    )
+
+
+def test_request_coalescer_shares_in_flight_and_replays_results():
+    calls = 0
+
+    async def main():
+        coalescer = services.RequestCoalescer(max_entries=2, ttl=60.0)
+        release = asyncio.Event()
+
+        async def generate() -> list[str]:
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return [f"cert-{calls}"]
+
+        first = asyncio.create_task(coalescer.run("body:a", "a", generate))
+        second = asyncio.create_task(coalescer.run("body:a", "a", generate))
+        await asyncio.sleep(0)
+        release.set()
+        shared = await asyncio.gather(first, second)
+
+        # Without an idempotency key, only in-flight requests are shared.
+        again = await coalescer.run("body:a", "a", generate)
+
+        remembered = await coalescer.run("key:k", "a", generate, remember=True)
+        replayed = await coalescer.run("key:k", "a", generate, remember=True)
+
+        with pytest.raises(services.IdempotencyKeyConflictError):
+            await coalescer.run("key:k", "b", generate, remember=True)
+
+        return shared, again, remembered, replayed, coalescer.stats()
+
+    shared, again, remembered, replayed, stats = asyncio.run(main())
+
+    assert shared == [["cert-1"], ["cert-1"]]
+    assert again == ["cert-2"]
+    assert remembered == replayed == ["cert-3"]
+    assert calls == 3
+    assert stats == {
+        "in_flight": 0,
+        "size": 1,
+        "max_entries": 2,
+        "coalesced": 1,
+        "replayed": 1,
+    }
+
+
+@pytest.mark.parametrize("store_type", ["memory", "sqlite"])
+def test_certificate_job_runner_runs_and_cancels_jobs(store_type: str, tmp_path):
+    async def main():
+        store: services.JobStore = (
+            services.InMemoryJobStore()
+            if store_type == "memory"
+            else services.SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+        )
+        runner = services.CertificateJobRunner(store, max_queue_size=1)
+        runner.start()
+        blocked = asyncio.Event()
+
+        async def generate(job: models.CertificateJob) -> None:
+            job.results[0] = {"recipient_name": "Recipient 0"}
+            job.completed += 1
+            await runner.save_progress(job)
+
+        async def block(_: models.CertificateJob) -> None:
+            blocked.set()
+            await asyncio.Event().wait()
+
+        done = models.CertificateJob(job_id="done", total=1)
+        running = models.CertificateJob(job_id="running", total=1)
+        queued = models.CertificateJob(job_id="queued", total=1)
+        await runner.submit(done, generate)
+
+        while (job := await store.get("done")) is None or not job.status.is_finished:
+            await asyncio.sleep(0)
+
+        await runner.submit(running, block)
+        await blocked.wait()
+        # The worker may pick this one up once "running" is cancelled, so it must
+        # not finish before it's cancelled too.
+        await runner.submit(queued, block)
+
+        with pytest.raises(services.JobQueueFullError):
+            await runner.submit(models.CertificateJob(job_id="full", total=1), block)
+
+        cancelled = [await runner.cancel("running"), await runner.cancel("queued")]
+        finished = await store.get("done")
+        await runner.stop()
+        return finished, cancelled
+
+    finished, cancelled = asyncio.run(main())
+
+    assert finished is not None
+    assert finished.status == models.JobStatus.SUCCEEDED
+    assert finished.completed == 1
+    assert finished.results == [{"recipient_name": "Recipient 0"}]
+    assert [job.status for job in cancelled if job] == [
+        models.JobStatus.CANCELLED,
+        models.JobStatus.CANCELLED,
+    ]
+
+
+@pytest.mark.parametrize("progress_interval, saves", [(60.0, 3), (0.0, 13)])
+def test_certificate_job_runner_throttles_progress_saves(
+    progress_interval: float, saves: int
+):
+    class CountingJobStore(services.InMemoryJobStore):
+        saves = 0
+
+        async def save(self, job: models.CertificateJob) -> None:
+            self.saves += 1
+            await super().save(job)
+
+    async def main():
+        store = CountingJobStore()
+        runner = services.CertificateJobRunner(
+            store, progress_interval=progress_interval
+        )
+        runner.start()
+
+        async def generate(job: models.CertificateJob) -> None:
+            for index in range(job.total):
+                job.results[index] = {"recipient_name": f"Recipient {index}"}
+                job.completed += 1
+                await runner.save_progress(job)
+
+        await runner.submit(models.CertificateJob(job_id="job", total=10), generate)
+
+        while (job := await store.get("job")) is None or not job.status.is_finished:
+            await asyncio.sleep(0)
+
+        await runner.stop()
+        return store.saves, job
+
+    store_saves, job = asyncio.run(main())
+
+    # Queued, running and succeeded are always saved.
+    assert store_saves == saves
+    assert job.completed == 10
+    assert job.status == models.JobStatus.SUCCEEDED
+
+
+def test_sqlite_job_store_only_fails_jobs_of_dead_workers(tmp_path):
+    with subprocess.Popen([sys.executable, "-c", ""]) as process:
+        dead_pid = process.pid
+
+    owners = {
+        "dead": (socket.gethostname(), dead_pid),
+        # A restarted worker can get the ID of the process it replaces.
+        "restarted": (socket.gethostname(), os.getpid()),
+        "sibling": (socket.gethostname(), os.getppid()),
+        "remote": ("another-host", dead_pid),
+    }
+
+    async def main():
+        store = services.SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+
+        for job_id, (host, pid) in owners.items():
+            await store.save(models.CertificateJob(job_id=job_id, total=1))
+            store._execute(  # pylint: disable=W0212
+                "UPDATE certificate_jobs SET owner_host = ?, owner_pid = ? "
+                "WHERE job_id = ?",
+                (host, pid, job_id),
+            )
+
+        await store.fail_unfinished()
+        jobs = {job_id: await store.get(job_id) for job_id in owners}
+        await store.close()
+        return jobs
+
+    jobs = asyncio.run(main())
+
+    assert {job_id: job.status for job_id, job in jobs.items() if job} == {
+        "dead": models.JobStatus.FAILED,
+        "restarted": models.JobStatus.FAILED,
+        "sibling": models.JobStatus.QUEUED,
+        "remote": models.JobStatus.QUEUED,
+    }
+
+
+def _write_service_account(tmp_path, token_uri: str) -> str:
+    # pylint: disable=import-outside-toplevel
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    path = tmp_path / "service-account.json"
+    path.write_text(
+        json.dumps(
+            {
+                "type": "service_account",
+                "client_email": "certinize@example.iam.gserviceaccount.com",
+                "private_key_id": "test",
+                "private_key": key.private_bytes(
+                    serialization.Encoding.PEM,
+                    serialization.PrivateFormat.PKCS8,
+                    serialization.NoEncryption(),
+                ).decode(),
+                "token_uri": token_uri,
+            }
+        )
+    )
+    return str(path)
+
+
+def test_gdrive_client_talks_to_the_drive_api(tmp_path):
+    drive_files: dict[str, dict] = {}
+    deleted: dict[str, dict] = {}
+    tokens_issued = 0
+    rejected_first_request = False
+
+    async def token(_: web.Request) -> web.Response:
+        nonlocal tokens_issued
+        tokens_issued += 1
+        return web.json_response(
+            {"access_token": f"token-{tokens_issued}", "expires_in": 3600}
+        )
+
+    def authorize(request: web.Request) -> None:
+        nonlocal rejected_first_request
+
+        if not rejected_first_request:
+            rejected_first_request = True
+            raise web.HTTPUnauthorized()
+
+        assert request.headers["Authorization"] == f"Bearer token-{tokens_issued}"
+
+    def create(metadata: dict, content: bytes = b"") -> web.Response:
+        file_id = f"file-{len(drive_files)}"
+        drive_files[file_id] = metadata | {"id": file_id, "content": content}
+        return web.json_response({"id": file_id, "name": metadata["name"]})
+
+    async def create_folder(request: web.Request) -> web.Response:
+        authorize(request)
+        return create(await request.json())
+
+    async def upload(request: web.Request) -> web.Response:
+        authorize(request)
+
+        if request.query["uploadType"] == "resumable":
+            metadata = await request.json()
+            uploads[metadata["name"]] = (metadata, bytearray())
+            return web.Response(
+                headers={"Location": f"{base_url}/resumable/{metadata['name']}"}
+            )
+
+        reader = await request.multipart()
+        metadata = await (await reader.next()).json()  # type: ignore
+        return create(metadata, await (await reader.next()).read())  # type: ignore
+
+    async def upload_chunk(request: web.Request) -> web.Response:
+        authorize(request)
+        metadata, content = uploads[request.match_info["name"]]
+        content.extend(await request.read())
+        total = int(request.headers["Content-Range"].rpartition("/")[2])
+
+        if len(content) < total:
+            return web.Response(
+                status=308, headers={"Range": f"bytes=0-{len(content) - 1}"}
+            )
+
+        return create(metadata, bytes(content))
+
+    async def share(request: web.Request) -> web.Response:
+        authorize(request)
+        drive_files[request.match_info["id"]]["shared"] = True
+        return web.json_response({"id": "anyoneWithLink"})
+
+    async def list_files(request: web.Request) -> web.Response:
+        authorize(request)
+        start = int(request.query.get("pageToken", 0))
+        page = [{"id": file_id} for file_id in sorted(drive_files)][start : start + 2]
+
+        if start + 2 < len(drive_files):
+            return web.json_response({"files": page, "nextPageToken": str(start + 2)})
+
+        return web.json_response({"files": page})
+
+    async def delete(request: web.Request) -> web.Response:
+        authorize(request)
+        file_id = request.match_info["id"]
+        deleted[file_id] = drive_files.pop(file_id)
+        return web.Response(status=204)
+
+    uploads: dict[str, tuple[dict, bytearray]] = {}
+    reported: dict[int, tuple[str, str]] = {}
+    base_url = ""
+
+    async def main():
+        nonlocal base_url
+        app = web.Application()
+        app.router.add_post("/token", token)
+        app.router.add_post("/drive/v3/files", create_folder)
+        app.router.add_get("/drive/v3/files", list_files)
+        app.router.add_post("/drive/v3/files/{id}/permissions", share)
+        app.router.add_delete("/drive/v3/files/{id}", delete)
+        app.router.add_post("/upload/drive/v3/files", upload)
+        app.router.add_put("/resumable/{name}", upload_chunk)
+        runner, base_url = await _serve(app)
+        client = services.GoogleDriveClient(
+            _write_service_account(tmp_path, f"{base_url}/token"),
+            api_url=f"{base_url}/drive/v3",
+            upload_api_url=f"{base_url}/upload/drive/v3",
+        )
+        client.resumable_upload_threshold = 8
+        client.resumable_chunk_size = 4
+
+        async def files_():
+            yield 0, (b"small", "small.jpg")
+            yield 1, (io.BytesIO(b"0123456789"), "large.jpg")
+
+        async def on_uploaded(index: int, response: tuple[str, str]) -> None:
+            reported[index] = response
+
+        try:
+            folder = await client.create_folder("certificates", share=True)
+            uploaded = await client.upload_files_as_ready(
+                files_(),
+                folder_id=folder["id"],
+                share=False,
+                on_uploaded=on_uploaded,
+            )
+            listed = await client.get_all_files()
+            await client.delete_all_files()
+        finally:
+            await client.session.close()
+            await runner.cleanup()
+
+        return folder, uploaded, listed
+
+    folder, uploaded, listed = asyncio.run(main())
+
+    assert tokens_issued == 2
+    assert folder == {"id": "file-0", "name": "certificates"}
+    assert [file_id for _, file_id in uploaded] == ["file-1", "file-2"]
+    assert reported == dict(enumerate(uploaded))
+    assert uploaded[0][0] == services.drive_download_link("file-1")
+    assert [file["id"] for file in listed] == ["file-0", "file-1", "file-2"]
+    assert not drive_files
+    assert deleted["file-0"]["shared"]
+    assert deleted["file-1"]["content"] == b"small"
+    assert deleted["file-2"]["content"] == b"0123456789"
+    assert not any("shared" in deleted[file_id] for file_id in ("file-1", "file-2"))
+
+
+def test_gdrive_client_retries_uploads_without_duplicating_files(tmp_path, monkeypatch):
+    drive_files: dict[str, dict] = {}
+    creates = shares = 0
+
+    async def token(_: web.Request) -> web.Response:
+        return web.json_response({"access_token": "token", "expires_in": 3600})
+
+    async def upload(request: web.Request) -> web.Response:
+        nonlocal creates
+        creates += 1
+        reader = await request.multipart()
+        metadata = await (await reader.next()).json()  # type: ignore
+        drive_files[f"file-{creates}"] = metadata
+
+        # The file is created, but the response is lost.
+        if creates == 1:
+            return web.Response(status=503)
+
+        return web.json_response({"id": f"file-{creates}"})
+
+    async def list_files(request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "files": [
+                    {"id": file_id}
+                    for file_id, metadata in drive_files.items()
+                    if f"name = '{metadata['name']}'" in request.query["q"]
+                    and f"'{metadata['parents'][0]}' in parents" in request.query["q"]
+                ]
+            }
+        )
+
+    async def share(_: web.Request) -> web.Response:
+        nonlocal shares
+        shares += 1
+        return web.Response(status=503 if shares == 1 else 200)
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/token", token)
+        app.router.add_get("/drive/v3/files", list_files)
+        app.router.add_post("/drive/v3/files/{id}/permissions", share)
+        app.router.add_post("/upload/drive/v3/files", upload)
+        runner, base_url = await _serve(app)
+        client = services.GoogleDriveClient(
+            _write_service_account(tmp_path, f"{base_url}/token"),
+            api_url=f"{base_url}/drive/v3",
+            upload_api_url=f"{base_url}/upload/drive/v3",
+        )
+
+        try:
+            return await client.upload_file(
+                b"certificate", "cert.png", folder_id="folder", share=True
+            )
+        finally:
+            await client.session.close()
+            await runner.cleanup()
+
+    monkeypatch.setattr(services.jobs.random, "uniform", lambda *_: 0)
+    _, file_id = asyncio.run(main())
+
+    assert file_id == "file-1"
+    assert creates == 1
+    assert shares == 2
+
+
+def test_gdrive_client_deletes_folders_by_id_concurrently(tmp_path):
+    children = {f"cert-{i}" for i in range(5)}
+    queries: list[str] = []
+    deleted: list[str] = []
+    in_flight = max_in_flight = 0
+
+    async def token(_: web.Request) -> web.Response:
+        return web.json_response({"access_token": "token", "expires_in": 3600})
+
+    async def list_files(request: web.Request) -> web.Response:
+        queries.append(request.query["q"])
+        return web.json_response({"files": [{"id": file_id} for file_id in children]})
+
+    async def delete(request: web.Request) -> web.Response:
+        nonlocal in_flight, max_in_flight
+        file_id = request.match_info["id"]
+
+        if file_id == "cert-0":
+            # Already removed, e.g. along with its folder.
+            return web.Response(status=404)
+
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        deleted.append(file_id)
+        return web.Response(status=204)
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/token", token)
+        app.router.add_get("/drive/v3/files", list_files)
+        app.router.add_delete("/drive/v3/files/{id}", delete)
+        runner, base_url = await _serve(app)
+        client = services.GoogleDriveClient(
+            _write_service_account(tmp_path, f"{base_url}/token"),
+            max_concurrent_deletes=2,
+            api_url=f"{base_url}/drive/v3",
+        )
+
+        try:
+            await client.delete_folder("folder")
+        finally:
+            await client.session.close()
+            await runner.cleanup()
+
+    asyncio.run(main())
+
+    assert queries == ["'folder' in parents and trashed=false"]
+    assert sorted(deleted[:-1]) == sorted(children - {"cert-0"})
+    assert deleted[-1] == "folder"
+    assert max_in_flight == 2
+
+
+class _FakeMultipartS3Client:
+    def __init__(self, fail_part: int | None = None) -> None:
+        self.fail_part = fail_part
+        self.exceptions = types.SimpleNamespace(
+            NoSuchBucket=LookupError, ClientError=exceptions.ClientError
+        )
+        self.objects: dict[str, bytes] = {}
+        self.metadata: dict[str, dict[str, str]] = {}
+        self.parts: dict[int, bytes] = {}
+        self.aborted = False
+        self.in_flight = self.max_in_flight = 0
+
+    async def put_object(self, Bucket: str, Key: str, Body: bytes, Metadata=None):
+        # pylint: disable=invalid-name,unused-argument
+        self.objects[Key] = Body
+        self.metadata[Key] = Metadata or {}
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    async def create_multipart_upload(self, Bucket: str, Key: str, Metadata=None):
+        # pylint: disable=invalid-name,unused-argument
+        self.metadata[Key] = Metadata or {}
+        return {"UploadId": "upload"}
+
+    async def copy_object(self, Bucket: str, Key: str, CopySource: dict[str, str]):
+        # pylint: disable=invalid-name,unused-argument
+        self.objects[Key] = self.objects[CopySource["Key"]]
+        self.metadata[Key] = self.metadata[CopySource["Key"]]
+        return {"CopyObjectResult": {"ETag": '"etag"'}}
+
+    async def upload_part(self, PartNumber: int, Body: bytes, **_):
+        # pylint: disable=invalid-name
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+
+        if PartNumber == self.fail_part:
+            raise RuntimeError("part failed")
+
+        self.parts[PartNumber] = Body
+        return {"ETag": f'"{PartNumber}"'}
+
+    async def complete_multipart_upload(self, Key: str, MultipartUpload, **_):
+        # pylint: disable=invalid-name
+        self.objects[Key] = b"".join(
+            self.parts[part["PartNumber"]] for part in MultipartUpload["Parts"]
+        )
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    async def abort_multipart_upload(self, **_):
+        self.aborted = True
+
+    async def generate_presigned_post(self, Bucket: str, Key: str, **_):
+        # pylint: disable=invalid-name
+        return {"url": f"https://{Bucket}.example.com", "fields": {"key": Key}}
+
+    async def head_object(self, Bucket: str, Key: str):
+        # pylint: disable=invalid-name,unused-argument
+        if Key not in self.objects:
+            raise exceptions.ClientError({"Error": {"Code": "404"}}, "HeadObject")
+
+        return {
+            "ContentLength": len(self.objects[Key]),
+            "ETag": '"etag"',
+            "Metadata": self.metadata.get(Key, {}),
+        }
+
+
+class _ChunkedReader:  # pylint: disable=too-few-public-methods
+    """Returns at most 3 bytes per read, like a socket would."""
+
+    def __init__(self, data: bytes) -> None:
+        self.stream = io.BytesIO(data)
+
+    async def read(self, size: int = -1) -> bytes:
+        return self.stream.read(min(size, 3))
+
+
+def test_s3_client_streams_large_objects_in_parts():
+    client = _FakeMultipartS3Client()
+
+    async def main():
+        for key, data in (("small", b"tiny"), ("large", b"0123456789" * 5)):
+            await services.S3Client.upload_fileobj(
+                client,  # type: ignore
+                "media",
+                key,
+                _ChunkedReader(data),
+                part_size=8,
+                max_concurrency=2,
+            )
+
+    asyncio.run(main())
+
+    assert client.objects == {"small": b"tiny", "large": b"0123456789" * 5}
+    assert sorted(client.parts) == list(range(1, 8))
+    assert all(len(client.parts[number]) == 8 for number in range(1, 7))
+    assert client.max_in_flight == 2
+
+
+def test_s3_client_aborts_failed_multipart_uploads():
+    client = _FakeMultipartS3Client(fail_part=2)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(
+            services.S3Client.upload_fileobj(
+                client,  # type: ignore
+                "media",
+                "large",
+                _ChunkedReader(b"x" * 64),
+                part_size=8,
+            )
+        )
+
+    assert client.aborted
+    assert "large" not in client.objects
+
+
+def test_nft_storage_client_streams_files_in_batches():
+    requests: list[dict[str, bytes]] = []
+
+    async def upload(request: web.Request) -> web.Response:
+        assert request.headers["Authorization"] == "Bearer key"
+        files_: dict[str, bytes] = {}
+
+        async for part in await request.multipart():
+            files_[part.filename] = await part.read()  # type: ignore
+
+        requests.append(files_)
+        return web.json_response({"ok": True, "value": {"cid": str(len(requests))}})
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/upload", upload)
+        runner, base_url = await _serve(app)
+        client = services.NftStorageClient(base_url, "key", max_request_bytes=13)
+        client.chunk_size = 4
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                return await client.upload_files(
+                    session,
+                    {
+                        "a.png": ("image/png", _ChunkedReader(b"a" * 10)),
+                        "b.png": ("image/png", b"b" * 3),
+                        "c.png": ("image/png", _ChunkedReader(b"c" * 7)),
+                        "d.png": ("image/png", _ChunkedReader(b"d" * 2)),
+                    },
+                    sizes={"a.png": 10, "c.png": 7},
+                )
+        finally:
+            await runner.cleanup()
+
+    responses = asyncio.run(main())
+
+    assert [response["value"]["cid"] for response in responses] == ["1", "2", "3"]
+    # d.png's size isn't known, so it isn't added to a request with other files.
+    assert requests == [
+        {"a.png": b"a" * 10, "b.png": b"b" * 3},
+        {"c.png": b"c" * 7},
+        {"d.png": b"d" * 2},
+    ]
+
+
+def test_imagekit_client_streams_binary_templates():
+    uploads: list[dict[str, tuple[str | None, bytes]]] = []
+    png = b"\x89PNG\r\n\x1a\n" + b"p" * 100
+
+    async def upload(request: web.Request) -> web.Response:
+        fields: dict[str, tuple[str | None, bytes]] = {}
+
+        async for part in await request.multipart():
+            fields[part.name] = (  # type: ignore
+                part.headers.get("Content-Type"),  # type: ignore
+                await part.read(),  # type: ignore
+            )
+
+        uploads.append(fields)
+        return web.json_response({"fileId": str(len(uploads))})
+
+    async def chunks():
+        for start in range(0, len(png), 16):
+            yield png[start : start + 16]
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/api/v1/files/upload", upload)
+        runner, base_url = await _serve(app)
+        client = services.ImageKitClient("private", "public", "", base_url)
+
+        try:
+            return await client.upload_file(
+                chunks(), "a.png", {"folder": "templates"}, content_type="image/png"
+            )
+        finally:
+            await client.session.close()
+            await runner.cleanup()
+
+    assert asyncio.run(main()) == {"fileId": "1"}
+    assert uploads[0]["file"] == ("image/png", png)
+    assert uploads[0]["fileName"][1] == b"a.png"
+    assert uploads[0]["folder"][1] == b"templates"
+    assert models.sniff_image_type(png[: models.IMAGE_HEADER_SIZE]) == "image/png"
+    assert models.sniff_image_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert models.sniff_image_type(b"<svg") is None
+
+    with pytest.raises(pydantic.ValidationError):
+        models.TemplateUpload(filename="a.txt", options={}, fileb="aGVsbG8gd29ybGQ=")
+
+
+def _storage_backend(
+    name: str, client: _FakeMultipartS3Client, quota_bytes: int | None = None
+) -> services.StorageBackend:
+    return services.StorageBackend(
+        name=name,
+        network="IPFS",
+        session=services.S3ClientSession(
+            bucket_name="bucket",
+            exit_stack=contextlib.AsyncExitStack(),
+            s3client=client,  # type: ignore
+            max_concurrency=2,
+        ),
+        quota_bytes=quota_bytes,
+    )
+
+
+def test_storage_router_spreads_writes_and_respects_quotas():
+    filebase, storj = _FakeMultipartS3Client(), _FakeMultipartS3Client()
+    router = services.StorageRouter(
+        [_storage_backend("filebase", filebase), _storage_backend("storj", storj, 4)]
+    )
+
+    results = asyncio.run(
+        router.put_objects((f"{i}.json", b"{}", None) for i in range(6))
+    )
+
+    assert all(backend is not None for backend, _ in results)
+    # Storj only has room for two objects; Filebase takes the rest.
+    assert len(storj.objects) == 2
+    assert len(filebase.objects) == 4
+
+
+def test_storage_router_reserves_quota_before_uploading():
+    storj = _FakeMultipartS3Client()
+    put_object = storj.put_object
+
+    async def slow_put_object(**kwargs):
+        await asyncio.sleep(0.01)
+
+        if kwargs["Key"] == "fail.json":
+            raise RuntimeError("service unavailable")
+
+        return await put_object(**kwargs)
+
+    storj.put_object = slow_put_object  # type: ignore
+    backend = _storage_backend("storj", storj, 4)
+    router = services.StorageRouter([backend], failure_cooldown=0)
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await router.put_object("fail.json", b"{}")
+
+        return await router.put_objects((f"{i}.json", b"{}", None) for i in range(6))
+
+    results = asyncio.run(main())
+
+    # The uploads run concurrently, but only two fit in the quota.
+    assert len(storj.objects) == 2
+    assert sum(backend is None for backend, _ in results) == 4
+    assert backend.bytes_written == 4
+    assert backend.bytes_reserved == 0
+
+
+def test_storage_router_fails_over_to_the_next_backend():
+    filebase, storj = _FakeMultipartS3Client(), _FakeMultipartS3Client()
+
+    async def unavailable(**_):
+        raise RuntimeError("service unavailable")
+
+    filebase.put_object = unavailable  # type: ignore
+    router = services.StorageRouter(
+        [_storage_backend("filebase", filebase), _storage_backend("storj", storj)]
+    )
+
+    async def main():
+        first = await router.put_object("0.json", b"{}")
+        # Filebase is now skipped instead of being tried first again.
+        second = router.candidates()
+        return first, second
+
+    (backend, _), candidates = asyncio.run(main())
+
+    assert backend.name == "storj"
+    assert [candidate.name for candidate in candidates] == ["storj"]
+    assert storj.objects == {"0.json": b"{}"}
+
+
+def test_storage_router_presigns_and_verifies_direct_uploads():
+    storj = _FakeMultipartS3Client()
+    router = services.StorageRouter([_storage_backend("storj", storj)])
+
+    async def main():
+        backend, presigned = await router.presign_posts(["0.png", "1.png"])
+        # The client uploads only the first object.
+        storj.objects["0.png"] = b"image"
+        heads = await router.verify_objects(backend, ["0.png", "1.png"])
+        # A retried completion sees the same objects without counting them again.
+        await router.verify_objects(backend, ["0.png", "1.png"])
+        # The second object arrives later.
+        storj.objects["1.png"] = b"picture"
+        await router.verify_objects(backend, ["0.png", "1.png"])
+        return backend, presigned, heads
+
+    backend, presigned, heads = asyncio.run(main())
+
+    assert [post["fields"]["key"] for post in presigned] == ["0.png", "1.png"]
+    assert heads[0] is not None and heads[0]["ContentLength"] == 5
+    assert heads[1] is None
+    assert backend.bytes_written == 12
+    assert not backend.presigned_keys
+
+
+@pytest.mark.parametrize("index_type", ["memory", "sqlite"])
+def test_storage_router_skips_uploading_stored_content(index_type: str, tmp_path):
+    storj = _FakeMultipartS3Client()
+    content_index: services.ContentIndex = (
+        services.InMemoryContentIndex()
+        if index_type == "memory"
+        else services.SQLiteContentIndex(str(tmp_path / "index.sqlite3"))
+    )
+    router = services.StorageRouter(
+        [_storage_backend("storj", storj)], content_index=content_index
+    )
+
+    storj_put_object = storj.put_object
+    puts: list[str] = []
+
+    async def put_object(**kwargs):
+        puts.append(kwargs["Key"])
+        return await storj_put_object(**kwargs)
+
+    storj.put_object = put_object  # type: ignore
+
+    async def main():
+        await router.put_object("a.json", b'{"name": "a"}')
+        # The same bytes under the same key aren't uploaded again.
+        _, unchanged = await router.put_object("a.json", b'{"name": "a"}')
+        # Under another key, they are copied inside the bucket.
+        _, copied = await router.put_object("b.json", b'{"name": "a"}')
+        # An entry whose object was overwritten is dropped and the content is
+        # uploaded again.
+        await router.put_object("a.json", b'{"name": "b"}')
+        _, reuploaded = await router.put_object("c.json", b'{"name": "a"}')
+        await content_index.close()
+        return unchanged, copied, reuploaded
+
+    unchanged, copied, reuploaded = asyncio.run(main())
+
+    assert unchanged["Key"] == "a.json" and unchanged["Deduplicated"]
+    assert copied["Key"] == "b.json" and copied["Deduplicated"]
+    assert "Deduplicated" not in reuploaded
+    assert puts == ["a.json", "a.json", "c.json"]
+    assert storj.objects == {
+        "a.json": b'{"name": "b"}',
+        "b.json": b'{"name": "a"}',
+        "c.json": b'{"name": "a"}',
+    }
@@ -1,7 +0,0 @@
-"""
-This type stub file was generated by pyright.
-"""
-
-from pydrive2.fs.spec import GDriveFileSystem
-
-__all__ = ["GDriveFileSystem"]
@@ -1,4 +0,0 @@
-"""
-This type stub file was generated by pyright.
-"""
-